@@ -0,0 +1,275 @@
+# Description: This program steps a whole batch of Kuba games at once with NumPy. Each
+#               board is stored in the 9x9 tray-border layout GameBoard uses, so results
+#               match GameBoard.push_marble and KubaGame.check_for_winner board for board.
+import numpy as np
+
+from KubaGame import GameBoard, DIRECTIONS
+
+# tile codes of the int8 board array
+EMPTY = 0
+WHITE = 1
+BLACK = 2
+RED = 3
+TRAY = -1
+_CODES = {'X': EMPTY, 'W': WHITE, 'B': BLACK, 'R': RED, '-': TRAY, '|': TRAY}
+_TILES = {EMPTY: 'X', WHITE: 'W', BLACK: 'B', RED: 'R'}
+
+# direction index (position in DIRECTIONS) -> row and col offset of one push step
+_ROW_STEPS = np.array([-1, 1, 0, 0], dtype=np.int64)
+_COL_STEPS = np.array([0, 0, -1, 1], dtype=np.int64)
+_LINE = np.arange(9)
+
+
+def encode_board(board):
+    """
+    Converts a list of lists board (as returned by GameBoard.get_board) to a 9x9 int8 array
+    Parameters: game board (list of lists)
+    Returns: numpy array of tile codes
+    """
+    return np.array([[_CODES[tile] for tile in row] for row in board], dtype=np.int8)
+
+
+def decode_board(array):
+    """
+    Converts a 9x9 int8 array back to the list of lists layout GameBoard uses
+    Parameters: numpy array of tile codes
+    Returns: game board (list of lists)
+    """
+    board = []
+    for row in range(9):
+        tiles = []
+        for col in range(9):
+            code = int(array[row, col])
+            if code == TRAY:
+                tiles.append('-' if row in (0, 8) else '|')
+            else:
+                tiles.append(_TILES[code])
+        board.append(tiles)
+    return board
+
+
+def push_boards(boards, positions, directions):
+    """
+    Pushes one marble on every board of an array of boards, in place, exactly like
+        GameBoard.push_marble: a marble pushed off the board is left in the tray.
+    Parameters: (N, 9, 9) int8 boards, (N, 2) board positions (1-7, tray excluded),
+        (N,) direction indexes into DIRECTIONS
+    Returns: (N,) int8 array of the marble pushed into the tray (EMPTY if none)
+    """
+    count = boards.shape[0]
+    batch = np.arange(count)
+    directions = np.asarray(directions)
+
+    # the nine tiles from each pushed marble towards the tray (clipped at the tray)
+    rows = np.clip(positions[:, 0:1] + _ROW_STEPS[directions][:, None] * _LINE, 0, 8)
+    cols = np.clip(positions[:, 1:2] + _COL_STEPS[directions][:, None] * _LINE, 0, 8)
+    line = boards[batch[:, None], rows, cols]
+
+    # the chain ends at the first tile without a marble (0 if there is nothing to push)
+    end = np.argmax(line <= EMPTY, axis=1)
+    moving = (_LINE[None, :] <= end[:, None]) & (end[:, None] > 0)
+
+    # every tile up to the end takes the marble behind it; the pushed tile becomes empty
+    shifted = np.empty_like(line)
+    shifted[:, 0] = EMPTY
+    shifted[:, 1:] = line[:, :-1]
+    boards[np.broadcast_to(batch[:, None], rows.shape)[moving], rows[moving], cols[moving]] = \
+        shifted[moving]
+
+    end_tile = line[batch, end]
+    pushed_off = np.where((end > 0) & (end_tile == TRAY), line[batch, end - 1], EMPTY)
+    return pushed_off.astype(np.int8)
+
+
+class BatchBoard:
+    """
+    This class holds a batch of N Kuba games as NumPy arrays and steps all of them at once.
+        Player 1 plays white and player 2 plays black in every game, as in the default
+        KubaGame setup, and players are referred to by their marble code (WHITE or BLACK).
+    Data members:
+     - boards: (N, 9, 9) int8 boards in the GameBoard tray-border layout
+     - prev: (N, 9, 9) int8 boards from the start of the last turn (repetition rule)
+     - captured: (N, 2) reds captured by white and black
+     - turn: (N,) marble code of the player to move (EMPTY before the first move)
+     - winner: (N,) marble code of the winner (EMPTY while the game is on)
+    This class communicates with the following classes:
+     - GameBoard: BatchBoard starts every board from the GameBoard starting layout.
+    """
+    def __init__(self, count):
+        """
+        Initializes a batch of games at the starting position
+        Parameters: number of games (number)
+        Returns: N/A
+        """
+        start = encode_board(GameBoard().get_board())
+        self.boards = np.repeat(start[None, :, :], count, axis=0)
+        self.prev = self.boards.copy()
+        self.captured = np.zeros((count, 2), dtype=np.int16)
+        self.turn = np.zeros(count, dtype=np.int8)
+        self.winner = np.zeros(count, dtype=np.int8)
+
+    @classmethod
+    def from_games(cls, games, players=(('White', 'W'), ('Black', 'B'))):
+        """
+        Builds a batch from KubaGame objects set up with player 1 white and player 2 black
+        Parameters: list of KubaGame objects, the (name, color) pairs the games were created with
+        Returns: BatchBoard object
+        """
+        batch = cls(len(games))
+        codes = {players[0][0]: WHITE, players[1][0]: BLACK, None: EMPTY}
+        for index, game in enumerate(games):
+            batch.boards[index] = encode_board(game.get_board())
+            batch.prev[index] = encode_board(game.get_board_prev())
+            batch.captured[index] = (game.get_captured(players[0][0]),
+                                     game.get_captured(players[1][0]))
+            batch.turn[index] = codes[game.get_current_turn()]
+            batch.winner[index] = codes[game.get_winner()]
+        return batch
+
+    def __len__(self):
+        return self.boards.shape[0]
+
+    def get_board(self, index):
+        """
+        Returns one board of the batch as a list of lists, like GameBoard.get_board
+        Parameters: index of the game (number)
+        Returns: game board (list of lists)
+        """
+        return decode_board(self.boards[index])
+
+    def get_marble_counts(self):
+        """
+        Counts the marbles on every board (the tray is not counted)
+        Parameters: N/A
+        Returns: (N, 3) array of (# white marbles, # black, # red)
+        """
+        play = self.boards[:, 1:8, 1:8]
+        return np.stack([(play == WHITE).sum(axis=(1, 2)),
+                         (play == BLACK).sum(axis=(1, 2)),
+                         (play == RED).sum(axis=(1, 2))], axis=1)
+
+    def clear_trays(self):
+        """
+        Clears the tray of every board
+        Parameters: N/A
+        Returns: N/A
+        """
+        self.boards[:, (0, 8), :] = TRAY
+        self.boards[:, :, (0, 8)] = TRAY
+
+    def push_marbles(self, positions, directions, active=None):
+        """
+        Pushes one marble per board without data validation, like GameBoard.push_marble
+        Parameters: (N, 2) board positions (1-7), (N,) direction indexes into DIRECTIONS,
+            optional (N,) bool mask of the boards to push
+        Returns: (N,) array of the marble pushed into each tray (EMPTY if none)
+        """
+        positions = np.asarray(positions)
+        directions = np.asarray(directions)
+        if active is None:
+            return push_boards(self.boards, positions, directions)
+        pushed_off = np.zeros(len(self), dtype=np.int8)
+        selected = self.boards[active]
+        pushed_off[active] = push_boards(selected, positions[active], directions[active])
+        self.boards[active] = selected
+        return pushed_off
+
+    def check_for_winners(self):
+        """
+        Updates the winner of every game the way KubaGame.check_for_winner does
+        Parameters: N/A
+        Returns: (N,) array of winners (EMPTY while the game is on)
+        """
+        counts = self.get_marble_counts()
+        self.winner[self.captured[:, 0] == 7] = WHITE
+        self.winner[self.captured[:, 1] == 7] = BLACK
+        self.winner[counts[:, 0] == 0] = BLACK
+        self.winner[counts[:, 1] == 0] = WHITE
+        return self.winner
+
+    def legal_move_masks(self, colors=None):
+        """
+        Finds every legal push on every board
+        Parameters: optional (N,) marble codes of the player to check for (the player to
+            move by default; it must be given for games that have not started)
+        Returns: (N, 7, 7, 4) bool array indexed by [game, row, col, direction], with
+            rows and cols in make_move coordinates and directions indexing DIRECTIONS
+        """
+        if colors is None:
+            colors = self.turn
+        colors = np.asarray(colors, dtype=np.int8)
+        self.check_for_winners()
+        boards = self.boards
+        play = boards[:, 1:8, 1:8]
+        occupied = play > EMPTY
+        color = colors[:, None, None]
+
+        # tiles whose push chain runs unbroken to the edge, per push direction
+        chain_to_top = np.cumprod(occupied, axis=1).astype(bool)
+        chain_to_bottom = np.flip(np.cumprod(np.flip(occupied, 1), axis=1), 1).astype(bool)
+        chain_to_left = np.cumprod(occupied, axis=2).astype(bool)
+        chain_to_right = np.flip(np.cumprod(np.flip(occupied, 2), axis=2), 2).astype(bool)
+
+        # a push needs an own marble with an empty or tray tile behind it, and may not push
+        #  an own marble off the far edge
+        masks = np.zeros(play.shape + (4,), dtype=bool)
+        own = play == color
+        # F: pushed from below, towards row 0
+        masks[..., 0] = (own & (boards[:, 2:9, 1:8] <= EMPTY)
+                         & ~(chain_to_top & (play[:, 0:1, :] == color)))
+        # B: pushed from above, towards row 8
+        masks[..., 1] = (own & (boards[:, 0:7, 1:8] <= EMPTY)
+                         & ~(chain_to_bottom & (play[:, 6:7, :] == color)))
+        # L: pushed from the right, towards col 0
+        masks[..., 2] = (own & (boards[:, 1:8, 2:9] <= EMPTY)
+                         & ~(chain_to_left & (play[:, :, 0:1] == color)))
+        # R: pushed from the left, towards col 8
+        masks[..., 3] = (own & (boards[:, 1:8, 0:7] <= EMPTY)
+                         & ~(chain_to_right & (play[:, :, 6:7] == color)))
+
+        # no moves once the game is won, or for the player who is not to move
+        masks[(self.winner != EMPTY) | ((self.turn != EMPTY) & (self.turn != colors))
+              | ((colors != WHITE) & (colors != BLACK))] = False
+
+        # repetition rule: replay the remaining candidates on copies of their boards
+        game, row, col, direction = np.nonzero(masks)
+        if game.size:
+            copies = boards[game].copy()
+            pushed_off = push_boards(copies, np.stack([row + 1, col + 1], axis=1), direction)
+            repeat = (pushed_off == EMPTY) & (copies == self.prev[game]).all(axis=(1, 2))
+            masks[game[repeat], row[repeat], col[repeat], direction[repeat]] = False
+        return masks
+
+    def make_moves(self, colors, positions, directions):
+        """
+        Validates and makes one move per game, like KubaGame.make_move on every game
+        Parameters: (N,) marble codes of the players moving, (N, 2) positions in make_move
+            coordinates (0-6), (N,) directions as indexes into DIRECTIONS or as
+            'F', 'B', 'L', 'R' strings
+        Returns: (N,) bool array, True where the move was valid and made
+        """
+        colors = np.asarray(colors, dtype=np.int8)
+        positions = np.asarray(positions, dtype=np.int64)
+        directions = np.asarray(directions)
+        if directions.dtype.kind in 'US':
+            lookup = {direction: index for index, direction in enumerate(DIRECTIONS)}
+            directions = np.array([lookup.get(direction, -1) for direction in directions])
+
+        # reject malformed input before indexing the legal move masks
+        valid = ((positions >= 0) & (positions < 7)).all(axis=1) & (directions >= 0) & \
+            (directions < 4) & ((colors == WHITE) | (colors == BLACK))
+        safe_positions = np.where(valid[:, None], positions, 0)
+        safe_directions = np.where(valid, directions, 0)
+        masks = self.legal_move_masks(colors)
+        valid &= masks[np.arange(len(self)), safe_positions[:, 0], safe_positions[:, 1],
+                       safe_directions]
+
+        # make the validated moves
+        self.prev[valid] = self.boards[valid]
+        pushed_off = self.push_marbles(safe_positions + 1, safe_directions, valid)
+        self.captured[valid & (pushed_off == RED) & (colors == WHITE), 0] += 1
+        self.captured[valid & (pushed_off == RED) & (colors == BLACK), 1] += 1
+        self.turn[valid] = np.where(colors[valid] == WHITE, BLACK, WHITE)
+        self.clear_trays()
+        self.check_for_winners()
+        return valid
@@ -0,0 +1,387 @@
+# Description: This program benchmarks the Kuba move pipeline (board pushes, counts, the
+#               move check for each rejection reason, full make_move calls, move
+#               generation and search, server session moves and snapshots, and whole-game
+#               playouts), writes the results as JSON and compares them with a stored
+#               baseline or between the board backends.
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from KubaGame import KubaGame, GameBoard, BitBoard, MOVE_VALID, GAME_OVER, BAD_POSITION, \
+    BAD_DIRECTION, NOT_YOUR_TURN, UNKNOWN_PLAYER, NOT_YOUR_MARBLE, NO_ROOM, SELF_CAPTURE, REPEAT
+from KubaPerft import perft
+from KubaServer import board_text
+
+BACKENDS = {'gameboard': GameBoard, 'bitboard': BitBoard}
+PLAYERS = (('White', 'W'), ('Black', 'B'))
+
+
+def time_per_call(function, calls, repeat):
+    """
+    Times a function that makes a number of calls, keeping the best of several runs
+    Parameters: function taking no arguments, calls the function makes per run (number),
+        number of runs (number)
+    Returns: best seconds per call (number)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / calls
+
+
+def record_game(seed, board_class, max_plies=300):
+    """
+    Plays a random game and returns its moves, so every run times the same moves
+    Parameters: random seed (number), board backend class, longest game in plies
+    Returns: list of (player name, position, direction) moves
+    """
+    rng = random.Random(seed)
+    game = KubaGame(PLAYERS[0], PLAYERS[1], board_class=board_class)
+    player_name = PLAYERS[0][0]
+    moves = []
+    while len(moves) < max_plies and game.get_winner() is None:
+        legal = game.legal_moves(player_name)
+        if not legal:
+            break
+        position, direction = legal[rng.randrange(len(legal))]
+        game.make_move(player_name, position, direction)
+        moves.append((player_name, position, direction))
+        player_name = game.get_current_turn()
+    return moves
+
+
+def bench_board(board_class, loops, repeat):
+    """
+    Microbenchmarks of push_marble, get_marble_count and clear_tray on one backend
+    Returns: dictionary of benchmark name -> seconds per call
+    """
+    board = board_class()
+
+    def push_cycle():
+        # pushing (1, 1) right and then (1, 3) left puts the board back where it started
+        for _ in range(loops):
+            board.push_marble((1, 1), 'R')
+            board.push_marble((1, 3), 'L')
+
+    def count():
+        for _ in range(loops):
+            board.get_marble_count()
+
+    def clear():
+        for _ in range(loops):
+            board.clear_tray()
+
+    return {'push_marble': time_per_call(push_cycle, 2 * loops, repeat),
+            'get_marble_count': time_per_call(count, loops, repeat),
+            'clear_tray': time_per_call(clear, loops, repeat)}
+
+
+def bench_stages(board_class, loops, repeat):
+    """
+    Times the single-pass move check (check_move) for a move rejected by each rejection
+        reason and for a legal move, so each benchmark stops at the stage that decides
+        it, and times valid_make_move (what make_move runs) for the legal move
+    Returns: dictionary of benchmark name -> seconds per call
+    """
+    white, black = PLAYERS[0][0], PLAYERS[1][0]
+    opening = KubaGame(PLAYERS[0], PLAYERS[1], board_class=board_class)
+    # after these moves White is not to move, and Black pushing (2, 6) L would recreate
+    #  the board from before White's last move
+    middle = KubaGame(PLAYERS[0], PLAYERS[1], board_class=board_class)
+    for name, position, direction in ((white, (0, 1), 'B'), (black, (0, 5), 'B'),
+                                      (white, (2, 1), 'R')):
+        middle.make_move(name, position, direction)
+    finished = KubaGame(PLAYERS[0], PLAYERS[1], board_class=board_class)
+    finished.set_winner(white)
+    cases = {GAME_OVER: (finished, white, (0, 1), 'B'),
+             BAD_POSITION: (opening, white, (9, 9), 'F'),
+             BAD_DIRECTION: (opening, white, (0, 0), 'X'),
+             NOT_YOUR_TURN: (middle, white, (1, 1), 'R'),
+             UNKNOWN_PLAYER: (opening, 'Nobody', (0, 0), 'B'),
+             NOT_YOUR_MARBLE: (opening, white, (0, 5), 'B'),
+             NO_ROOM: (opening, white, (1, 1), 'B'),
+             SELF_CAPTURE: (opening, white, (0, 1), 'L'),
+             REPEAT: (middle, black, (2, 6), 'L'),
+             MOVE_VALID: (opening, white, (0, 1), 'B')}
+
+    results = {}
+    for reason, (game, name, position, direction) in cases.items():
+        if game.check_move(name, position, direction) != reason:
+            raise RuntimeError("benchmark move is not rejected as " + reason)
+
+        def run(check=game.check_move, name=name, position=position, direction=direction):
+            for _ in range(loops):
+                check(name, position, direction)
+        results['check.' + reason] = time_per_call(run, loops, repeat)
+
+    board_pos = (1, 2)      # (0, 1) in board coordinates, the legal move above
+
+    def run_valid():
+        for _ in range(loops):
+            opening.valid_make_move(white, board_pos, 'B')
+    results['valid_make_move'] = time_per_call(run_valid, loops, repeat)
+    return results
+
+
+def bench_make_move(board_class, moves, repeat):
+    """
+    Times full make_move calls by replaying a recorded game
+    Returns: dictionary of benchmark name -> seconds per call
+    """
+    def replay():
+        game = KubaGame(PLAYERS[0], PLAYERS[1], board_class=board_class)
+        for player_name, position, direction in moves:
+            game.make_move(player_name, position, direction)
+
+    return {'make_move': time_per_call(replay, len(moves), repeat)}
+
+
+def bench_search(board_class, moves, loops, repeat):
+    """
+    Times what search code runs at every node: legal_moves and an apply_move and
+        undo_move of each legal move in a middle game position (the position after the
+        first 20 recorded moves), and perft to depth 3 from the starting position
+    Returns: dictionary of benchmark name -> seconds per call, and seconds per perft node
+    """
+    game = KubaGame(PLAYERS[0], PLAYERS[1], board_class=board_class)
+    for player_name, position, direction in moves[:20]:
+        game.make_move(player_name, position, direction)
+    player_name = game.get_current_turn()
+    legal = game.legal_moves(player_name)
+
+    def generate():
+        for _ in range(loops):
+            game.legal_moves(player_name)
+
+    def apply_undo():
+        for _ in range(loops // len(legal) + 1):
+            for position, direction in legal:
+                game.undo_move(game.apply_move(player_name, position, direction))
+
+    start = KubaGame(PLAYERS[0], PLAYERS[1], board_class=board_class)
+    nodes = perft(start, PLAYERS[0][0], 3)
+    return {'legal_moves': time_per_call(generate, loops, repeat),
+            'apply_undo': time_per_call(apply_undo, (loops // len(legal) + 1) * len(legal),
+                                        repeat),
+            'perft.per_node': time_per_call(lambda: perft(start, PLAYERS[0][0], 3), nodes,
+                                            repeat)}
+
+
+def bench_session(board_class, moves, repeat):
+    """
+    Times what a server session does per move by replaying a recorded game: make_move,
+        the next player's legal_moves (a player with none loses) and the board text of
+        the update sent to both players; and a session save and restore (to_bytes and
+        from_bytes) of the finished game
+    Returns: dictionary of benchmark name -> seconds per move, and per save and restore
+    """
+    def replay():
+        game = KubaGame(PLAYERS[0], PLAYERS[1], board_class=board_class)
+        for player_name, position, direction in moves:
+            game.make_move(player_name, position, direction)
+            if game.get_winner() is None:
+                game.legal_moves(game.get_current_turn())
+            board_text(game)
+
+    game = KubaGame(PLAYERS[0], PLAYERS[1], board_class=board_class)
+    for player_name, position, direction in moves:
+        game.make_move(player_name, position, direction)
+    snapshots = 100
+
+    def save_restore():
+        for _ in range(snapshots):
+            KubaGame.from_bytes(game.to_bytes(), PLAYERS[0], PLAYERS[1], board_class)
+
+    return {'session.move': time_per_call(replay, len(moves), repeat),
+            'session.save_restore': time_per_call(save_restore, snapshots, repeat)}
+
+
+def bench_playout(board_class, games, seed):
+    """
+    Measures whole-game random playout throughput from the starting position
+    Returns: dictionary of benchmark name -> seconds per move and per game
+    """
+    total_moves = 0
+    start = time.perf_counter()
+    for number in range(games):
+        total_moves += len(record_game(seed + number, board_class))
+    elapsed = time.perf_counter() - start
+    return {'playout.per_move': elapsed / total_moves,
+            'playout.per_game': elapsed / games}
+
+
+def bytes_per_game(board_class, games=1000, plies=0, seed=0):
+    """
+    Measures the memory a live game holds: creates a number of games, plays each one
+        a number of random moves, and divides the memory still allocated by the games
+    Parameters: board backend class, number of games, moves to play in each game, random seed
+    Returns: bytes per game (number)
+    """
+    moves = record_game(seed, board_class, plies)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = []
+        for _ in range(games):
+            game = KubaGame(PLAYERS[0], PLAYERS[1], board_class=board_class)
+            for player_name, position, direction in moves:
+                game.make_move(player_name, position, direction)
+            kept.append(game)
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    # the list holding the games is not part of a game
+    return (used - sys.getsizeof(kept)) / games
+
+
+def bench_memory(board_class, games):
+    """
+    Measures the memory of a new game and of a game 40 moves in
+    Returns: dictionary of benchmark name -> bytes per game
+    """
+    return {'memory.new_game': bytes_per_game(board_class, games, 0),
+            'memory.played_game': bytes_per_game(board_class, games, 40)}
+
+
+def run_benchmarks(quick=False, seed=0):
+    """
+    Runs the benchmark suite on every board backend
+    Parameters: True for a short run with fewer loops, random seed for the recorded games
+    Returns: results dictionary; every benchmark is measured in seconds per operation,
+        except the memory benchmarks, which are measured in bytes per game
+    """
+    loops = 2000 if quick else 20000
+    repeat = 3 if quick else 5
+    games = 5 if quick else 40
+    benchmarks = {}
+    for backend, board_class in BACKENDS.items():
+        moves = record_game(seed, board_class)
+        results = {}
+        results.update(bench_board(board_class, loops, repeat))
+        results.update(bench_stages(board_class, loops // 10, repeat))
+        results.update(bench_make_move(board_class, moves, repeat))
+        results.update(bench_search(board_class, moves, loops // 10, repeat))
+        results.update(bench_session(board_class, moves, repeat))
+        results.update(bench_playout(board_class, games, seed))
+        results.update(bench_memory(board_class, 200 if quick else 2000))
+        for name, seconds in results.items():
+            benchmarks[backend + '.' + name] = seconds
+    return {'python': platform.python_version(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'benchmarks': benchmarks}
+
+
+def metric_unit(name):
+    """
+    Returns the unit a benchmark is measured in
+    Parameters: benchmark name (string)
+    Returns: 'bytes' for the memory benchmarks, 's' (seconds) for the rest
+    """
+    return 'bytes' if name.startswith('memory.') else 's'
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares benchmark results with a baseline
+    Parameters: results dictionary, baseline results dictionary, allowed slowdown as a
+        fraction (0.1 allows each benchmark to be 10% slower than the baseline)
+    Returns: list of (benchmark name, baseline value, current value, ratio) regressions, the
+        values in the benchmark's metric_unit
+    """
+    regressions = []
+    for name, base_value in baseline['benchmarks'].items():
+        value = results['benchmarks'].get(name)
+        if value is None or base_value <= 0:
+            continue
+        ratio = value / base_value
+        if ratio > 1 + threshold:
+            regressions.append((name, base_value, value, ratio))
+    return regressions
+
+
+def speedups(results, base='gameboard', other='bitboard'):
+    """
+    Compares two board backends within one set of results
+    Parameters: results dictionary from run_benchmarks, backend name to compare against,
+        backend name to compare
+    Returns: list of (benchmark name, base value, other value, speedup) tuples, where a
+        speedup above 1 means the other backend is faster (or, for memory, smaller)
+    """
+    benchmarks = results['benchmarks']
+    rows = []
+    for name in sorted(benchmarks):
+        if not name.startswith(base + '.'):
+            continue
+        metric = name[len(base) + 1:]
+        value = benchmarks.get(other + '.' + metric)
+        if value is None or value <= 0:
+            continue
+        rows.append((metric, benchmarks[name], value, benchmarks[name] / value))
+    return rows
+
+
+def main(argv=None):
+    """
+    Command line entry point. Exits with status 1 if any benchmark regressed past the
+        threshold compared with the baseline.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the Kuba move pipeline")
+    parser.add_argument('--out', default=None, help="write results JSON to this file")
+    parser.add_argument('--baseline', default=None, help="baseline results JSON to compare with")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="allowed slowdown per benchmark as a fraction (default 0.10)")
+    parser.add_argument('--quick', action='store_true', help="fewer loops, for a fast check")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memory', action='store_true',
+                        help="only report the bytes per live game of each backend")
+    parser.add_argument('--speedup', action='store_true',
+                        help="also report how many times faster bitboard is than gameboard")
+    args = parser.parse_args(argv)
+
+    if args.memory:
+        for backend, board_class in BACKENDS.items():
+            for name, size in bench_memory(board_class, 2000).items():
+                print("%s.%s: %.0f bytes" % (backend, name, size))
+        return 0
+
+    results = run_benchmarks(args.quick, args.seed)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            out_file.write(text + '\n')
+    else:
+        print(text)
+
+    if args.speedup:
+        for name, base_value, value, speedup in speedups(results):
+            unit = metric_unit(name)
+            print("%s: gameboard %.3g %s, bitboard %.3g %s (%.2fx)"
+                  % (name, base_value, unit, value, unit, speedup))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        for name, base_value, value, ratio in regressions:
+            unit = metric_unit(name)
+            sys.stderr.write("REGRESSION %s: %.3g %s -> %.3g %s (%.2fx)\n"
+                             % (name, base_value, unit, value, unit, ratio))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
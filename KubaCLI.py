@@ -0,0 +1,158 @@
+# Description: This program is the headless command line front end for Kuba. It plays a
+#               game at the console (optionally against the computer engine) or replays
+#               a file of moves, using only the pure-Python rules engine in KubaGame.
+import argparse
+import sys
+
+from KubaGame import KubaGame, BitBoard, DIRECTIONS
+
+PLAYERS = (('White', 'W'), ('Black', 'B'))
+
+
+def parse_move(text):
+    """
+    Parses a move typed as "row col direction", e.g. "0 1 B"
+    Parameters: move text (string)
+    Returns: (position (tuple), direction (string)), or None if the text is not a move
+    """
+    parts = text.split()
+    if len(parts) != 3 or parts[2].upper() not in DIRECTIONS:
+        return None
+    try:
+        return (int(parts[0]), int(parts[1])), parts[2].upper()
+    except ValueError:
+        return None
+
+
+def print_status(game, out):
+    """
+    Prints the board and the status of the game
+    """
+    for row in game.get_board():
+        out.write("  ".join(row) + "\n")
+    out.write("Current turn: %s | Reds captured: White %d, Black %d | Winner: %s\n"
+              % (game.get_current_turn(), game.get_captured('White'),
+                 game.get_captured('Black'), game.get_winner()))
+
+
+def print_hint(game, player_name, out):
+    """
+    Prints the position analysis for a player: how many pushes each side has, the
+        player's pushes that capture, and the player's marbles the opponent can capture
+    """
+    analysis = game.get_analysis()
+    color = game.get_player(player_name).get_color()
+    other_player = game.get_other_player(player_name)
+    out.write("Pushes: %s %d, %s %d\n"
+              % (player_name, analysis.get_mobility(color), other_player.get_name(),
+                 analysis.get_mobility(other_player.get_color())))
+    for position, direction, pushed_off in analysis.get_threats(color):
+        out.write("  %d %d %s pushes off %s\n" % (position[0], position[1], direction, pushed_off))
+    exposed = analysis.get_exposed(color)
+    if exposed:
+        out.write("Exposed: %s\n" % ", ".join("%d %d" % position for position in exposed))
+
+
+def play(computer=None, think_ms=1000, read=input, out=sys.stdout):
+    """
+    Plays a game at the console. Each turn the player types "row col direction"
+        (directions F, B, L, R), "hint" or "quit".
+    Parameters: the player the computer engine plays (or None for two humans), engine
+        time budget in milliseconds, function that reads a line, output stream
+    Returns: the winner's name, or None if the game was quit
+    """
+    game = KubaGame(PLAYERS[0], PLAYERS[1], board_class=BitBoard)
+    engine = None
+    if computer is not None:
+        # only load the engine when the computer plays
+        from KubaEngine import KubaEngine
+        engine = KubaEngine()
+
+    player_name = PLAYERS[0][0]
+    while game.get_winner() is None:
+        print_status(game, out)
+        if not game.legal_moves(player_name):
+            out.write("%s has no legal moves.\n" % player_name)
+            game.set_winner(game.get_other_player(player_name).get_name())
+            break
+
+        if player_name == computer:
+            result = engine.search(game, player_name, time_ms=think_ms)
+            position, direction = result.move
+            out.write("%s plays %d %d %s (depth %d, %.0f nodes/sec)\n"
+                      % (player_name, position[0], position[1], direction,
+                         result.depth, result.get_nps()))
+        else:
+            try:
+                text = read("%s> " % player_name)
+            except EOFError:
+                return None
+            if text.strip().lower() in ('q', 'quit', 'exit'):
+                return None
+            if text.strip().lower() == 'hint':
+                print_hint(game, player_name, out)
+                continue
+            move = parse_move(text)
+            if move is None:
+                out.write("Type a move as: row col direction (e.g. 0 1 B), or hint\n")
+                continue
+            position, direction = move
+
+        if not game.make_move(player_name, position, direction):
+            out.write("Invalid move.\n")
+            continue
+        player_name = game.get_current_turn()
+
+    print_status(game, out)
+    return game.get_winner()
+
+
+def replay(lines, verbose=False, out=sys.stdout):
+    """
+    Replays a game from lines of "player row col direction" moves. Blank lines and
+        lines starting with # are skipped.
+    Parameters: iterable of lines, True to print the board after every move, output stream
+    Returns: KubaGame object after the last move
+    """
+    game = KubaGame(PLAYERS[0], PLAYERS[1], board_class=BitBoard)
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        name, _, rest = line.partition(' ')
+        move = parse_move(rest)
+        if move is None or not game.make_move(name, move[0], move[1]):
+            out.write("line %d: invalid move: %s\n" % (number, line))
+            continue
+        if verbose:
+            out.write("%s\n" % line)
+            print_status(game, out)
+    return game
+
+
+def main(argv=None):
+    """
+    Command line entry point: "play" or "replay"
+    """
+    parser = argparse.ArgumentParser(description="Headless Kuba")
+    commands = parser.add_subparsers(dest='command', required=True)
+    play_parser = commands.add_parser('play', help="play a game at the console")
+    play_parser.add_argument('--computer', choices=['White', 'Black'], default=None,
+                             help="the player the computer engine plays")
+    play_parser.add_argument('--think-ms', type=int, default=1000)
+    replay_parser = commands.add_parser('replay', help="replay a file of moves")
+    replay_parser.add_argument('path', help="moves file, one 'player row col direction' per line")
+    replay_parser.add_argument('--verbose', action='store_true', help="print every position")
+    args = parser.parse_args(argv)
+
+    if args.command == 'play':
+        play(args.computer, args.think_ms)
+    else:
+        with open(args.path) as moves_file:
+            game = replay(moves_file, args.verbose)
+        print_status(game, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,348 @@
+# Description: This program is a computer opponent for Kuba. It searches KubaGame
+#               positions with negamax alpha-beta and iterative deepening under a
+#               per-move time budget.
+import time
+
+from KubaGame import MARBLES, MOVE_VALID
+
+# scores are from the point of view of the player to move
+WIN_SCORE = 1000000
+_WIN_THRESHOLD = WIN_SCORE - 1000       # scores past this are wins/losses in N plies
+
+# transposition table entry flags
+_EXACT = 0
+_LOWER = 1
+_UPPER = 2
+
+
+def material_evaluation(game, player_name):
+    """
+    Default evaluation function: scores captured reds and marbles left on the board
+    Parameters: KubaGame object, the name of the player to score for (string)
+    Returns: score from the player's point of view (number)
+    """
+    player = game.get_player(player_name)
+    other_player = game.get_other_player(player_name)
+    counts = game.get_marble_count()
+    own_marbles = counts[MARBLES.index(player.get_color())]
+    other_marbles = counts[MARBLES.index(other_player.get_color())]
+    return (100 * (player.get_captured() - other_player.get_captured())
+            + 40 * (own_marbles - other_marbles))
+
+
+def mobility_evaluation(game, player_name):
+    """
+    Evaluation function that adds the position analysis of the game (see
+        KubaGame.get_analysis) to material_evaluation: the pushes each side can make
+        and each side's capture threats
+    Parameters: KubaGame object, the name of the player to score for (string)
+    Returns: score from the player's point of view (number)
+    """
+    analysis = game.get_analysis()
+    color = game.get_player(player_name).get_color()
+    other_color = game.get_other_player(player_name).get_color()
+    return (material_evaluation(game, player_name)
+            + 2 * (analysis.get_mobility(color) - analysis.get_mobility(other_color))
+            + 10 * (len(analysis.get_threats(color)) - len(analysis.get_threats(other_color))))
+
+
+class SearchResult:
+    """
+    This class holds the outcome of a KubaEngine search: the best move found, its
+        score, the depth reached, the principal variation and the search speed.
+    This class does not communicate with other classes.
+    """
+    def __init__(self, move, score, depth, nodes, elapsed, pv):
+        """
+        Init method for SearchResult data members
+        Parameters: best move as (position, direction) or None, score (number), depth
+            reached (number), nodes searched (number), elapsed seconds (number),
+            principal variation (list of moves)
+        Returns: N/A
+        """
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.pv = pv
+
+    def get_nps(self):
+        """
+        Returns the search speed in nodes per second
+        Parameters: N/A
+        Returns: nodes per second (number)
+        """
+        if self.elapsed <= 0:
+            return 0
+        return self.nodes / self.elapsed
+
+    def __repr__(self):
+        return ("SearchResult(move=%r, score=%r, depth=%d, nodes=%d, nps=%.0f, pv=%r)"
+                % (self.move, self.score, self.depth, self.nodes, self.get_nps(), self.pv))
+
+
+class SearchTimeout(Exception):
+    """
+    This class is raised inside KubaEngine when the search runs past its deadline.
+    It is caught by KubaEngine.search and does not leave the engine.
+    """
+    pass
+
+
+class KubaEngine:
+    """
+    This class is a computer player that chooses moves for a KubaGame player.
+    Practically, it runs negamax alpha-beta search with iterative deepening, a
+        transposition table and move ordering (transposition table move, captures,
+        killer moves, then the history heuristic). Moves are tried on the game itself
+        with KubaGame.apply_move and undo_move, so the game is left unchanged. With an
+        endgame tablebase, positions the table holds are scored exactly without search.
+    This class communicates with the following classes:
+     - KubaGame: KubaEngine uses legal_moves, apply_move, undo_move and the board hash
+            of the game it searches.
+     - Tablebase: KubaEngine probes an optional endgame tablebase (see KubaTablebase).
+     - SearchResult: KubaEngine returns a SearchResult from every search.
+    """
+    def __init__(self, evaluate=None, table_size=1000000, tablebase=None):
+        """
+        Init method for KubaEngine data members
+        Parameters: evaluation function taking (KubaGame, player name) and returning a
+            score for that player (material_evaluation by default), maximum number of
+            transposition table entries (number), optional KubaTablebase.Tablebase
+        Returns: N/A
+        """
+        if evaluate is None:
+            evaluate = material_evaluation
+        self._evaluate = evaluate
+        self._tablebase = tablebase
+        self._table_size = table_size
+        self._table = {}
+        self._killers = {}
+        self._history = {}
+        self._nodes = 0
+        self._deadline = None
+        self._stop_event = None
+
+    def clear(self):
+        """
+        Clears the transposition table and move ordering tables between games
+        Parameters: N/A
+        Returns: N/A
+        """
+        self._table = {}
+        self._killers = {}
+        self._history = {}
+
+    def search(self, game, player_name, time_ms=1000, max_depth=64, stop_event=None):
+        """
+        Finds the best move for a player with iterative deepening until the time budget
+            runs out, stop_event is set or max_depth is reached. Returns the result of the
+            deepest completed iteration.
+        Parameters: KubaGame object, name of the player to move (string), hard time
+            budget in milliseconds (number), maximum search depth in plies (number),
+            optional threading.Event that another thread sets to stop the search early
+        Returns: SearchResult object (its move is None if the player has no legal move)
+        """
+        start = time.perf_counter()
+        self._deadline = start + time_ms / 1000.0
+        self._stop_event = stop_event
+        self._nodes = 0
+        self._killers = {}
+
+        root_moves = game.legal_moves(player_name)
+        if not root_moves:
+            return SearchResult(None, -WIN_SCORE, 0, 0, time.perf_counter() - start, [])
+        result = SearchResult(root_moves[0], 0, 0, 0, 0, [root_moves[0]])
+
+        for depth in range(1, max_depth + 1):
+            try:
+                score = self._negamax(game, player_name, depth, -WIN_SCORE - 1, WIN_SCORE + 1, 0)
+            except SearchTimeout:
+                break
+            pv = self._principal_variation(game, player_name, depth)
+            result = SearchResult(pv[0] if pv else root_moves[0], score, depth, self._nodes,
+                                  time.perf_counter() - start, pv)
+            # stop early once a forced win or loss has been found
+            if abs(score) >= _WIN_THRESHOLD:
+                break
+
+        result.nodes = self._nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def _negamax(self, game, player_name, depth, alpha, beta, ply):
+        """
+        Negamax alpha-beta search of the game from the point of view of player_name
+        Parameters: KubaGame object, name of the player to move (string), depth left,
+            alpha and beta bounds, plies from the root
+        Returns: score (number)
+        """
+        # a node costs tens of microseconds (move generation and evaluation), so reading
+        #  the clock at every node costs little and keeps the search within its budget
+        self._nodes += 1
+        if time.perf_counter() >= self._deadline \
+                or (self._stop_event is not None and self._stop_event.is_set()):
+            raise SearchTimeout
+
+        winner = game.get_winner()
+        if winner is not None:
+            return WIN_SCORE - ply if winner == player_name else -WIN_SCORE + ply
+
+        if self._tablebase is not None and ply > 0:
+            probed = self._tablebase.probe(game, player_name)
+            if probed is not None:
+                result, plies = probed
+                if result == 'win':
+                    return WIN_SCORE - ply - plies
+                if result == 'loss':
+                    return -WIN_SCORE + ply + plies
+                return 0
+
+        original_alpha = alpha
+        key = self._table_key(game, player_name)
+        entry = self._table.get(key)
+        table_move = None
+        if entry is not None:
+            entry_depth, entry_score, entry_flag, table_move = entry
+            if entry_depth >= depth and ply > 0:
+                entry_score = _score_from_table(entry_score, ply)
+                if entry_flag == _EXACT:
+                    return entry_score
+                if entry_flag == _LOWER and entry_score > alpha:
+                    alpha = entry_score
+                elif entry_flag == _UPPER and entry_score < beta:
+                    beta = entry_score
+                if alpha >= beta:
+                    return entry_score
+
+        if depth == 0:
+            return self._evaluate(game, player_name)
+
+        moves = game.legal_moves(player_name)
+        if not moves:
+            # a player with no legal moves loses
+            return -WIN_SCORE + ply
+
+        other_name = game.get_other_player(player_name).get_name()
+        best_score = -WIN_SCORE - 1
+        best_move = None
+        for move in self._order_moves(game, player_name, moves, table_move, ply):
+            record = game.apply_move(player_name, move[0], move[1])
+            try:
+                score = -self._negamax(game, other_name, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                game.undo_move(record)
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                # remember quiet moves that cause cutoffs for move ordering
+                if game.get_pushed_off(move[0], move[1]) is None:
+                    killers = self._killers.setdefault(ply, [])
+                    if move not in killers:
+                        killers.insert(0, move)
+                        del killers[2:]
+                    self._history[move] = self._history.get(move, 0) + depth * depth
+                break
+
+        if best_score <= original_alpha:
+            flag = _UPPER
+        elif best_score >= beta:
+            flag = _LOWER
+        else:
+            flag = _EXACT
+        if len(self._table) >= self._table_size:
+            self._table = {}
+        self._table[key] = (depth, _score_to_table(best_score, ply), flag, best_move)
+        return best_score
+
+    def _order_moves(self, game, player_name, moves, table_move, ply):
+        """
+        Sorts moves so the most promising are searched first: the transposition table
+            move, then pushes that capture a red or an opposing marble, then killer moves,
+            then by history score
+        Parameters: KubaGame object, name of the player to move (string), list of moves,
+            transposition table move (or None), plies from the root
+        Returns: sorted list of moves
+        """
+        own_color = game.get_player(player_name).get_color()
+        killers = self._killers.get(ply, ())
+
+        def move_rank(move):
+            if move == table_move:
+                return 4000000
+            pushed_off = game.get_pushed_off(move[0], move[1])
+            if pushed_off == 'R':
+                return 3000000
+            if pushed_off is not None and pushed_off != own_color:
+                return 2000000
+            if move in killers:
+                return 1000000
+            return self._history.get(move, 0)
+
+        return sorted(moves, key=move_rank, reverse=True)
+
+    def _principal_variation(self, game, player_name, depth):
+        """
+        Follows the transposition table best moves from the current position. Past the
+            search deadline only the first move is taken.
+        Parameters: KubaGame object, name of the player to move (string), maximum length
+        Returns: list of moves
+        """
+        pv = []
+        records = []
+        seen = set()
+        while len(pv) < depth and (not pv or time.perf_counter() < self._deadline):
+            key = self._table_key(game, player_name)
+            entry = self._table.get(key)
+            if entry is None or entry[3] is None or key in seen:
+                break
+            move = entry[3]
+            if game.check_move(player_name, move[0], move[1]) != MOVE_VALID:
+                break
+            seen.add(key)
+            pv.append(move)
+            records.append(game.apply_move(player_name, move[0], move[1]))
+            player_name = game.get_other_player(player_name).get_name()
+        for record in reversed(records):
+            game.undo_move(record)
+        return pv
+
+    @staticmethod
+    def _table_key(game, player_name):
+        """
+        Returns the transposition table key of a position: the board hash, the previous
+            board hash (it decides which moves are legal), the player to move and the
+            captured reds of both players
+        """
+        other_name = game.get_other_player(player_name).get_name()
+        history = game.get_hash_history()
+        previous_hash = history[-2] if len(history) > 1 else None
+        return (history[-1], previous_hash, player_name,
+                game.get_captured(player_name), game.get_captured(other_name))
+
+
+def _score_to_table(score, ply):
+    """
+    Converts a win/loss score to be relative to the stored position
+    """
+    if score >= _WIN_THRESHOLD:
+        return score + ply
+    if score <= -_WIN_THRESHOLD:
+        return score - ply
+    return score
+
+
+def _score_from_table(score, ply):
+    """
+    Converts a stored win/loss score back to be relative to the root
+    """
+    if score >= _WIN_THRESHOLD:
+        return score - ply
+    if score <= -_WIN_THRESHOLD:
+        return score + ply
+    return score
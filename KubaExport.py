@@ -0,0 +1,420 @@
+# Description: This program exports labelled Kuba positions for training an evaluator. It
+#               plays headless games through KubaGame on a pool of worker processes and
+#               streams every position (board planes from get_board, side to move, captured
+#               reds and the final result) into memory-mapped NumPy shard files, described by
+#               a JSON manifest. The exporter holds one block of positions in memory and
+#               copies it into the current shard in one sequential write, so memory stays
+#               bounded however many positions are exported. ShardDataset reads the shards
+#               back lazily, a batch at a time.
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from KubaGame import KubaGame, BitBoard, Ruleset, STANDARD
+from KubaSelfPlay import choose_move, POLICIES, RANDOM_POLICY
+
+PLAYERS = (('White', 'W'), ('Black', 'B'))
+
+MANIFEST = 'manifest.json'
+_FORMAT_VERSION = 1
+
+# board planes, in order: one plane of 0/1 per marble color over the playing area (tray
+#  excluded), so a position's planes are a (3, size, size) uint8 array
+PLANES = ('W', 'B', 'R')
+_PLANE_CODES = np.frombuffer(''.join(PLANES).encode('ascii'), dtype=np.uint8)[:, None, None]
+
+# per-position result for the player to move
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+
+def _fields(size):
+    """
+    Returns the exported fields as (name, dtype, shape of one position) tuples:
+     - planes: board planes in PLANES order
+     - turn: side to move (0 for white, 1 for black)
+     - captured: reds captured by white and by black before the move
+     - result: final result of the game for the side to move (WIN, DRAW or LOSS)
+     - game: game number
+     - ply: ply of the position within its game
+    """
+    return (('planes', np.uint8, (len(PLANES), size, size)),
+            ('turn', np.int8, ()),
+            ('captured', np.int16, (2,)),
+            ('result', np.int8, ()),
+            ('game', np.uint32, ()),
+            ('ply', np.uint32, ()))
+
+
+def encode_planes(board):
+    """
+    Encodes a board (as returned by get_board, tray border included) as board planes
+    Parameters: game board (list of lists)
+    Returns: (3, size, size) uint8 array, one plane per marble color in PLANES order
+    """
+    size = len(board) - 2
+    tiles = ''.join(''.join(row[1:-1]) for row in board[1:-1]).encode('ascii')
+    codes = np.frombuffer(tiles, dtype=np.uint8).reshape(size, size)
+    return (codes[None, :, :] == _PLANE_CODES).view(np.uint8)
+
+
+def play_game(job):
+    """
+    Plays one game between two policies through KubaGame.make_move and encodes every
+        position a player moved from. Once the game is over, each position is labelled
+        with the result for its side to move; a game still on after the longest allowed
+        number of plies is a draw.
+    Parameters: tuple of (game number, seed, white policy, black policy, longest game in
+        plies, engine time budget in milliseconds, engine depth limit, board size of a
+        scaled ruleset (None for the standard game))
+    Returns: dictionary of field name -> array with one row per position (see _fields)
+    """
+    number, seed, white_policy, black_policy, max_plies, engine_ms, engine_depth, size = job
+    rng = random.Random(seed)
+    ruleset = STANDARD if size is None else Ruleset.scaled(size)
+    game = KubaGame(PLAYERS[0], PLAYERS[1], BitBoard, ruleset=ruleset)
+    policies = {'White': white_policy, 'Black': black_policy}
+    turns = {'White': 0, 'Black': 1}
+
+    planes = []
+    movers = []
+    captured = []
+    # alternate which player opens the game
+    player_name = PLAYERS[number % 2][0]
+    while len(movers) < max_plies and game.get_winner() is None:
+        move = choose_move(policies[player_name], game, player_name, rng, engine_ms, engine_depth)
+        if move is None:
+            # a player with no legal moves loses
+            game.set_winner(game.get_other_player(player_name).get_name())
+            break
+        planes.append(encode_planes(game.get_board()))
+        movers.append(turns[player_name])
+        captured.append((game.get_captured('White'), game.get_captured('Black')))
+        game.make_move(player_name, move[0], move[1])
+        player_name = game.get_current_turn()
+
+    count = len(movers)
+    turn = np.array(movers, dtype=np.int8)
+    winner = game.get_winner()
+    if winner is None:
+        result = np.full(count, DRAW, dtype=np.int8)
+    else:
+        result = np.where(turn == turns[winner], WIN, LOSS).astype(np.int8)
+    board_size = ruleset.get_size()
+    return {'planes': (np.stack(planes) if planes else
+                       np.zeros((0, len(PLANES), board_size, board_size), dtype=np.uint8)),
+            'turn': turn,
+            'captured': np.array(captured, dtype=np.int16).reshape(count, 2),
+            'result': result,
+            'game': np.full(count, number, dtype=np.uint32),
+            'ply': np.arange(count, dtype=np.uint32)}
+
+
+class ShardWriter:
+    """
+    This class writes positions to a directory of memory-mapped .npy shards, one file per
+        field per shard, and keeps a JSON manifest of the finished shards. Positions are
+        gathered in a block in memory and copied into the current shard a block at a time.
+        The manifest is rewritten whenever a shard is finished, so an interrupted export
+        leaves a readable dataset of the shards finished so far.
+    This class communicates with the following classes:
+     - ShardDataset: ShardDataset reads the shards and manifest a ShardWriter writes.
+    """
+    def __init__(self, directory, size=7, shard_size=1 << 18, block_size=1 << 13, meta=None):
+        """
+        Creates the dataset directory
+        Parameters: directory path, board size, positions per shard, positions held in
+            memory before a write, optional dictionary of settings to keep in the manifest
+        Returns: N/A
+        """
+        if shard_size < 1 or block_size < 1:
+            raise ValueError("shard and block sizes must be positive")
+        if os.path.exists(os.path.join(directory, MANIFEST)):
+            raise ValueError("a dataset already exists in " + directory)
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._fields = _fields(size)
+        self._shard_size = shard_size
+        self._block_size = min(block_size, shard_size)
+        self._manifest = {'version': _FORMAT_VERSION,
+                          'size': size,
+                          'planes': list(PLANES),
+                          'fields': {name: {'dtype': np.dtype(dtype).str, 'shape': list(shape)}
+                                     for name, dtype, shape in self._fields},
+                          'meta': meta or {},
+                          'positions': 0,
+                          'games': 0,
+                          'shards': []}
+        self._block = {name: np.empty((self._block_size,) + shape, dtype=dtype)
+                       for name, dtype, shape in self._fields}
+        self._block_count = 0
+        self._shard = None          # field name -> memmap of the shard being written
+        self._shard_count = 0
+        self._write_manifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_game(self, positions):
+        """
+        Adds the positions of one game
+        Parameters: dictionary of field name -> array with one row per position (as
+            returned by play_game)
+        Returns: N/A
+        """
+        count = len(positions['turn'])
+        start = 0
+        while start < count:
+            take = min(count - start, self._block_size - self._block_count)
+            for name, _, _ in self._fields:
+                self._block[name][self._block_count:self._block_count + take] = \
+                    positions[name][start:start + take]
+            self._block_count += take
+            start += take
+            if self._block_count == self._block_size:
+                self._write_block()
+        self._manifest['games'] += 1
+
+    def close(self):
+        """
+        Writes the positions still in memory, finishes the last shard and the manifest
+        Parameters: N/A
+        Returns: manifest dictionary
+        """
+        if self._block is not None:
+            self._write_block()
+            self._finish_shard()
+            self._block = None
+            self._write_manifest()
+        return self._manifest
+
+    def _write_block(self):
+        """copies the block into the current shard, splitting it across shards if needed"""
+        written = 0
+        while written < self._block_count:
+            if self._shard is None:
+                self._open_shard()
+            take = min(self._block_count - written, self._shard_size - self._shard_count)
+            for name, _, _ in self._fields:
+                self._shard[name][self._shard_count:self._shard_count + take] = \
+                    self._block[name][written:written + take]
+            self._shard_count += take
+            written += take
+            if self._shard_count == self._shard_size:
+                self._finish_shard()
+        self._block_count = 0
+
+    def _shard_path(self, index, name):
+        return os.path.join(self._directory, 'shard-%05d.%s.npy' % (index, name))
+
+    def _open_shard(self):
+        """creates the memory-mapped files of the next shard at full shard size"""
+        index = len(self._manifest['shards'])
+        self._shard = {name: open_memmap(self._shard_path(index, name), mode='w+', dtype=dtype,
+                                         shape=(self._shard_size,) + shape)
+                       for name, dtype, shape in self._fields}
+        self._shard_count = 0
+
+    def _finish_shard(self):
+        """flushes the current shard, trims a part-filled one and records it in the manifest"""
+        if self._shard is None:
+            return
+        index = len(self._manifest['shards'])
+        for name, dtype, shape in self._fields:
+            array = self._shard[name]
+            array.flush()
+            if self._shard_count < self._shard_size:
+                # a shard's file shape is its real length: copy the filled rows to a file
+                #  of that length, a block at a time
+                path = self._shard_path(index, name)
+                trimmed = open_memmap(path + '.tmp', mode='w+', dtype=dtype,
+                                      shape=(self._shard_count,) + shape)
+                for start in range(0, self._shard_count, self._block_size):
+                    stop = min(start + self._block_size, self._shard_count)
+                    trimmed[start:stop] = array[start:stop]
+                trimmed.flush()
+                del trimmed, array
+                self._shard[name] = None
+                os.replace(path + '.tmp', path)
+        self._shard = None
+        if self._shard_count:
+            self._manifest['shards'].append({'name': 'shard-%05d' % index,
+                                             'positions': self._shard_count})
+            self._manifest['positions'] += self._shard_count
+        else:
+            for name, _, _ in self._fields:
+                os.remove(self._shard_path(index, name))
+        self._shard_count = 0
+        self._write_manifest()
+
+    def _write_manifest(self):
+        """replaces the manifest file in one step, so readers never see half of it"""
+        path = os.path.join(self._directory, MANIFEST)
+        with open(path + '.tmp', 'w') as manifest_file:
+            json.dump(self._manifest, manifest_file, indent=1)
+        os.replace(path + '.tmp', path)
+
+
+class ShardDataset:
+    """
+    This class reads a dataset written by ShardWriter. Shards are opened as read-only
+        memory maps, so positions are only read from disk when they are used.
+    This class communicates with the following classes:
+     - ShardWriter: ShardDataset reads the shards and manifest a ShardWriter writes.
+    """
+    def __init__(self, directory):
+        """
+        Reads the manifest of a dataset
+        Parameters: directory path
+        Returns: N/A
+        """
+        with open(os.path.join(directory, MANIFEST)) as manifest_file:
+            self._manifest = json.load(manifest_file)
+        if self._manifest.get('version') != _FORMAT_VERSION:
+            raise ValueError("unknown dataset version: " + str(self._manifest.get('version')))
+        self._directory = directory
+
+    def __len__(self):
+        return self._manifest['positions']
+
+    def get_manifest(self):
+        """Returns the manifest dictionary"""
+        return self._manifest
+
+    def get_fields(self):
+        """Returns the names of the exported fields"""
+        return list(self._manifest['fields'])
+
+    def shards(self, fields=None):
+        """
+        Iterates over the shards without reading them
+        Parameters: optional list of field names (every field by default)
+        Returns: iterator of dictionaries of field name -> read-only memory-mapped array
+        """
+        fields = self.get_fields() if fields is None else fields
+        for shard in self._manifest['shards']:
+            yield {name: np.load(os.path.join(self._directory, '%s.%s.npy' % (shard['name'], name)),
+                                 mmap_mode='r')
+                   for name in fields}
+
+    def batches(self, batch_size, fields=None):
+        """
+        Iterates over every position in batches read from the shards as they are needed.
+            A batch can span two shards; only the last batch may be shorter.
+        Parameters: positions per batch, optional list of field names (every field by
+            default)
+        Returns: iterator of dictionaries of field name -> in-memory array
+        """
+        pending = None
+        for shard in self.shards(fields):
+            count = len(next(iter(shard.values())))
+            start = 0
+            if pending is not None:
+                start = min(count, batch_size - len(next(iter(pending.values()))))
+                pending = {name: np.concatenate((pending[name], array[:start]))
+                           for name, array in shard.items()}
+                if len(next(iter(pending.values()))) < batch_size:
+                    continue
+                yield pending
+                pending = None
+            while start + batch_size <= count:
+                yield {name: np.array(array[start:start + batch_size])
+                       for name, array in shard.items()}
+                start += batch_size
+            if start < count:
+                pending = {name: np.array(array[start:]) for name, array in shard.items()}
+        if pending is not None:
+            yield pending
+
+
+def export_games(games, directory, white_policy=RANDOM_POLICY, black_policy=RANDOM_POLICY,
+                 processes=None, seed=0, max_plies=500, engine_ms=100, engine_depth=64,
+                 size=None, shard_size=1 << 18, block_size=1 << 13, window=None, report=None):
+    """
+    Plays a number of games on a process pool and exports their positions to a dataset
+        directory. Games are written in game number order, and handed to the pool a window
+        at a time, so only that many games are ever waiting in memory.
+    Parameters: number of games, dataset directory, white and black policies, number of
+        worker processes (all cores by default), base seed (game N uses seed + N), longest
+        game in plies, engine time budget in ms, engine depth limit, board size of a
+        scaled ruleset (None for the standard game), positions per shard, positions per
+        write, number of games queued at once, optional stream to print progress to
+    Returns: summary dictionary (games, positions, shards, seconds, positions/sec)
+    """
+    for policy in (white_policy, black_policy):
+        if policy not in POLICIES:
+            raise ValueError("unknown policy: " + str(policy))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if window is None:
+        window = processes * 64
+    board_size = STANDARD.get_size() if size is None else Ruleset.scaled(size).get_size()
+    meta = {'white': white_policy, 'black': black_policy, 'seed': seed,
+            'max_plies': max_plies, 'engine_ms': engine_ms, 'engine_depth': engine_depth}
+
+    start = time.perf_counter()
+    positions = 0
+    with ShardWriter(directory, board_size, shard_size, block_size, meta) as writer, \
+            multiprocessing.Pool(processes) as pool:
+        for window_start in range(0, games, window):
+            jobs = ((number, seed + number, white_policy, black_policy, max_plies,
+                     engine_ms, engine_depth, size)
+                    for number in range(window_start, min(games, window_start + window)))
+            for game_positions in pool.imap(play_game, jobs, chunksize=4):
+                writer.add_game(game_positions)
+                positions += len(game_positions['turn'])
+            if report is not None:
+                elapsed = time.perf_counter() - start
+                report.write("%d/%d games, %d positions, %.0f positions/sec\n"
+                             % (min(games, window_start + window), games, positions,
+                                positions / elapsed))
+    manifest = writer.close()
+
+    elapsed = time.perf_counter() - start
+    return {'games': manifest['games'],
+            'positions': manifest['positions'],
+            'shards': len(manifest['shards']),
+            'seconds': elapsed,
+            'positions_per_sec': manifest['positions'] / elapsed if elapsed else 0.0}
+
+
+def main(argv=None):
+    """
+    Command line entry point for exporting training positions
+    """
+    parser = argparse.ArgumentParser(description="Export Kuba self-play positions as NumPy shards")
+    parser.add_argument('games', type=int, help="number of games to play")
+    parser.add_argument('--out', default='dataset', help="dataset directory")
+    parser.add_argument('--white', choices=POLICIES, default=RANDOM_POLICY)
+    parser.add_argument('--black', choices=POLICIES, default=RANDOM_POLICY)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-plies', type=int, default=500)
+    parser.add_argument('--engine-ms', type=int, default=100)
+    parser.add_argument('--engine-depth', type=int, default=64)
+    parser.add_argument('--size', type=int, default=None,
+                        help="play the standard layout scaled to this board size")
+    parser.add_argument('--shard-size', type=int, default=1 << 18, help="positions per shard")
+    parser.add_argument('--block-size', type=int, default=1 << 13,
+                        help="positions held in memory before each write")
+    args = parser.parse_args(argv)
+
+    summary = export_games(args.games, args.out, args.white, args.black, args.processes,
+                           args.seed, args.max_plies, args.engine_ms, args.engine_depth,
+                           args.size, args.shard_size, args.block_size, report=sys.stderr)
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
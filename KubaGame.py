@@ -3,7 +3,425 @@
 # Description: This program lets two players participate in a virtual board game
 #               called Kuba
 import copy
-import pygame
+import struct
+import time
+from array import array
+
+DIRECTIONS = ('F', 'B', 'L', 'R')
+MARBLES = ('W', 'B', 'R')
+_MARBLE_INDEX = {tile: index for index, tile in enumerate(MARBLES)}
+
+# direction -> (row offset, col offset) of the tile a marble is pushed from
+_BEHIND = {'F': (1, 0), 'B': (-1, 0), 'L': (0, 1), 'R': (0, -1)}
+# direction -> (row offset, col offset) of one push step
+_STEPS = {'F': (-1, 0), 'B': (1, 0), 'L': (0, -1), 'R': (0, 1)}
+
+# repetition rules: a move may not recreate the board from the start of the last turn
+#  (REPEAT_PREVIOUS), or any board seen earlier in the game (REPEAT_SUPERKO)
+REPEAT_PREVIOUS = 'previous'
+REPEAT_SUPERKO = 'superko'
+
+# the rules a move is checked against, in order (each also has its own check method)
+VALIDATION_STAGES = ('winner_check', 'position_check', 'direction_check', 'turn_check',
+                     'marble_color_check', 'push_check', 'self_capture_check', 'history_check')
+
+# check_move results: MOVE_VALID, or the first rule the move breaks
+MOVE_VALID = 'valid'
+GAME_OVER = 'game_over'                 # the game has already been won
+BAD_POSITION = 'bad_position'           # the position is off the playing board
+BAD_DIRECTION = 'bad_direction'         # the direction is not F, B, L or R
+NOT_YOUR_TURN = 'not_your_turn'
+UNKNOWN_PLAYER = 'unknown_player'
+NOT_YOUR_MARBLE = 'not_your_marble'     # the tile doesn't hold one of the player's marbles
+NO_ROOM = 'no_room'                     # the tile the marble is pushed from isn't empty
+SELF_CAPTURE = 'self_capture'           # the push would push off one of the player's marbles
+REPEAT = 'repeat'                       # the push would repeat an earlier board
+# rejection reason -> the validation stage that rejects it
+REJECTION_STAGES = {GAME_OVER: 'winner_check', BAD_POSITION: 'position_check',
+                    BAD_DIRECTION: 'direction_check', NOT_YOUR_TURN: 'turn_check',
+                    UNKNOWN_PLAYER: 'marble_color_check', NOT_YOUR_MARBLE: 'marble_color_check',
+                    NO_ROOM: 'push_check', SELF_CAPTURE: 'self_capture_check',
+                    REPEAT: 'history_check'}
+
+# installed statistics collector (see set_instrumentation), None while instrumentation is off
+_instrumentation = None
+
+# move codes: (row * size + col) * 4 + direction index, with row and col in make_move
+#  coordinates. On the standard 7x7 board every move fits in one byte (codes 0-195).
+_DIRECTION_CODES = {direction: index for index, direction in enumerate(DIRECTIONS)}
+
+# packed tiles: the 49 playing tiles at 2 bits each (X, W, B, R), row by row, in 13 bytes
+_TILE_CODES = {'X': 0, 'W': 1, 'B': 2, 'R': 3}
+_CODE_TILES = ('X', 'W', 'B', 'R')
+PACKED_TILES_SIZE = 13
+
+# game snapshot (see KubaGame.to_bytes): format version, flags, board, previous board,
+#  reds captured by player 1 and 2, and turn | winner << 2 | first player << 4 with
+#  0 for none and 1 or 2 for a player
+_SNAPSHOT = struct.Struct('<BB13s13sBBB')
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_SUPERKO = 1       # flag: the game uses REPEAT_SUPERKO
+SNAPSHOT_SIZE = _SNAPSHOT.size
+
+# Zobrist keys: one random 64-bit key per (marble, tile), indexed by row * width + col,
+#  where the width of a board is its size plus the two tray tiles. Tray tiles keep a key
+#  of 0, so a marble in the tray does not change the board hash. The keys come from a
+#  fixed-seed SplitMix64 generator, so hashes agree between processes and importing the
+#  rules engine does not need the random module.
+_ZOBRIST_SEED = 0x4B756261
+_MASK64 = (1 << 64) - 1
+
+
+def _splitmix64(state):
+    """
+    Returns the next (state, 64-bit random number) of a SplitMix64 generator
+    """
+    state = (state + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((state ^ (state >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return state, value ^ (value >> 31)
+
+
+def _zobrist_keys(seed, width):
+    """
+    Returns the Zobrist key table of a board width: marble -> list of keys indexed by
+    row * width + col
+    """
+    state = seed
+    keys = {}
+    for tile in MARBLES:
+        keys[tile] = []
+        for index in range(width * width):
+            state, value = _splitmix64(state)
+            row, col = divmod(index, width)
+            keys[tile].append(value if 0 < row < width - 1 and 0 < col < width - 1 else 0)
+    return keys
+
+
+class _Geometry:
+    """
+    The tables shared by every board of one size: the playing range, the tray rows and
+        columns, the Zobrist keys, the BitBoard bit layout and push tables, and the lines
+        a PositionAnalysis keeps. Built once per size by _geometry and never changed, so
+        boards share it instead of copying it.
+    """
+    __slots__ = ('size', 'width', 'edge', 'play_range', 'keys', 'board_mask', 'play_mask',
+                 'positions', 'coordinates', 'shifts', 'rays', 'lines', 'ray_positions',
+                 'fronts', 'edges', 'move_keys', 'empty_board', 'line_tiles')
+
+    def __init__(self, size):
+        width = size + 2
+        self.size = size
+        self.width = width
+        # rows and columns of the tray, and of the playing board inside it
+        self.edge = (0, width - 1)
+        self.play_range = range(1, size + 1)
+        self.keys = _zobrist_keys(_ZOBRIST_SEED, width)
+
+        # BitBoard layout: bit (row * width + col) represents tile (row, col), tray included
+        tiles = width * width
+        self.board_mask = (1 << tiles) - 1
+        self.play_mask = sum(1 << (row * width + col) for row in self.play_range
+                             for col in self.play_range)
+        # bit index -> (row, col), and -> make_move coordinates (row - 1, col - 1)
+        self.positions = tuple(divmod(index, width) for index in range(tiles))
+        self.coordinates = tuple((row - 1, col - 1) for row, col in self.positions)
+        row_masks = [((1 << width) - 1) << (row * width) for row in range(width)]
+        col_masks = [sum(1 << (row * width + col) for row in range(width))
+                     for col in range(width)]
+
+        # push tables, direction -> table indexed by the bit of the pushed marble (every
+        #  table is filled in for the playing board only):
+        #  shifts: the bit shift of one push step (negative for a shift right)
+        #  rays: the mask of the tiles ahead of the marble, up to and including the tray
+        #  lines: the mask of the row or column the push runs along
+        #  ray_positions: the (row, col) of the marble and the tiles ahead of it
+        #  fronts: the bit of the last playing tile ahead, whose marble a push would drop
+        #  move_keys: marble -> the Zobrist key change of that marble moving one step
+        # and edges: direction -> the mask of the playing tiles next to the tray ahead
+        self.shifts = {'F': -width, 'B': width, 'L': -1, 'R': 1}
+        self.rays = {}
+        self.lines = {}
+        self.ray_positions = {}
+        self.fronts = {}
+        self.edges = {}
+        self.move_keys = {}
+        for direction, shift in self.shifts.items():
+            rays = [0] * tiles
+            lines = [0] * tiles
+            ray_positions = [()] * tiles
+            fronts = [0] * tiles
+            for row in self.play_range:
+                for col in self.play_range:
+                    index = row * width + col
+                    ahead = []
+                    tile = index + shift
+                    while True:
+                        ahead.append(tile)
+                        tile_row, tile_col = self.positions[tile]
+                        if tile_row in self.edge or tile_col in self.edge:
+                            break
+                        tile += shift
+                    rays[index] = sum(1 << tile for tile in ahead)
+                    lines[index] = row_masks[row] if direction in 'LR' else col_masks[col]
+                    ray_positions[index] = tuple(self.positions[tile] for tile in [index] + ahead)
+                    fronts[index] = 1 << (ahead[-2] if len(ahead) > 1 else index)
+            self.rays[direction] = tuple(rays)
+            self.lines[direction] = tuple(lines)
+            self.ray_positions[direction] = tuple(ray_positions)
+            self.fronts[direction] = tuple(fronts)
+            self.edges[direction] = sum(1 << index for index in range(tiles)
+                                        if fronts[index] == 1 << index)
+            self.move_keys[direction] = {
+                tile: tuple(keys[index] ^ keys[index + shift] if (self.play_mask >> index) & 1
+                            else 0 for index in range(tiles))
+                for tile, keys in self.keys.items()}
+
+        # the list of lists view of an empty board, copied by BitBoard.get_board
+        self.empty_board = tuple(tuple('-' if row in self.edge else '|' if col in self.edge
+                                       else 'X' for col in range(width)) for row in range(width))
+
+        # the lines a PositionAnalysis keeps: the rows (pushed L and R) then the columns
+        #  (pushed F and B) of the playing board, each as its tiles from tray to tray
+        self.line_tiles = tuple([tuple((row, col) for col in range(width)) for row in self.play_range]
+                                + [tuple((row, col) for row in range(width)) for col in self.play_range])
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return _geometry, (self.size,)
+
+
+# board size -> _Geometry, filled in as sizes are first used
+_GEOMETRIES = {}
+
+
+def _geometry(size):
+    """
+    Returns the shared _Geometry of a board size
+    """
+    geometry = _GEOMETRIES.get(size)
+    if geometry is None:
+        geometry = _GEOMETRIES[size] = _Geometry(size)
+    return geometry
+
+
+def _board_hash(board, geometry):
+    """
+    Returns the Zobrist hash of the marbles on the playing area of a list of lists board
+    """
+    keys = geometry.keys
+    width = geometry.width
+    board_hash = 0
+    for row in geometry.play_range:
+        tiles = board[row]
+        for col in geometry.play_range:
+            tile = tiles[col]
+            if tile in MARBLES:
+                board_hash ^= keys[tile][row * width + col]
+    return board_hash
+
+
+class Ruleset:
+    """
+    This class describes a variant of Kuba: the size of the playing board, the starting
+        layout of the marbles and the number of captured reds that wins. A player also
+        wins when the other player has no marbles left on the board. Rulesets never
+        change, so every game and board playing a variant shares one.
+    This class does not communicate with other classes. KubaGame, GameBoard and BitBoard
+        are set up from it.
+    """
+    __slots__ = ('_name', '_layout', '_reds_to_win', '_marble_count', '_geometry')
+
+    def __init__(self, name, layout, reds_to_win):
+        """
+        Init method for Ruleset data members
+        Parameters: name (string), starting layout of the playing board as one string
+            per row of 'X', 'W', 'B' and 'R' tiles (the board must be square), number
+            of captured reds that wins the game
+        Returns: N/A
+        """
+        layout = tuple(layout)
+        if not layout or any(len(row) != len(layout) for row in layout):
+            raise ValueError("a ruleset layout must be a square of rows")
+        if any(tile not in 'XWBR' for row in layout for tile in row):
+            raise ValueError("layout tiles must be 'X', 'W', 'B' or 'R'")
+        tiles = ''.join(layout)
+        self._name = name
+        self._layout = layout
+        self._marble_count = (tiles.count('W'), tiles.count('B'), tiles.count('R'))
+        if not 0 < reds_to_win <= self._marble_count[2]:
+            raise ValueError("reds_to_win must be between 1 and the number of reds")
+        self._reds_to_win = reds_to_win
+        self._geometry = _geometry(len(layout))
+
+    @classmethod
+    def scaled(cls, size):
+        """
+        Builds the standard layout scaled to another board size: a square block of each
+            player's marbles in every corner (white top left and bottom right, black top
+            right and bottom left) and a diamond of reds in the middle. Winning takes a
+            majority of the reds. Size 7 gives the standard game.
+        Parameters: playing board size (odd number, at least 5)
+        Returns: Ruleset object
+        """
+        if size < 5 or size % 2 == 0:
+            raise ValueError("scaled board sizes are odd numbers from 5 up")
+        block = (size + 1) // 4
+        radius = (size - 3) // 2
+        center = size // 2
+        layout = []
+        for row in range(size):
+            tiles = []
+            for col in range(size):
+                top, left = row < block, col < block
+                bottom, right = row >= size - block, col >= size - block
+                if (top and left) or (bottom and right):
+                    tiles.append('W')
+                elif (top and right) or (bottom and left):
+                    tiles.append('B')
+                elif abs(row - center) + abs(col - center) <= radius:
+                    tiles.append('R')
+                else:
+                    tiles.append('X')
+            layout.append(''.join(tiles))
+        reds = ''.join(layout).count('R')
+        return cls('%dx%d' % (size, size), layout, reds // 2 + 1)
+
+    def __eq__(self, other):
+        if not isinstance(other, Ruleset):
+            return NotImplemented
+        return self._layout == other._layout and self._reds_to_win == other._reds_to_win
+
+    def __hash__(self):
+        return hash((self._layout, self._reds_to_win))
+
+    def __repr__(self):
+        return 'Ruleset(%r, %d reds to win)' % (self._name, self._reds_to_win)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def get_name(self):
+        """returns the name of the ruleset"""
+        return self._name
+
+    def get_size(self):
+        """returns the number of rows (and columns) of the playing board"""
+        return len(self._layout)
+
+    def get_layout(self):
+        """returns the starting layout as a tuple of row strings"""
+        return self._layout
+
+    def get_reds_to_win(self):
+        """returns the number of captured reds that wins the game"""
+        return self._reds_to_win
+
+    def get_marble_count(self):
+        """returns the starting marble count as a tuple (# white marbles, # black, # red)"""
+        return self._marble_count
+
+    def get_board(self):
+        """
+        Builds the starting board
+        Parameters: N/A
+        Returns: game board (list of lists) with the playing board inside a tray border
+        """
+        width = len(self._layout) + 2
+        board = [['-'] * width]
+        for row in self._layout:
+            board.append(['|'] + list(row) + ['|'])
+        board.append(['-'] * width)
+        return board
+
+    def get_geometry(self):
+        """returns the tables shared by every board of this size (used by the board classes)"""
+        return self._geometry
+
+
+# the standard game: a 7x7 board, 8 marbles each, 13 reds and 7 captured reds to win
+STANDARD = Ruleset('standard', ('WWXXXBB',
+                                'WWXRXBB',
+                                'XXRRRXX',
+                                'XRRRRRX',
+                                'XXRRRXX',
+                                'BBXRXWW',
+                                'BBXXXWW'), 7)
+
+
+def set_instrumentation(stats):
+    """
+    Installs a statistics collector for every game in the process, or removes it. While
+        one is installed, every move check reports its result and the time it took as a
+        whole and per validation stage, apply_move reports each push, and every deep copy
+        of a board (make_hyp_move, or copy.deepcopy of a game) is counted (see KubaStats).
+    Parameters: object with record_check, record_stage, record_push and record_deepcopy
+        methods (such as KubaStats.ValidationStats), or None to turn instrumentation off
+    Returns: N/A
+    """
+    global _instrumentation
+    _instrumentation = stats
+
+
+def get_instrumentation():
+    """returns the installed statistics collector, or None"""
+    return _instrumentation
+
+
+def encode_move(coordinates, direction, size=7):
+    """
+    Packs a move into its move code
+    Parameters: position (tuple) in make_move coordinates, direction ('F', 'B', 'L', or 'R')
+        and the size of the playing board
+    Returns: move code (number 0-195 on the standard board)
+    """
+    return (coordinates[0] * size + coordinates[1]) * 4 + _DIRECTION_CODES[direction]
+
+
+def decode_move(code, size=7):
+    """
+    Unpacks a move code
+    Parameters: move code (number 0-195 on the standard board), size of the playing board
+    Returns: (position (tuple) in make_move coordinates, direction (string))
+    """
+    tile, direction = divmod(code, 4)
+    return divmod(tile, size), DIRECTIONS[direction]
+
+
+def pack_tiles(board):
+    """
+    Packs the 49 playing tiles of a board into 13 bytes, 2 bits per tile
+    Parameters: game board (list of lists) in the 9x9 tray-border layout
+    Returns: bytes
+    """
+    packed = 0
+    shift = 0
+    for row in range(1, 8):
+        for tile in board[row][1:8]:
+            packed |= _TILE_CODES[tile] << shift
+            shift += 2
+    return packed.to_bytes(PACKED_TILES_SIZE, 'little')
+
+
+def unpack_tiles(data):
+    """
+    Unpacks tiles packed by pack_tiles
+    Parameters: bytes-like object of 13 bytes
+    Returns: game board (list of lists) in the 9x9 tray-border layout, with a clear tray
+    """
+    packed = int.from_bytes(data, 'little')
+    board = [['-'] * 9]
+    for _ in range(7):
+        row = ['|']
+        for _ in range(7):
+            row.append(_CODE_TILES[packed & 3])
+            packed >>= 2
+        row.append('|')
+        board.append(row)
+    board.append(['-'] * 9)
+    return board
 
 
 class KubaGame:
@@ -13,29 +431,225 @@ class KubaGame:
      - GameBoard: KubaGame uses GameBoard to initialize and change the physical
             board with marbles on it. It also returns important information
             about the status of the board to KubaGame.
+     - BitBoard: KubaGame can use BitBoard in place of GameBoard as a faster
+            drop-in board backend (see the board_class parameter).
+     - Ruleset: KubaGame plays the board size, starting layout and winning count of
+            captured reds of its Ruleset (STANDARD by default).
+     - PositionAnalysis: KubaGame keeps a PositionAnalysis of the position up to date
+            once get_analysis has been called.
      - Player: KubaGame uses Player object to initialize and return information about
             players 1 and 2.
      - InvalidMoveError: KubaGame uses InvalidMoveError to pass an error when a player
             inputs an invalid move
      """
-    def __init__(self, player1, player2):
+    # slots keep a live game small: no per-instance __dict__
+    __slots__ = ('_player1', '_player2', '_board', '_turn', '_winner', '_marble_count',
+                 '_board_prev', '_repetition_rule', '_hash_prev', '_hash_history',
+                 '_hash_counts', '_first_player', '_moves', '_analysis', '_ruleset')
+
+    def __init__(self, player1, player2, board_class=None, repetition_rule=REPEAT_PREVIOUS,
+                 ruleset=None):
         """
         Purpose: initializes variables for the game
-        Parameters: Player object (player1), Player object (player2)
+        Parameters: Player object (player1), Player object (player2),
+            board backend class (GameBoard by default, or BitBoard),
+            repetition rule (REPEAT_PREVIOUS by default, or REPEAT_SUPERKO),
+            Ruleset object (STANDARD by default)
         Returns: N/A
         """
+        if repetition_rule not in (REPEAT_PREVIOUS, REPEAT_SUPERKO):
+            raise ValueError("unknown repetition rule: " + str(repetition_rule))
+        if board_class is None:
+            board_class = GameBoard
+        if ruleset is None:
+            ruleset = STANDARD
+        self._ruleset = ruleset
         self._player1 = Player(player1[0], player1[1])
         self._player2 = Player(player2[0], player2[1])
-        self._board = GameBoard()
+        self._board = board_class(ruleset)
         self._turn = None
         self._winner = None
-        self._marble_count = (8, 8, 13)     # (W, B, R)
-        self._board_prev = copy.deepcopy(self._board.get_board())
+        self._marble_count = ruleset.get_marble_count()     # (W, B, R)
+        # the previous board is kept packed by the board backend, in the packed layout of
+        #  the ruleset's board size (see get_board_prev)
+        self._board_prev = self._board.pack_board()
+
+        # board hashes used by the repetition rule: the hash of the previous board, every
+        #  board hash played this game (packed 8 bytes each), and, for REPEAT_SUPERKO only,
+        #  how many times each board hash has been played
+        self._repetition_rule = repetition_rule
+        self._hash_prev = self._board.get_hash()
+        self._hash_history = array('Q', (self._hash_prev,))
+        self._hash_counts = None
+        if repetition_rule == REPEAT_SUPERKO:
+            self._hash_counts = {self._hash_prev: 1}
+
+        # move log: the name of the player who moved first and one move code per move
+        self._first_player = None
+        self._moves = self._new_move_log()
+
+        # position analysis, created by the first get_analysis call and then kept up to
+        #  date by every move
+        self._analysis = None
 
     def get_board(self):
         """returns the game board as a list of lists"""
         return self._board.get_board()
 
+    def get_ruleset(self):
+        """returns the Ruleset the game is played with"""
+        return self._ruleset
+
+    def get_analysis(self):
+        """
+        Returns the analysis of the current position: pushes, mobility and capture threats
+            per color (see PositionAnalysis). It stays in step with the game, each move
+            recomputing only the rows and columns the move changed.
+        Parameters: N/A
+        Returns: PositionAnalysis object
+        """
+        if self._analysis is None:
+            self._analysis = PositionAnalysis(self._board)
+        return self._analysis
+
+    def get_hash(self):
+        """returns the 64-bit Zobrist hash of the game board"""
+        return self._board.get_hash()
+
+    def get_hash_history(self):
+        """returns the hashes of every board played this game, oldest first (an array of
+        unsigned 64-bit numbers)"""
+        return self._hash_history
+
+    def get_moves(self):
+        """returns the move log (see encode_move): a bytearray of one-byte move codes, or
+        on boards larger than 8x8, an array of unsigned 16-bit move codes"""
+        return self._moves
+
+    def _new_move_log(self, moves=()):
+        """returns a move log holding the given move codes, sized for the board"""
+        size = self._ruleset.get_size()
+        if size * size * 4 <= 256:
+            return bytearray(moves)
+        return array('H', moves)
+
+    def get_first_player(self):
+        """returns the name of the player who made the first move, or None before it"""
+        return self._first_player
+
+    def load_position(self, board, board_prev, captured, turn, winner, moves=b'', first_player=None):
+        """
+        Sets up the game from a saved position. The hash history restarts from the
+            previous and current boards, so only the previous board repetition rule is
+            enforced against moves made before the position was saved.
+        Parameters: game board and previous board (lists of lists), reds captured by
+            player 1 and player 2 (tuple), the current turn's and the winner's player
+            names (or None), the move log up to the position and the first player's name
+        Returns: N/A
+        """
+        self._board.set_board(board)
+        self.set_board_prev(board_prev)
+        self._player1.set_captured(captured[0])
+        self._player2.set_captured(captured[1])
+        self._turn = turn
+        self._winner = winner
+        self._moves = self._new_move_log(moves)
+        self._first_player = first_player
+        if self._analysis is not None:
+            self._analysis.refresh()
+        if winner is None:
+            # moves are checked against the winner kept by apply_move, so settle it now
+            self.check_for_winner()
+
+        self._hash_prev = _board_hash(board_prev, self._ruleset.get_geometry())
+        self._hash_history = array('Q', (self._hash_prev, self._board.get_hash()))
+        if self._repetition_rule == REPEAT_SUPERKO:
+            self._hash_counts = {}
+            for board_hash in self._hash_history:
+                self._hash_counts[board_hash] = self._hash_counts.get(board_hash, 0) + 1
+
+    def copy(self, board_class=None):
+        """
+        Copies the game, optionally onto another board backend. Unlike load_position,
+            the copy keeps the whole game: its board hash history (both backends hash
+            boards with the same keys), so REPEAT_SUPERKO is still enforced, and its
+            move log.
+        Parameters: board backend class of the copy (the same as this game's by default)
+        Returns: KubaGame object
+        """
+        if board_class is None:
+            board_class = type(self._board)
+        game = KubaGame((self._player1.get_name(), self._player1.get_color()),
+                        (self._player2.get_name(), self._player2.get_color()),
+                        board_class, self._repetition_rule, self._ruleset)
+        game._board.set_board(self._board.get_board())
+        game.set_board_prev(self.get_board_prev())
+        game._player1.set_captured(self._player1.get_captured())
+        game._player2.set_captured(self._player2.get_captured())
+        game._turn = self._turn
+        game._winner = self._winner
+        game._hash_prev = self._hash_prev
+        game._hash_history = array('Q', self._hash_history)
+        if self._hash_counts is not None:
+            game._hash_counts = dict(self._hash_counts)
+        game._first_player = self._first_player
+        game._moves = self._new_move_log(self._moves)
+        return game
+
+    def to_bytes(self):
+        """
+        Packs the game state into SNAPSHOT_SIZE bytes: the board, the previous board, the
+            captured reds, and the turn, winner and first player by reference (as player 1
+            or 2), so the player names and colors are not stored. The move log and the
+            board hash history are not part of a snapshot. Only games of the STANDARD
+            ruleset have snapshots.
+        Parameters: N/A
+        Returns: bytes
+        """
+        if self._ruleset != STANDARD:
+            raise ValueError("snapshots hold standard games only, not " + self._ruleset.get_name())
+        names = (None, self._player1.get_name(), self._player2.get_name())
+        state = (names.index(self._turn) | names.index(self._winner) << 2
+                 | names.index(self._first_player) << 4)
+        flags = _SNAPSHOT_SUPERKO if self._repetition_rule == REPEAT_SUPERKO else 0
+        return _SNAPSHOT.pack(_SNAPSHOT_VERSION, flags, pack_tiles(self._board.get_board()),
+                              pack_tiles(self.get_board_prev()), self._player1.get_captured(),
+                              self._player2.get_captured(), state)
+
+    @classmethod
+    def from_bytes(cls, data, player1, player2, board_class=None):
+        """
+        Rebuilds a game from a snapshot made by to_bytes. Like load_position, the restored
+            game enforces the repetition rule against the previous board only.
+        Parameters: bytes-like object (at least SNAPSHOT_SIZE bytes), the (name, color)
+            pairs of player 1 and player 2, board backend class (GameBoard by default)
+        Returns: KubaGame object
+        """
+        version, flags, board, board_prev, captured1, captured2, state = \
+            _SNAPSHOT.unpack_from(data)
+        if version != _SNAPSHOT_VERSION:
+            raise ValueError("unknown snapshot version: " + str(version))
+        rule = REPEAT_SUPERKO if flags & _SNAPSHOT_SUPERKO else REPEAT_PREVIOUS
+        game = cls(player1, player2, board_class, rule)
+        names = (None, player1[0], player2[0])
+        game.load_position(unpack_tiles(board), unpack_tiles(board_prev), (captured1, captured2),
+                           names[state & 3], names[state >> 2 & 3], b'', names[state >> 4 & 3])
+        return game
+
+    def get_repetition_rule(self):
+        """returns the repetition rule (REPEAT_PREVIOUS or REPEAT_SUPERKO)"""
+        return self._repetition_rule
+
+    def is_repeat(self, board_hash):
+        """
+        Checks a board hash against the repetition rule
+        Parameters: 64-bit board hash (number)
+        Returns: True if a move to this board would break the repetition rule. False otherwise.
+        """
+        if self._repetition_rule == REPEAT_SUPERKO:
+            return board_hash in self._hash_counts
+        return board_hash == self._hash_prev
+
     def display_board(self):
         """
         Prints the game board to the console
@@ -48,17 +662,21 @@ class KubaGame:
         """
         Prints the game board from the previous turn to the console
         """
-        for row in self._board_prev:
+        for row in self.get_board_prev():
             print("  ".join(x for x in row))
 
+    def get_board_prev(self):
+        """returns the game board from the start of the previous turn as a new list of lists"""
+        return self._board.unpack_board(self._board_prev)
+
     def set_board_prev(self, board):
         """
-        Stores a deep copy of the previous valid playing board
-            object for use in previous board position checks
-        Parameters: GameBoard object
+        Stores a packed copy of the previous valid playing board
+            for use in previous board position checks
+        Parameters: game board (list of lists)
         Returns: N/A
         """
-        self._board_prev = copy.deepcopy(board)
+        self._board_prev = self._board.pack_board(board)
 
     def get_player(self, name):
         """
@@ -138,23 +756,26 @@ class KubaGame:
 
     def check_for_winner(self):
         """
-        Checks if the game has been won by a player capturing 7 reds or 7 opposing marbles.
-            Returns True if a player has won the game. False otherwise.
+        Checks if the game has been won by a player capturing the ruleset's winning number
+            of reds (7 in the standard game) or every opposing marble.
         Parameters: N/A
-        Returns: True or False
+        Returns: N/A
         """
-        if self._player1.get_captured() == 7:
+        reds_to_win = self._ruleset.get_reds_to_win()
+        if self._player1.get_captured() >= reds_to_win:
             self.set_winner(self._player1.get_name())
 
-        if self._player2.get_captured() == 7:
+        if self._player2.get_captured() >= reds_to_win:
             self.set_winner(self._player2.get_name())
 
+        counts = self.get_marble_count()
+
         # if player 1 has no marbles on the board, player 2 wins
-        if self.get_marble_count()[0] == 0:
+        if counts[MARBLES.index(self._player1.get_color())] == 0:
             self.set_winner(self._player2.get_name())
 
         # if player 2 has no marbles on the board, player 1 wins
-        if self.get_marble_count()[1] == 0:
+        if counts[MARBLES.index(self._player2.get_color())] == 0:
             self.set_winner(self._player1.get_name())
 
     def set_winner(self,  name):
@@ -185,6 +806,14 @@ class KubaGame:
         """
         return self._board.get_tile(board_pos)
 
+    def get_pushed_off(self, coordinates, direction):
+        """
+        Returns the marble a push would push off the board, without making the push
+        Parameters: position (tuple) of marble to push and direction ('F', 'B', 'L', or 'R')
+        Returns: marble color as a string ('W', 'B', 'R') or None if no marble would leave the board
+        """
+        return self._board.get_pushed_off((coordinates[0] + 1, coordinates[1] + 1), direction)
+
     def make_hyp_move(self, coordinates, direction):
         """
         Makes a hypothetical move and then compares it with the previous board
@@ -214,30 +843,115 @@ class KubaGame:
         # if the parameters are validated
         if self.valid_make_move(player_name, board_pos, direction):
 
-            # store a deep copy of the previous board and then make the validated move
-            self.set_board_prev(self._board.get_board())
-
-            # count the reds before the move is made
-            reds_before = self.get_marble_count()[2]
-
-            # make the move for the current player
-            self._board.push_marble(board_pos, direction)
-
-            # update any reds captured on this turn for the player
-            self.update_captured(player_name, reds_before)
-
-            # update the current turn to the other player
-            other_player = self.get_other_player(player_name)
-            self.set_current_turn(other_player.get_name())
-
-            # clear the board tray after every valid move
-            self._board.clear_tray()
-
-            # check for game winner after every valid turn
-            self.check_for_winner()     # updates self._winner
+            # make the move for the current player (stores the previous board, updates
+            #  captured reds, the current turn and the winner)
+            self.apply_move(player_name, coordinates, direction)
             return True
         return False
 
+    def apply_move(self, player_name, coordinates, direction):
+        """
+        Makes a move for a player WITHOUT data validation and returns an undo record.
+            make_move calls this once a move is validated. Search code can call it
+            together with undo_move to try moves without copying the game.
+        Parameters: the Player's name making the move (string), position (tuple) of marble to push,
+            and the direction of the push ('F', 'B', 'L', or 'R')
+        Returns: undo record (tuple) to pass to undo_move
+        """
+        # convert input position to actual game board object position
+        board_pos = (coordinates[0] + 1, coordinates[1] + 1)
+        board_prev, turn, winner = self._board_prev, self._turn, self._winner
+        hash_prev = self._hash_prev
+
+        # store a packed copy of the previous board and then make the move
+        self._board_prev = self._board.pack_board()
+        self._hash_prev = self._board.get_hash()
+        board_record = self._board.apply_move(board_pos, direction)
+        if self._analysis is not None or _instrumentation is not None:
+            changed = self._board.get_changed(board_record)
+            if self._analysis is not None:
+                self._analysis.update(changed)
+            if _instrumentation is not None:
+                # the changed tiles are the moved marbles plus the empty tile filled by the push
+                _instrumentation.record_push(len(changed) - (board_record[1] is None))
+
+        # add the new board to the hash history
+        board_hash = self._board.get_hash()
+        self._hash_history.append(board_hash)
+        if self._hash_counts is not None:
+            self._hash_counts[board_hash] = self._hash_counts.get(board_hash, 0) + 1
+
+        # log the move
+        if turn is None:
+            self._first_player = player_name
+        self._moves.append(encode_move(coordinates, direction, self._ruleset.get_size()))
+
+        # update any reds captured on this turn for the player
+        captured_by = None
+        if board_record[1] == 'R':
+            captured_by = player_name
+            self.get_player(player_name).add_captured()
+
+        # update the current turn to the other player
+        other_player = self.get_other_player(player_name)
+        self.set_current_turn(other_player.get_name())
+
+        # check for game winner after every move
+        self.check_for_winner()     # updates self._winner
+        return board_record, board_prev, hash_prev, turn, winner, captured_by
+
+    def undo_move(self, record):
+        """
+        Takes back a move made by apply_move, restoring the game exactly
+        Parameters: undo record (tuple) returned by apply_move
+        Returns: N/A
+        """
+        board_record, board_prev, hash_prev, turn, winner, captured_by = record
+
+        # take the board back out of the hash history
+        board_hash = self._hash_history.pop()
+        if self._hash_counts is None:
+            pass
+        elif self._hash_counts[board_hash] == 1:
+            del self._hash_counts[board_hash]
+        else:
+            self._hash_counts[board_hash] -= 1
+        self._hash_prev = hash_prev
+
+        self._board.undo_move(board_record)
+        if self._analysis is not None:
+            self._analysis.update(self._board.get_changed(board_record))
+        if captured_by is not None:
+            self.get_player(captured_by).remove_captured()
+        self._board_prev = board_prev
+        self._turn = turn
+        self._winner = winner
+        self._moves.pop()
+        if turn is None:
+            self._first_player = None
+
+    def legal_moves(self, player_name):
+        """
+        Finds every legal push for a player without trying any of them.
+            Practically, this method asks the board backend for the pushes of the player's
+            marbles that the push room, self capture and repetition rules allow (see
+            GameBoard.legal_pushes and BitBoard.legal_pushes), so no hypothetical board
+            copies are made.
+        Parameters: the Player's name (string)
+        Returns: list of (position (tuple), direction (string)) pairs, with positions in
+            the same coordinates make_move takes
+        """
+        self.check_for_winner()
+        player = self.get_player(player_name)
+        if self._winner is not None or player is None:
+            return []
+        if self._turn is not None and self._turn != player_name:
+            return []
+        # under REPEAT_PREVIOUS only the previous board is forbidden, and the board can
+        #  rule out most pushes by comparing itself with it
+        board_prev = self._board_prev if self._repetition_rule == REPEAT_PREVIOUS else None
+        return self._board.legal_pushes(player.get_color(), self.is_repeat, board_prev)
+
     # ------ start error handling for make_move --------------------------
     def marble_color_check(self, name, position):
         """
@@ -266,15 +980,15 @@ class KubaGame:
         else:
             raise InvalidMoveError
 
-    @staticmethod
-    def position_check(board_pos):
+    def position_check(self, board_pos):
         """
         Data validation for the position tuple the player inputs
             Raises InvalidMoveError if data is not valid.
         Parameters: tile position (tuple)
         Returns: N/A
         """
-        if board_pos[0] in range(1, 8) and board_pos[1] in range(1, 8):
+        play_range = self._ruleset.get_geometry().play_range
+        if board_pos[0] in play_range and board_pos[1] in play_range:
             pass
         else:
             raise InvalidMoveError
@@ -339,18 +1053,15 @@ class KubaGame:
     def history_check(self, board_pos, direction):
         """
         Handles data validation that this move will not result in an identical board setup to
-                  the board setup at the beginning of last turn.
+                  the board setup at the beginning of last turn (or, under REPEAT_SUPERKO, to
+                  any board setup from earlier in the game).
             Raises InvalidMoveError if data is not valid.
         Parameters: tile position (tuple) and direction (string)
         Returns: N/A
         """
-        hyp_board_object = self.make_hyp_move(board_pos, direction)
-        hyp_board = hyp_board_object.get_board()
-
-        # if the hypothetical board matches the prev_board, raise InvalidMoveError
-        if hyp_board == self._board_prev:
+        # compare the hash of the hypothetical board with the hash history
+        if self.is_repeat(self._board.get_push_hash(board_pos, direction)):
             raise InvalidMoveError
-        pass
 
     def self_capture_check(self, name, board_pos, direction):
         """
@@ -360,28 +1071,23 @@ class KubaGame:
         Parameters: Player name (string), tile position (tuple), direction (string)
         Returns: N/A
         """
-        if name == self._player1.get_name():
-            # store the number of player1's marbles before the turn
-            marbles_before = self._board.get_marble_count()[0]
-
-            # make the hypothetical move (changing only a deep copy)
-            hyp_board_obj = self.make_hyp_move(board_pos, direction)
-            marbles_after = hyp_board_obj.get_marble_count()[0]
+        # make the hypothetical move in place and take it back, keeping the pushed off marble
+        record = self._board.apply_move(board_pos, direction)
+        self._board.undo_move(record)
 
-            if marbles_before != marbles_after:
-                raise InvalidMoveError
-
-        if name == self._player2.get_name():
-            # store the number of player1's marbles before the turn
-            marbles_before = self._board.get_marble_count()[1]
-
-            # make the hypothetical move (changing only a deep copy)
-            hyp_board_obj = self.make_hyp_move(board_pos, direction)
-            marbles_after = hyp_board_obj.get_marble_count()[1]
+        if record[1] == self.get_player(name).get_color():
+            raise InvalidMoveError
 
-            if marbles_before != marbles_after:
-                raise InvalidMoveError
-        pass
+    def check_move(self, player_name, coordinates, direction):
+        """
+        Checks a move against every rule without making it, and says which rule it breaks
+        Parameters: the Player's name (string), position (tuple) of marble to push, and the
+            direction of the push ('F', 'B', 'L', or 'R')
+        Returns: MOVE_VALID, or the rejection reason of the first rule broken, in the order
+            of VALIDATION_STAGES (GAME_OVER, BAD_POSITION, BAD_DIRECTION, NOT_YOUR_TURN,
+            UNKNOWN_PLAYER, NOT_YOUR_MARBLE, NO_ROOM, SELF_CAPTURE or REPEAT)
+        """
+        return self._check_move((coordinates[0] + 1, coordinates[1] + 1), player_name, direction)
 
     def valid_make_move(self, name, position, direction):
         """
@@ -389,65 +1095,147 @@ class KubaGame:
             Returns False if the move is not allowed according to the game rules
              if or any parameter for make_move is invalid.
             Returns True if valid move.
-            Practically, this function calls each specific data validation method and if
-             any of them raise the InvalidMoveError, it returns False. Otherwise, if the data
-             passes all data validation, it returns True.
+            Practically, this function runs the same single pass over the rules as
+             check_move and only keeps whether the move passed.
         Parameters: Player name (string), tile position (tuple), direction (string)
         Returns: True or False
         """
-        # data validation for game already won
-        try:
-            self.winner_check()
-        except InvalidMoveError:
-            return False
-
-        # data validation for position
-        try:
-            self.position_check(position)
-        except InvalidMoveError:
-            return False
-
-        # data validation for direction
-        try:
-            self.direction_check(direction)
-        except InvalidMoveError:
-            return False
-
-        # data validation for current turn
-        try:
-            self.turn_check(name)
-        except InvalidMoveError:
-            return False
-
-        # data validation for marble color
-        try:
-            self.marble_color_check(name, position)
-        except InvalidMoveError:
-            return False
-
-        # data validation for push validity
-        try:
-            self.push_check(position, direction)
-        except InvalidMoveError:
-            return False
-
-        # data validation for a player pushing their own marble off the board
-        try:
-            self.self_capture_check(name, position, direction)
-        except InvalidMoveError:
-            return False
-
-        # data validation for board history
-        try:
-            self.history_check(position, direction)
-        except InvalidMoveError:
-            return False
-
-        # otherwise, input is validated
-        return True
+        return self._check_move(position, name, direction) == MOVE_VALID
+
+    def _check_move(self, board_pos, name, direction):
+        """
+        Checks a move in one pass: the marble the push would drop decides the self capture
+            rule, and only a push that drops none is checked against the repetition rule. Reports the result to the installed
+            statistics collector, if any.
+        Parameters: tile position (tuple) in board coordinates, Player name (string),
+            direction (string)
+        Returns: MOVE_VALID or a rejection reason
+        """
+        if _instrumentation is None:
+            return self._find_rejection(board_pos, name, direction)
+        stats = _instrumentation
+        start = time.perf_counter_ns()
+        reason = self._timed_find_rejection(board_pos, name, direction, stats)
+        stats.record_check(reason, time.perf_counter_ns() - start)
+        return reason
+
+    def _find_rejection(self, board_pos, name, direction):
+        """
+        Finds the first rule a move breaks (see _check_move)
+        """
+        # the winner is settled by apply_move and load_position after every change
+        if self._winner is not None:
+            return GAME_OVER
+        row, col = board_pos
+        geometry = self._ruleset.get_geometry()
+        if row not in geometry.play_range or col not in geometry.play_range:
+            return BAD_POSITION
+        if direction not in DIRECTIONS:
+            return BAD_DIRECTION
+        if self._turn is not None and name != self._turn:
+            return NOT_YOUR_TURN
+        player = self.get_player(name)
+        if player is None:
+            return UNKNOWN_PLAYER
+        color = player.get_color()
+        if self._board.get_tile(board_pos) != color:
+            return NOT_YOUR_MARBLE
+
+        # the tile the marble is pushed from must be empty or the tray
+        behind_row, behind_col = _BEHIND[direction]
+        if self._board.get_tile((row + behind_row, col + behind_col)) in MARBLES:
+            return NO_ROOM
+
+        pushed_off = self._board.get_pushed_off(board_pos, direction)
+        if pushed_off is not None:
+            # the last marble in the chain is pushed off the board. The board then has one
+            #  marble fewer than every earlier board, so it can't repeat one.
+            if pushed_off == color:
+                return SELF_CAPTURE
+        elif self.is_repeat(self._board.get_push_hash(board_pos, direction)):
+            return REPEAT
+        return MOVE_VALID
+
+    def _timed_find_rejection(self, board_pos, name, direction, stats):
+        """
+        Runs the same single pass as _find_rejection, timing each validation stage and
+            reporting it to a statistics collector with record_stage. A capturing push
+            can't repeat an earlier board, so history_check only runs for other pushes.
+        Parameters: tile position (tuple) in board coordinates, Player name (string),
+            direction (string), statistics collector
+        Returns: MOVE_VALID or a rejection reason
+        """
+        clock = time.perf_counter_ns
+        start = clock()
+        reason = GAME_OVER if self._winner is not None else None
+        start = _record_stage(stats, 'winner_check', start, reason)
+        if reason is not None:
+            return reason
+
+        row, col = board_pos
+        geometry = self._ruleset.get_geometry()
+        if row not in geometry.play_range or col not in geometry.play_range:
+            reason = BAD_POSITION
+        start = _record_stage(stats, 'position_check', start, reason)
+        if reason is not None:
+            return reason
+
+        if direction not in DIRECTIONS:
+            reason = BAD_DIRECTION
+        start = _record_stage(stats, 'direction_check', start, reason)
+        if reason is not None:
+            return reason
+
+        if self._turn is not None and name != self._turn:
+            reason = NOT_YOUR_TURN
+        start = _record_stage(stats, 'turn_check', start, reason)
+        if reason is not None:
+            return reason
+
+        player = self.get_player(name)
+        color = None
+        if player is None:
+            reason = UNKNOWN_PLAYER
+        else:
+            color = player.get_color()
+            if self._board.get_tile(board_pos) != color:
+                reason = NOT_YOUR_MARBLE
+        start = _record_stage(stats, 'marble_color_check', start, reason)
+        if reason is not None:
+            return reason
+
+        behind_row, behind_col = _BEHIND[direction]
+        if self._board.get_tile((row + behind_row, col + behind_col)) in MARBLES:
+            reason = NO_ROOM
+        start = _record_stage(stats, 'push_check', start, reason)
+        if reason is not None:
+            return reason
+
+        pushed_off = self._board.get_pushed_off(board_pos, direction)
+        if pushed_off is not None and pushed_off == color:
+            reason = SELF_CAPTURE
+        start = _record_stage(stats, 'self_capture_check', start, reason)
+        if reason is not None or pushed_off is not None:
+            return reason or MOVE_VALID
+
+        if self.is_repeat(self._board.get_push_hash(board_pos, direction)):
+            reason = REPEAT
+        _record_stage(stats, 'history_check', start, reason)
+        return reason or MOVE_VALID
     # ------ end error handling for make_move --------------------------
 
 
+def _record_stage(stats, stage, start, reason):
+    """
+    Reports one timed validation stage to a statistics collector
+    Parameters: statistics collector, stage name (string), perf_counter_ns value the stage
+        started at, rejection reason (None if the stage passed)
+    Returns: perf_counter_ns value to time the next stage from
+    """
+    stats.record_stage(stage, time.perf_counter_ns() - start, reason is not None)
+    return time.perf_counter_ns()
+
+
 class GameBoard:
     """
     This class represents the physical playing board and handles the processing
@@ -456,25 +1244,55 @@ class GameBoard:
      - Queue: GameBoard uses the Queue class to enqueue and dequeue values in the
             push_marble method
     """
-    def __init__(self):
+    __slots__ = ('_board', '_hash', '_counts', '_ruleset', '_geometry')
+
+    def __init__(self, ruleset=None):
         """
         Initialize the board to starting marble positions
                   with a perimeter tray.
-            Initialize the row checker as a Queue.
-        Parameters: N/A
+        Parameters: Ruleset object giving the board size and starting layout (STANDARD by
+            default)
         Returns: N/A
         """
-        self._board = []
-        self._board.append(['-', '-', '-', '-', '-', '-', '-', '-', '-'])
-        self._board.append(['|', 'W', 'W', 'X', 'X', 'X', 'B', 'B', '|'])     # initialize row 0...
-        self._board.append(['|', 'W', 'W', 'X', 'R', 'X', 'B', 'B', '|'])
-        self._board.append(['|', 'X', 'X', 'R', 'R', 'R', 'X', 'X', '|'])
-        self._board.append(['|', 'X', 'R', 'R', 'R', 'R', 'R', 'X', '|'])
-        self._board.append(['|', 'X', 'X', 'R', 'R', 'R', 'X', 'X', '|'])
-        self._board.append(['|', 'B', 'B', 'X', 'R', 'X', 'W', 'W', '|'])
-        self._board.append(['|', 'B', 'B', 'X', 'X', 'X', 'W', 'W', '|'])     # ...initialize row 6
-        self._board.append(['-', '-', '-', '-', '-', '-', '-', '-', '-'])
-        self._marble_row = Queue()
+        if ruleset is None:
+            ruleset = STANDARD
+        self._ruleset = ruleset
+        self._geometry = ruleset.get_geometry()
+        self._board = ruleset.get_board()
+
+        # Zobrist hash of the marbles on the playing board, kept up to date by every push
+        self._hash = _board_hash(self._board, self._geometry)
+        # number of W, B and R marbles on the playing board, also kept up to date by every
+        #  push, so counting marbles doesn't scan the board
+        self._counts = list(ruleset.get_marble_count())
+
+    def __deepcopy__(self, memo):
+        """copies the tiles and counts; the ruleset and geometry are shared, never changed"""
+        if _instrumentation is not None:
+            _instrumentation.record_deepcopy()
+        board = GameBoard.__new__(GameBoard)
+        board._board = [list(row) for row in self._board]
+        board._hash = self._hash
+        board._counts = list(self._counts)
+        board._ruleset = self._ruleset
+        board._geometry = self._geometry
+        return board
+
+    def get_ruleset(self):
+        """returns the Ruleset the board was set up with"""
+        return self._ruleset
+
+    def set_board(self, board):
+        """
+        Replaces the marbles on the playing board (the tray is cleared)
+        Parameters: game board (list of lists) in the tray-border layout of this board's size
+        Returns: N/A
+        """
+        self._board = [list(row) for row in board]
+        self.clear_tray()
+        self._hash = _board_hash(self._board, self._geometry)
+        tiles = [tile for row in self._board[1:-1] for tile in row[1:-1]]
+        self._counts = [tiles.count(tile) for tile in MARBLES]
 
     def clear_tray(self):
         """
@@ -482,13 +1300,14 @@ class GameBoard:
         Parameters: N/A
         Returns: N/A
         """
-        self._board[0] = ['-', '-', '-', '-', '-', '-', '-', '-', '-']
-        self._board[8] = ['-', '-', '-', '-', '-', '-', '-', '-', '-']
+        last = self._geometry.width - 1
+        self._board[0] = ['-'] * (last + 1)
+        self._board[last] = ['-'] * (last + 1)
         index = 0
         for row in self._board:
-            if index != 0 and index != 8:
+            if index != 0 and index != last:
                 row[0] = '|'
-                row[8] = '|'
+                row[last] = '|'
             index += 1
 
     def get_board(self):
@@ -499,53 +1318,257 @@ class GameBoard:
         """
         return self._board
 
+    def pack_board(self, board=None):
+        """
+        Packs the playing area of a board into one byte per tile (49 bytes on the
+            standard board), one tile character per byte
+        Parameters: game board (list of lists), or None for this board
+        Returns: bytes
+        """
+        if board is None:
+            board = self._board
+        return ''.join([''.join(row[1:-1]) for row in board[1:-1]]).encode('ascii')
+
+    def unpack_board(self, data):
+        """
+        Unpacks a board packed by pack_board
+        Parameters: bytes
+        Returns: game board (list of lists) with a clear tray
+        """
+        tiles = data.decode('ascii')
+        size = self._geometry.size
+        board = [['-'] * (size + 2)]
+        for start in range(0, size * size, size):
+            board.append(['|'] + list(tiles[start:start + size]) + ['|'])
+        board.append(['-'] * (size + 2))
+        return board
+
     def push_marble(self, position, direction):
         """
         Pushes a the marble in the given position in the given direction,
                   pushing all marbles in front of it too
-            Practically, this method uses the marble_row Queue to "push" each marble forward by
+            Practically, this method uses a marble_row Queue to "push" each marble forward by
              storing the next marble then replacing it with the previous marble using the Queue.
         Parameters: tile position (tuple) and direction (string)
         Returns: None
         """
-        # initialize the queue with an empty space and then first tile
-        self._marble_row.clear()
-        self._marble_row.enqueue('X')
-        self._marble_row.enqueue(self._board[position[0]][position[1]])
+        # take the tiles about to move out of the board hash (and add them back after the push)
+        chain = self.get_push_chain(position, direction) if direction in _STEPS else []
+        self._hash ^= self._chain_key(chain)
+        if len(chain) > 1 and (chain[-1][0] in self._geometry.edge
+                               or chain[-1][1] in self._geometry.edge):
+            # the front marble of the chain is pushed into the tray
+            self._counts[_MARBLE_INDEX[self._board[chain[-2][0]][chain[-2][1]]]] -= 1
+
+        # initialize the queue with an empty space and then first tile (the queue only
+        #  lives for one push, so boards don't each carry one)
+        marble_row = Queue()
+        marble_row.enqueue('X')
+        marble_row.enqueue(self._board[position[0]][position[1]])
         counter = 0         # counter points at the first current tile
 
         if direction == 'R':
             while self._board[position[0]][position[1] + counter] in ['B', 'W', 'R']:
                 # dequeue the val into current
-                self._board[position[0]][position[1] + counter] = self._marble_row.dequeue()
+                self._board[position[0]][position[1] + counter] = marble_row.dequeue()
                 # enqueue the next val
-                self._marble_row.enqueue(self._board[position[0]][position[1] + counter + 1])
+                marble_row.enqueue(self._board[position[0]][position[1] + counter + 1])
                 counter += 1
-            self._board[position[0]][position[1] + counter] = self._marble_row.dequeue()
+            self._board[position[0]][position[1] + counter] = marble_row.dequeue()
 
         if direction == 'L':
             while self._board[position[0]][position[1] - counter] in ['B', 'W', 'R']:
-                self._board[position[0]][position[1] - counter] = self._marble_row.dequeue()
-                self._marble_row.enqueue(self._board[position[0]][position[1] - (counter + 1)])
+                self._board[position[0]][position[1] - counter] = marble_row.dequeue()
+                marble_row.enqueue(self._board[position[0]][position[1] - (counter + 1)])
                 counter += 1
-            self._board[position[0]][position[1] - counter] = self._marble_row.dequeue()
+            self._board[position[0]][position[1] - counter] = marble_row.dequeue()
 
         if direction == 'B':
             while self._board[position[0] + counter][position[1]] in ['B', 'W', 'R']:
-                self._board[position[0] + counter][position[1]] = self._marble_row.dequeue()
-                self._marble_row.enqueue(self._board[position[0] + counter + 1][position[1]])
+                self._board[position[0] + counter][position[1]] = marble_row.dequeue()
+                marble_row.enqueue(self._board[position[0] + counter + 1][position[1]])
                 counter += 1
-            self._board[position[0] + counter][position[1]] = self._marble_row.dequeue()
+            self._board[position[0] + counter][position[1]] = marble_row.dequeue()
 
         if direction == 'F':
             while self._board[position[0] - counter][position[1]] in ['B', 'W', 'R']:
-                self._board[position[0] - counter][position[1]] = self._marble_row.dequeue()
-                self._marble_row.enqueue(self._board[position[0] - (counter + 1)][position[1]])
+                self._board[position[0] - counter][position[1]] = marble_row.dequeue()
+                marble_row.enqueue(self._board[position[0] - (counter + 1)][position[1]])
                 counter += 1
-            self._board[position[0] - counter][position[1]] = self._marble_row.dequeue()
+            self._board[position[0] - counter][position[1]] = marble_row.dequeue()
 
+        self._hash ^= self._chain_key(chain)
         return
 
+    def apply_move(self, position, direction):
+        """
+        Pushes a marble like push_marble, then clears any marble pushed into the tray
+        Parameters: tile position (tuple) and direction (string)
+        Returns: undo record (tuple) for undo_move: the changed tiles as (position, old tile)
+            pairs, and the marble pushed off the board (None if no marble left the board)
+        """
+        chain = self.get_push_chain(position, direction)
+        if len(chain) == 1:
+            return (), None
+
+        # the last marble of a chain ending at the tray drops off the board
+        end_row, end_col = chain[-1]
+        pushed_off = None
+        if end_row in self._geometry.edge or end_col in self._geometry.edge:
+            chain.pop()
+            pushed_off = self._board[chain[-1][0]][chain[-1][1]]
+            self._counts[_MARBLE_INDEX[pushed_off]] -= 1
+        changed = tuple(((row, col), self._board[row][col]) for row, col in chain)
+        self._hash ^= self._chain_key(chain)
+
+        # move each marble one tile forward, starting from the front of the chain
+        for index in range(len(chain) - 1, 0, -1):
+            row, col = chain[index]
+            from_row, from_col = chain[index - 1]
+            self._board[row][col] = self._board[from_row][from_col]
+        self._board[position[0]][position[1]] = 'X'
+        self._hash ^= self._chain_key(chain)
+        return changed, pushed_off
+
+    def undo_move(self, record):
+        """
+        Takes back a push made by apply_move
+        Parameters: undo record (tuple) returned by apply_move
+        Returns: N/A
+        """
+        for (row, col), tile in record[0]:
+            self._hash ^= self._tile_key((row, col))
+            self._board[row][col] = tile
+            self._hash ^= self._tile_key((row, col))
+        if record[1] is not None:
+            self._counts[_MARBLE_INDEX[record[1]]] += 1
+
+    def get_changed(self, record):
+        """
+        Lists the tiles a push changed
+        Parameters: undo record (tuple) returned by apply_move
+        Returns: tuple of (position, tile before the push) pairs
+        """
+        return record[0]
+
+    def get_hash(self):
+        """
+        Getter method for the Zobrist hash of the marbles on the playing board
+        Parameters: N/A
+        Returns: 64-bit board hash (number)
+        """
+        return self._hash
+
+    def get_push_hash(self, position, direction, chain=None):
+        """
+        Finds the board hash a push would produce without changing the board
+        Parameters: tile position (tuple) and direction (string), and optionally the push
+            chain from get_push_chain, if the caller already has it
+        Returns: 64-bit board hash (number)
+        """
+        if chain is None:
+            chain = self.get_push_chain(position, direction)
+        board_hash = self._hash ^ self._chain_key(chain)
+        keys = self._geometry.keys
+        width = self._geometry.width
+
+        # each tile in the chain takes the marble from the tile behind it
+        for index in range(1, len(chain)):
+            from_row, from_col = chain[index - 1]
+            tile = self._board[from_row][from_col]
+            if tile in MARBLES:
+                row, col = chain[index]
+                board_hash ^= keys[tile][row * width + col]
+        return board_hash
+
+    def _tile_key(self, position):
+        """
+        Returns the Zobrist key of the marble on a tile (0 for empty and tray tiles)
+        """
+        tile = self._board[position[0]][position[1]]
+        if tile in MARBLES:
+            return self._geometry.keys[tile][position[0] * self._geometry.width + position[1]]
+        return 0
+
+    def _chain_key(self, chain):
+        """
+        Returns the combined Zobrist key of the marbles on a list of tiles
+        """
+        key = 0
+        for position in chain:
+            key ^= self._tile_key(position)
+        return key
+
+    def get_push_chain(self, position, direction):
+        """
+        Finds the tiles a push would move without changing the board
+        Parameters: tile position (tuple) and direction (string)
+        Returns: list of tile positions (tuples) from the pushed marble up to and
+            including the first empty or tray tile in front of the chain
+        """
+        row_step, col_step = _STEPS[direction]
+        row, col = position
+        chain = [(row, col)]
+        while self._board[row][col] in MARBLES:
+            row += row_step
+            col += col_step
+            chain.append((row, col))
+        return chain
+
+    def get_pushed_off(self, position, direction):
+        """
+        Finds the marble a push would push off the board without changing the board
+        Parameters: tile position (tuple) and direction (string)
+        Returns: marble color as a string ('W', 'B', 'R') or None if no marble would
+            leave the board
+        """
+        chain = self.get_push_chain(position, direction)
+        end_row, end_col = chain[-1]
+        edge = self._geometry.edge
+        if len(chain) > 1 and (end_row in edge or end_col in edge):
+            return self._board[chain[-2][0]][chain[-2][1]]
+        return None
+
+    def legal_pushes(self, color, is_repeat, board_prev=None):
+        """
+        Finds every push of a color's marbles the rules allow in one pass over the board.
+            Practically, this method walks each push chain once and derives the push room
+            and self capture rules from that chain, and checks the repetition rule with the
+            board hash the push would produce, so no hypothetical board copies are made.
+        Parameters: marble color of the player ('W' or 'B'), function taking a board hash
+            and returning True if the repetition rule forbids that board, and the packed
+            previous board (not needed here, see BitBoard.legal_pushes)
+        Returns: list of (position (tuple), direction (string)) pairs, with positions in
+            make_move coordinates, row by row and in DIRECTIONS order for each marble
+        """
+        board = self._board
+        edge = self._geometry.edge
+        play_range = self._geometry.play_range
+
+        moves = []
+        for row in play_range:
+            for col in play_range:
+                if board[row][col] != color:
+                    continue
+                for direction in DIRECTIONS:
+                    # the tile the marble is pushed from must be empty or the tray
+                    behind_row, behind_col = _BEHIND[direction]
+                    if board[row + behind_row][col + behind_col] in MARBLES:
+                        continue
+
+                    chain = self.get_push_chain((row, col), direction)
+                    end_row, end_col = chain[-1]
+                    if end_row in edge or end_col in edge:
+                        # the last marble in the chain is pushed off the board
+                        last_row, last_col = chain[-2]
+                        if board[last_row][last_col] == color:
+                            continue
+                    elif is_repeat(self.get_push_hash((row, col), direction, chain)):
+                        # only a push that keeps every marble can repeat an earlier board
+                        continue
+                    moves.append(((row - 1, col - 1), direction))
+        return moves
+
     def get_tile(self, position):
         """
         Getter method for a given tile's status
@@ -561,18 +1584,615 @@ class GameBoard:
         Parameters: N/A
         Returns: count of each marble on the board (tuple) (# white marbles, # black, # red)
         """
-        red_count = 0
-        black_count = 0
-        white_count = 0
-        for row in self._board[1:8]:                    # only count marbles on the playing board
-            for tile in row[1:8]:
-                if tile == 'R':
-                    red_count += 1
-                elif tile == 'B':
-                    black_count += 1
-                elif tile == 'W':
-                    white_count += 1
-        return white_count, black_count, red_count      # returns a tuple of these values
+        return tuple(self._counts)      # kept up to date by every push
+
+
+class BitBoard:
+    """
+    This class represents the physical playing board like GameBoard does, but it packs
+        the board into three integer bitmasks (one each for the W, B and R marbles).
+        Pushes become shift and mask operations over the precomputed rays and lines of
+        the board's _Geometry, legal pushes are found for every marble of a color at
+        once, and marble counts are kept up to date by every capture.
+    It exposes the same public methods as GameBoard, so KubaGame can use it as a
+        drop-in board backend. get_board() and get_tile() still return the list of lists
+        view, but that view is a snapshot: changing it does not change the board.
+    This class does not communicate with other classes.
+    """
+    __slots__ = ('_white', '_black', '_red', '_hash', '_counts', '_ruleset', '_geometry')
+
+    def __init__(self, ruleset=None):
+        """
+        Initialize the board to starting marble positions
+            by packing the ruleset's starting layout into bitmasks.
+        Parameters: Ruleset object giving the board size and starting layout (STANDARD by
+            default)
+        Returns: N/A
+        """
+        if ruleset is None:
+            ruleset = STANDARD
+        self._ruleset = ruleset
+        self._geometry = ruleset.get_geometry()
+        # the starting masks of a ruleset are packed once, by the first board to use them
+        start = _START_POSITIONS.get(ruleset)
+        if start is None:
+            masks = _board_masks(ruleset.get_board(), self._geometry)
+            start = _START_POSITIONS[ruleset] = masks, _mask_key(self._geometry.keys, *masks)
+        (self._white, self._black, self._red), self._hash = start
+        # number of W, B and R marbles on the playing board, replaced by every capture
+        #  (a tuple, so boards share it until then)
+        self._counts = ruleset.get_marble_count()
+
+    def __deepcopy__(self, memo):
+        """copies the masks (integers, so immutable); the ruleset and geometry are shared"""
+        if _instrumentation is not None:
+            _instrumentation.record_deepcopy()
+        board = BitBoard.__new__(BitBoard)
+        board._white, board._black, board._red = self._white, self._black, self._red
+        board._hash = self._hash
+        board._counts = self._counts
+        board._ruleset = self._ruleset
+        board._geometry = self._geometry
+        return board
+
+    def get_ruleset(self):
+        """returns the Ruleset the board was set up with"""
+        return self._ruleset
+
+    def set_board(self, board):
+        """
+        Replaces the marbles on the playing board (the tray is cleared)
+        Parameters: game board (list of lists) in the tray-border layout of this board's size
+        Returns: N/A
+        """
+        self._white, self._black, self._red = _board_masks(board, self._geometry)
+        self._hash = _mask_key(self._geometry.keys, self._white, self._black, self._red)
+        self._counts = (self._white.bit_count(), self._black.bit_count(), self._red.bit_count())
+
+    def clear_tray(self):
+        """
+        Clears the game board tray
+        Parameters: N/A
+        Returns: N/A
+        """
+        play_mask = self._geometry.play_mask
+        self._white &= play_mask
+        self._black &= play_mask
+        self._red &= play_mask
+
+    def get_board(self):
+        """
+        Getter method for a list of lists view of the game board. The view is built on
+            every call and not kept, so an idle board holds only its bitmasks: the empty
+            board is copied and each marble is set in it.
+        Parameters: N/A
+        Returns: game board (list)
+        """
+        positions = self._geometry.positions
+        board = [list(row) for row in self._geometry.empty_board]
+        for tile, mask in (('W', self._white), ('B', self._black), ('R', self._red)):
+            while mask:
+                low = mask & -mask
+                row, col = positions[low.bit_length() - 1]
+                board[row][col] = tile
+                mask ^= low
+        return board
+
+    def pack_board(self, board=None):
+        """
+        Packs the three bitmasks of a board into 3 bits per tile, tray included (31 bytes
+            on the standard board)
+        Parameters: game board (list of lists), or None for this board
+        Returns: bytes
+        """
+        if board is None:
+            white, black, red = self._white, self._black, self._red
+        else:
+            white, black, red = _board_masks(board, self._geometry)
+        bits = self._geometry.width ** 2
+        return (white | black << bits | red << 2 * bits).to_bytes((3 * bits + 7) // 8, 'little')
+
+    def unpack_board(self, data):
+        """
+        Unpacks a board packed by pack_board
+        Parameters: bytes
+        Returns: game board (list of lists) with a clear tray
+        """
+        board = BitBoard.__new__(BitBoard)
+        board._geometry = self._geometry
+        board._white, board._black, board._red = self._unpack_masks(data)
+        board.clear_tray()
+        return board.get_board()
+
+    def _unpack_masks(self, data):
+        """returns the (white, black, red) masks of a board packed by pack_board"""
+        bits = self._geometry.width ** 2
+        board_mask = self._geometry.board_mask
+        masks = int.from_bytes(data, 'little')
+        return masks & board_mask, masks >> bits & board_mask, masks >> 2 * bits
+
+    def _push_run(self, index, direction, occupied):
+        """
+        Masks a push: the run of marbles from the pushed marble (at bit index, which must
+            hold a marble) up to the first empty or tray tile ahead, and that tile
+        Returns: (run mask, bit of the tile in front of the run)
+        """
+        geometry = self._geometry
+        free = geometry.rays[direction][index] & ~(occupied & geometry.play_mask)
+        bit = 1 << index
+        if geometry.shifts[direction] > 0:
+            end = free & -free
+            return (end - bit) & geometry.lines[direction][index], end
+        end = 1 << (free.bit_length() - 1)
+        return ((bit << 1) - (end << 1)) & geometry.lines[direction][index], end
+
+    def _run_key(self, run, direction):
+        """returns the board hash change of moving every marble of a run one step"""
+        move_keys = self._geometry.move_keys[direction]
+        key = 0
+        for tile, mask in (('W', self._white & run), ('B', self._black & run),
+                           ('R', self._red & run)):
+            tile_keys = move_keys[tile]
+            while mask:
+                low = mask & -mask
+                key ^= tile_keys[low.bit_length() - 1]
+                mask ^= low
+        return key
+
+    def push_marble(self, position, direction):
+        """
+        Pushes a the marble in the given position in the given direction,
+                  pushing all marbles in front of it too
+            Practically, this method masks the run of marbles from the pushed marble up to
+             the first empty (or tray) tile ahead of it and shifts that run one tile in
+             every color mask. A marble pushed off the board is left in the tray, like
+             GameBoard does.
+        Parameters: tile position (tuple) and direction (string)
+        Returns: None
+        """
+        geometry = self._geometry
+        if direction not in geometry.shifts:
+            return
+        index = position[0] * geometry.width + position[1]
+        if not ((self._white | self._black | self._red) >> index) & 1:
+            return      # nothing to push, matching GameBoard
+        run, end = self._push_run(index, direction, self._white | self._black | self._red)
+        self._hash ^= self._run_key(run, direction)
+        self._shift_run(run, geometry.shifts[direction])
+        if not end & geometry.play_mask:
+            # the front marble of the run is pushed into the tray
+            self._counts = self._counts_without(end)
+
+    def _shift_run(self, run, shift):
+        """moves the marbles of a run one step (a shift of the bits) in every color mask"""
+        if shift > 0:
+            moved = self._white & run
+            self._white ^= moved ^ (moved << shift)
+            moved = self._black & run
+            self._black ^= moved ^ (moved << shift)
+            moved = self._red & run
+            self._red ^= moved ^ (moved << shift)
+        else:
+            moved = self._white & run
+            self._white ^= moved ^ (moved >> -shift)
+            moved = self._black & run
+            self._black ^= moved ^ (moved >> -shift)
+            moved = self._red & run
+            self._red ^= moved ^ (moved >> -shift)
+
+    def apply_move(self, position, direction):
+        """
+        Pushes a marble like push_marble, then clears any marble pushed into the tray
+        Parameters: tile position (tuple) and direction (string)
+        Returns: undo record (tuple) for undo_move: the mask of the changed tiles (see
+            get_changed), the marble pushed off the board (None if no marble left the
+            board) and the masks, hash and marble counts from before the push
+        """
+        geometry = self._geometry
+        white, black, red, board_hash = self._white, self._black, self._red, self._hash
+        counts = self._counts
+        index = position[0] * geometry.width + position[1]
+        occupied = white | black | red
+        if not (occupied >> index) & 1:
+            return 0, None, white, black, red, board_hash, counts
+        run, end = self._push_run(index, direction, occupied)
+        self._hash ^= self._run_key(run, direction)
+        self._shift_run(run, geometry.shifts[direction])
+
+        pushed_off = None
+        if end & geometry.play_mask:
+            run |= end
+        else:
+            self._counts = self._counts_without(end)
+            if self._white & end:
+                pushed_off = 'W'
+                self._white ^= end
+            elif self._black & end:
+                pushed_off = 'B'
+                self._black ^= end
+            else:
+                pushed_off = 'R'
+                self._red ^= end
+        return run, pushed_off, white, black, red, board_hash, counts
+
+    def undo_move(self, record):
+        """
+        Takes back a push made by apply_move
+        Parameters: undo record (tuple) returned by apply_move
+        Returns: N/A
+        """
+        _, _, self._white, self._black, self._red, self._hash, self._counts = record
+
+    def _counts_without(self, bit):
+        """returns the marble counts with the marble on one bit taken off the board"""
+        white, black, red = self._counts
+        if self._white & bit:
+            return white - 1, black, red
+        if self._black & bit:
+            return white, black - 1, red
+        return white, black, red - 1
+
+    def get_changed(self, record):
+        """
+        Lists the tiles a push changed
+        Parameters: undo record (tuple) returned by apply_move
+        Returns: tuple of (position, tile before the push) pairs
+        """
+        changed, _, white, black, red, _, _ = record
+        positions = self._geometry.positions
+        tiles = []
+        while changed:
+            low = changed & -changed
+            tile = 'W' if white & low else 'B' if black & low else 'R' if red & low else 'X'
+            tiles.append((positions[low.bit_length() - 1], tile))
+            changed ^= low
+        return tuple(tiles)
+
+    def get_hash(self):
+        """
+        Getter method for the Zobrist hash of the marbles on the playing board
+        Parameters: N/A
+        Returns: 64-bit board hash (number)
+        """
+        return self._hash
+
+    def get_push_hash(self, position, direction, chain=None):
+        """
+        Finds the board hash a push would produce without changing the board
+        Parameters: tile position (tuple) and direction (string), and optionally the push
+            chain from get_push_chain (not needed: the run of marbles is masked directly)
+        Returns: 64-bit board hash (number)
+        """
+        index = position[0] * self._geometry.width + position[1]
+        occupied = self._white | self._black | self._red
+        if not (occupied >> index) & 1:
+            return self._hash
+        run, _ = self._push_run(index, direction, occupied)
+        return self._hash ^ self._run_key(run, direction)
+
+    def get_push_chain(self, position, direction):
+        """
+        Finds the tiles a push would move without changing the board
+        Parameters: tile position (tuple) and direction (string)
+        Returns: list of tile positions (tuples) from the pushed marble up to and
+            including the first empty or tray tile in front of the chain
+        """
+        geometry = self._geometry
+        index = position[0] * geometry.width + position[1]
+        occupied = self._white | self._black | self._red
+        if not (occupied >> index) & 1:
+            return [tuple(position)]
+        # count the steps to the first free tile ahead, which ends the chain
+        free = geometry.rays[direction][index] & ~(occupied & geometry.play_mask)
+        shift = geometry.shifts[direction]
+        if shift > 0:
+            steps = ((free & -free).bit_length() - 1 - index) // shift
+        else:
+            steps = (index - free.bit_length() + 1) // -shift
+        return list(geometry.ray_positions[direction][index][:steps + 1])
+
+    def get_pushed_off(self, position, direction):
+        """
+        Finds the marble a push would push off the board without changing the board
+        Parameters: tile position (tuple) and direction (string)
+        Returns: marble color as a string ('W', 'B', 'R') or None if no marble would
+            leave the board
+        """
+        geometry = self._geometry
+        index = position[0] * geometry.width + position[1]
+        occupied = (self._white | self._black | self._red) & geometry.play_mask
+        if not (occupied >> index) & 1:
+            return None
+        # the push captures if every tile ahead of the marble up to the tray holds one
+        ray = geometry.rays[direction][index] & geometry.play_mask
+        if occupied & ray != ray:
+            return None
+        front = geometry.fronts[direction][index]
+        return 'W' if self._white & front else 'B' if self._black & front else 'R'
+
+    def legal_pushes(self, color, is_repeat, board_prev=None):
+        """
+        Finds every push of a color's marbles the rules allow, for all of its marbles at
+            once. For each direction, a shift of the occupied tiles finds the marbles with
+            room to be pushed, and a fill from the edge back through the occupied tiles
+            finds the marbles whose push drops a marble off the board (and which of those
+            would drop one of the player's own). Only pushes that capture nothing can
+            repeat a board; their hashes are only worked out when they could.
+        Parameters: marble color of the player ('W' or 'B'), function taking a board hash
+            and returning True if the repetition rule forbids that board, and optionally
+            the packed board (see pack_board) of the previous turn when it is the only
+            board the rule forbids (REPEAT_PREVIOUS)
+        Returns: list of (position (tuple), direction (string)) pairs, with positions in
+            make_move coordinates, in the order GameBoard.legal_pushes finds them
+        """
+        geometry = self._geometry
+        play_mask = geometry.play_mask
+        white, black = self._white & play_mask, self._black & play_mask
+        occupied = white | black | (self._red & play_mask)
+        own = white if color == 'W' else black
+
+        # a push changes tiles on one row or column only, so it can only repeat a board
+        #  that differs from this one on a single line: find the row and column that would
+        #  have to hold every difference (-1 when none does)
+        repeat_row = repeat_col = -1
+        if board_prev is not None:
+            prev_white, prev_black, prev_red = self._unpack_masks(board_prev)
+            differ = ((white ^ prev_white) | (black ^ prev_black)
+                      | (self._red ^ prev_red)) & play_mask
+            if differ:
+                row, col = geometry.positions[differ.bit_length() - 1]
+                if not differ & ~geometry.lines['R'][row * geometry.width + col]:
+                    repeat_row = row
+                if not differ & ~geometry.lines['F'][row * geometry.width + col]:
+                    repeat_col = col
+
+        # (direction, marbles with a legal push that way, marbles whose push captures)
+        pushes = []
+        for direction in DIRECTIONS:
+            shift = geometry.shifts[direction]
+            if shift > 0:
+                movable = own & ~(occupied << shift)
+            else:
+                movable = own & ~(occupied >> -shift)
+            # fill back from the edge through unbroken runs of marbles
+            edge = geometry.edges[direction]
+            reach = occupied & edge
+            own_reach = own & edge
+            while True:
+                if shift > 0:
+                    grown = reach | (reach >> shift) & occupied
+                    own_grown = own_reach | (own_reach >> shift) & occupied
+                else:
+                    grown = reach | (reach << -shift) & occupied
+                    own_grown = own_reach | (own_reach << -shift) & occupied
+                if grown == reach and own_grown == own_reach:
+                    break
+                reach, own_reach = grown, own_grown
+            pushes.append((direction, movable & ~own_reach, movable & reach))
+
+        moves = []
+        coordinates = geometry.coordinates
+        marbles = own
+        while marbles:
+            low = marbles & -marbles
+            index = low.bit_length() - 1
+            marbles ^= low
+            for direction, legal, captures in pushes:
+                if not legal & low:
+                    continue
+                if not captures & low:
+                    row, col = geometry.positions[index]
+                    if board_prev is None or (row == repeat_row if direction in 'LR'
+                                              else col == repeat_col):
+                        run, _ = self._push_run(index, direction, occupied)
+                        if is_repeat(self._hash ^ self._run_key(run, direction)):
+                            continue
+                moves.append((coordinates[index], direction))
+        return moves
+
+    def get_tile(self, position):
+        """
+        Getter method for a given tile's status
+        Parameters: tile position (tuple)
+        Returns: status of given tile (string)
+        """
+        row, col = position
+        bit = 1 << (row * self._geometry.width + col)
+        if self._white & bit:
+            return 'W'
+        if self._black & bit:
+            return 'B'
+        if self._red & bit:
+            return 'R'
+        return self._geometry.empty_board[row][col]
+
+    def get_marble_count(self):
+        """
+        Getter method for the number of each marble on the board
+        Parameters: N/A
+        Returns: count of each marble on the board (tuple) (# white marbles, # black, # red)
+        """
+        return self._counts      # kept up to date by every capture
+
+
+def _mask_key(keys, white, black, red):
+    """
+    Returns the combined Zobrist key of the marbles set in the given color bitmasks
+    """
+    key = 0
+    for tile, mask in (('W', white), ('B', black), ('R', red)):
+        tile_keys = keys[tile]
+        while mask:
+            low = mask & -mask
+            key ^= tile_keys[low.bit_length() - 1]
+            mask ^= low
+    return key
+
+
+def _board_masks(board, geometry):
+    """
+    Packs the playing area of a list of lists board into (white, black, red) bitmasks
+    """
+    width = geometry.width
+    white = black = red = 0
+    for row in geometry.play_range:
+        tiles = board[row]
+        for col in geometry.play_range:
+            tile = tiles[col]
+            if tile == 'W':
+                white |= 1 << (row * width + col)
+            elif tile == 'B':
+                black |= 1 << (row * width + col)
+            elif tile == 'R':
+                red |= 1 << (row * width + col)
+    return white, black, red
+
+
+# BitBoard starting positions: Ruleset -> ((white, black, red) masks, board hash), filled
+#  in as rulesets are first used
+_START_POSITIONS = {}
+
+
+# the (direction, step) pairs of the lines a PositionAnalysis keeps: pushes along a row,
+#  then pushes along a column (see _Geometry.line_tiles)
+_LINE_DIRECTIONS = (('L', -1), ('R', 1)), (('F', -1), ('B', 1))
+
+
+class PositionAnalysis:
+    """
+    This class keeps a summary of what each side can do from a position: every push the
+        push room and self capture rules allow, which of those push off a red or an
+        opposing marble, and which marbles the opponent could push off next move.
+    Practically, a push only depends on the row or column it is made along, so the pushes
+        are kept per line. After a move only the lines with a changed tile (the line of
+        the push and the lines crossing it at the moved marbles) are recomputed.
+    The repetition rule is not applied: it depends on the game history, and it can only
+        remove pushes that capture nothing. KubaGame.legal_moves still applies it.
+    This class communicates with the following classes:
+     - GameBoard, BitBoard: PositionAnalysis reads the tiles of the board it analyzes.
+    """
+    __slots__ = ('_board', '_geometry', '_lines', '_counts', '_mobility')
+
+    def __init__(self, board):
+        """
+        Analyzes every line of a board
+        Parameters: GameBoard or BitBoard object (kept and read on every update)
+        Returns: N/A
+        """
+        self._board = board
+        self._geometry = board.get_ruleset().get_geometry()
+        self._lines = [()] * len(self._geometry.line_tiles)
+        self._counts = [(0, 0)] * len(self._geometry.line_tiles)
+        self._mobility = {'W': 0, 'B': 0}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Recomputes every line, for when the whole board has been replaced
+        Parameters: N/A
+        Returns: N/A
+        """
+        for line in range(len(self._geometry.line_tiles)):
+            self._update_line(line)
+
+    def update(self, changed):
+        """
+        Recomputes the lines through a move's changed tiles
+        Parameters: the changed tiles of a board undo record, as (position, tile) pairs
+        Returns: N/A
+        """
+        rows = set()
+        cols = set()
+        for (row, col), _ in changed:
+            rows.add(row)
+            cols.add(col)
+        size = self._geometry.size
+        for row in rows:
+            if 1 <= row <= size:
+                self._update_line(row - 1)
+        for col in cols:
+            if 1 <= col <= size:
+                self._update_line(col - 1 + size)
+
+    def _update_line(self, line):
+        """
+        Finds the pushes along one line and updates the mobility totals
+        """
+        line_tiles = self._geometry.line_tiles[line]
+        size = self._geometry.size
+        tiles = list(map(self._board.get_tile, line_tiles))
+        directions = _LINE_DIRECTIONS[line // size]
+        pushes = []
+        white = black = 0
+        for index in range(1, size + 1):
+            color = tiles[index]
+            if color != 'W' and color != 'B':
+                continue
+            for direction, step in directions:
+                # the tile the marble is pushed from must be empty or the tray
+                if tiles[index - step] in MARBLES:
+                    continue
+                end = index + step
+                while tiles[end] in MARBLES:
+                    end += step
+                pushed_off = None
+                pushed_position = None
+                if end == 0 or end == size + 1:
+                    pushed_off = tiles[end - step]
+                    if pushed_off == color:
+                        continue
+                    row, col = line_tiles[end - step]
+                    pushed_position = (row - 1, col - 1)
+                row, col = line_tiles[index]
+                pushes.append((color, (row - 1, col - 1), direction, pushed_off, pushed_position))
+                if color == 'W':
+                    white += 1
+                else:
+                    black += 1
+
+        old_white, old_black = self._counts[line]
+        self._mobility['W'] += white - old_white
+        self._mobility['B'] += black - old_black
+        self._counts[line] = (white, black)
+        self._lines[line] = pushes
+
+    def get_mobility(self, color):
+        """
+        Returns the number of pushes a color can make
+        Parameters: marble color ('W' or 'B')
+        Returns: number of pushes
+        """
+        return self._mobility[color]
+
+    def get_pushes(self, color):
+        """
+        Returns the pushes a color can make
+        Parameters: marble color ('W' or 'B')
+        Returns: list of (position (tuple), direction (string)) pairs, with positions in
+            the same coordinates make_move takes
+        """
+        return [(push[1], push[2]) for pushes in self._lines for push in pushes
+                if push[0] == color]
+
+    def get_threats(self, color):
+        """
+        Returns the pushes with which a color would push a red or an opposing marble off
+            the board
+        Parameters: marble color ('W' or 'B')
+        Returns: list of (position (tuple), direction (string), color pushed off (string))
+        """
+        return [(push[1], push[2], push[3]) for pushes in self._lines for push in pushes
+                if push[0] == color and push[3] is not None]
+
+    def get_exposed(self, color):
+        """
+        Returns the marbles of a color the other player (either player, for reds) could
+            push off the board next move
+        Parameters: marble color ('W', 'B' or 'R')
+        Returns: sorted list of positions (tuples) in make_move coordinates
+        """
+        return sorted({push[4] for pushes in self._lines for push in pushes
+                       if push[3] == color and push[0] != color})
 
 
 class Player:
@@ -582,6 +2202,8 @@ class Player:
     This class does not communicate with other classes. It produces a sovereign player
         object. It is used by the KubaGame class though.
     """
+    __slots__ = ('_name', '_color', '_captured')
+
     def __init__(self, name, color):
         """
         Init method for Player class data members
@@ -624,6 +2246,23 @@ class Player:
         """
         self._captured += 1
 
+    def remove_captured(self):
+        """
+        Takes a captured red marble back off the player's count of captured reds
+            (used when a move is undone)
+        Parameters: N/A
+        Returns: N/A
+        """
+        self._captured -= 1
+
+    def set_captured(self, captured):
+        """
+        Sets the player's count of captured reds (used when a saved game is loaded)
+        Parameters: number of captured red marbles
+        Returns: N/A
+        """
+        self._captured = captured
+
 
 class InvalidMoveError(Exception):
     """
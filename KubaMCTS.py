@@ -0,0 +1,252 @@
+# Description: This program is a Monte Carlo Tree Search player for Kuba. It runs UCT
+#               searches on a pool of worker processes and merges the statistics of the
+#               root moves.
+import math
+import multiprocessing
+import random
+import time
+
+from KubaGame import BitBoard, MARBLES
+
+# playout policies
+RANDOM_PLAYOUT = 'random'
+CAPTURE_PLAYOUT = 'capture'
+
+
+class MCTSNode:
+    """
+    This class represents one position in a Monte Carlo search tree.
+    The wins of a node are counted for the player who made the move leading to it.
+    This class does not communicate with other classes. It is used by MCTSPlayer.
+    """
+    __slots__ = ('move', 'parent', 'player_name', 'children', 'untried', 'visits', 'wins')
+
+    def __init__(self, move, parent, player_name, untried):
+        """
+        Init method for MCTSNode data members
+        Parameters: move leading to this node (or None for the root), parent node (or None),
+            name of the player who made the move (string), legal moves not yet expanded (list)
+        Returns: N/A
+        """
+        self.move = move
+        self.parent = parent
+        self.player_name = player_name
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.wins = 0.0
+
+    def select_child(self, exploration):
+        """
+        Picks the child with the best UCT score
+        Parameters: exploration constant (number)
+        Returns: MCTSNode object
+        """
+        log_visits = math.log(self.visits)
+        best_child = None
+        best_score = -1.0
+        for child in self.children:
+            score = (child.wins / child.visits
+                     + exploration * math.sqrt(log_visits / child.visits))
+            if score > best_score:
+                best_score = score
+                best_child = child
+        return best_child
+
+
+class MCTSPlayer:
+    """
+    This class is a computer player that chooses moves with Monte Carlo Tree Search (UCT).
+    Practically, each worker process builds its own search tree from the same position
+        (root parallelization) and returns the visits and wins of every root move. The
+        statistics are summed over the workers and the most visited move is played.
+        Playouts use KubaGame.legal_moves, apply_move and undo_move, so they never copy
+        the game. The search runs on a copy of the game on the board backend given to
+        the player, BitBoard by default: from the starting position it plays random
+        playouts at 30 us per move against 55 us on GameBoard, and capture playouts at
+        44 against 84 us.
+    This class communicates with the following classes:
+     - KubaGame: MCTSPlayer searches copies of the game it is given (see KubaGame.copy).
+     - MCTSNode: MCTSPlayer builds its search trees out of MCTSNode objects.
+    """
+    def __init__(self, processes=None, exploration=1.4, playout=RANDOM_PLAYOUT,
+                 max_playout=200, seed=None, board_class=BitBoard):
+        """
+        Init method for MCTSPlayer data members
+        Parameters: number of worker processes (all cores by default, 1 searches in this
+            process), UCT exploration constant (number), playout policy (RANDOM_PLAYOUT or
+            CAPTURE_PLAYOUT), longest playout in plies before it is scored as a draw (number),
+            random seed (number or None), board backend class the search runs on
+        Returns: N/A
+        """
+        if playout not in (RANDOM_PLAYOUT, CAPTURE_PLAYOUT):
+            raise ValueError("unknown playout policy: " + str(playout))
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self._processes = processes
+        self._exploration = exploration
+        self._playout = playout
+        self._max_playout = max_playout
+        self._random = random.Random(seed)
+        self._board_class = board_class
+        self._pool = None
+
+    def close(self):
+        """
+        Shuts down the worker pool
+        Parameters: N/A
+        Returns: N/A
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def search(self, game, player_name, iterations=10000, time_ms=None):
+        """
+        Runs the search and returns the statistics of every root move
+        Parameters: KubaGame object, name of the player to move (string), total number of
+            search iterations over all workers (number), optional time budget in milliseconds
+        Returns: dictionary of move -> (visits, wins), with moves as (position, direction)
+        """
+        game = game.copy(self._board_class)
+        jobs = []
+        per_worker = max(1, iterations // self._processes)
+        for _ in range(self._processes):
+            jobs.append((game, player_name, per_worker, time_ms, self._exploration,
+                         self._playout, self._max_playout, self._random.getrandbits(64)))
+
+        if self._processes == 1:
+            results = [_search_worker(jobs[0])]
+        else:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self._processes)
+            results = self._pool.map(_search_worker, jobs)
+
+        # merge the root statistics of every worker's tree
+        stats = {}
+        for worker_stats in results:
+            for move, (visits, wins) in worker_stats.items():
+                total_visits, total_wins = stats.get(move, (0, 0.0))
+                stats[move] = (total_visits + visits, total_wins + wins)
+        return stats
+
+    def choose_move(self, game, player_name, iterations=10000, time_ms=None):
+        """
+        Returns the most visited root move
+        Parameters: KubaGame object, name of the player to move (string), total number of
+            search iterations (number), optional time budget in milliseconds
+        Returns: move as (position, direction), or None if the player has no legal move
+        """
+        stats = self.search(game, player_name, iterations, time_ms)
+        if not stats:
+            return None
+        return max(stats, key=lambda move: stats[move][0])
+
+
+def _search_worker(job):
+    """
+    Builds one UCT search tree and returns the statistics of its root moves.
+        Runs in a worker process, so it only takes and returns picklable values.
+    Parameters: tuple of (KubaGame object, player name, iterations, time budget in ms or None,
+        exploration constant, playout policy, longest playout, random seed)
+    Returns: dictionary of move -> (visits, wins)
+    """
+    game, player_name, iterations, time_ms, exploration, playout, max_playout, seed = job
+    rng = random.Random(seed)
+    deadline = None if time_ms is None else time.perf_counter() + time_ms / 1000.0
+    other_name = game.get_other_player(player_name).get_name()
+    root = MCTSNode(None, None, other_name, game.legal_moves(player_name))
+
+    for iteration in range(iterations):
+        if deadline is not None and iteration % 16 == 0 and time.perf_counter() >= deadline:
+            break
+        node = root
+        records = []
+
+        # selection: walk down fully expanded nodes
+        while not node.untried and node.children:
+            node = node.select_child(exploration)
+            mover = node.player_name
+            records.append(game.apply_move(mover, node.move[0], node.move[1]))
+
+        # expansion: add one untried move
+        if node.untried and game.get_winner() is None:
+            move = node.untried.pop(rng.randrange(len(node.untried)))
+            mover = _next_player(node, player_name, other_name)
+            records.append(game.apply_move(mover, move[0], move[1]))
+            next_name = other_name if mover == player_name else player_name
+            child = MCTSNode(move, node, mover, game.legal_moves(next_name))
+            node.children.append(child)
+            node = child
+
+        # playout, then take back every move of this iteration
+        winner = _playout(game, node, player_name, other_name, playout, max_playout, rng, records)
+        for record in reversed(records):
+            game.undo_move(record)
+
+        # backpropagation
+        while node is not None:
+            node.visits += 1
+            if winner is None:
+                node.wins += 0.5
+            elif winner == node.player_name:
+                node.wins += 1.0
+            node = node.parent
+
+    return {child.move: (child.visits, child.wins) for child in root.children}
+
+
+def _next_player(node, player_name, other_name):
+    """
+    Returns the name of the player to move at a node
+    """
+    return other_name if node.player_name == player_name else player_name
+
+
+def _playout(game, node, player_name, other_name, playout, max_playout, rng, records):
+    """
+    Plays random (or capture-first) moves from a node until the game ends
+    Parameters: KubaGame object, the node to play out from, the two player names,
+        playout policy, longest playout in plies, random generator, list that collects
+        the undo records of the moves played
+    Returns: the winner's name, or None for a playout that hit max_playout
+    """
+    mover = _next_player(node, player_name, other_name)
+    for _ in range(max_playout):
+        winner = game.get_winner()
+        if winner is not None:
+            return winner
+        moves = game.legal_moves(mover)
+        if not moves:
+            # a player with no legal moves loses
+            return other_name if mover == player_name else player_name
+        move = None
+        if playout == CAPTURE_PLAYOUT:
+            move = _capture_move(game, mover, moves, rng)
+        if move is None:
+            move = moves[rng.randrange(len(moves))]
+        records.append(game.apply_move(mover, move[0], move[1]))
+        mover = other_name if mover == player_name else player_name
+    return game.get_winner()
+
+
+def _capture_move(game, player_name, moves, rng):
+    """
+    Returns a random move that pushes off a red or an opposing marble, if there is one
+    """
+    own_color = game.get_player(player_name).get_color()
+    captures = []
+    for move in moves:
+        pushed_off = game.get_pushed_off(move[0], move[1])
+        if pushed_off in MARBLES and pushed_off != own_color:
+            captures.append(move)
+    if captures:
+        return captures[rng.randrange(len(captures))]
+    return None
@@ -0,0 +1,117 @@
+# Description: This program counts the positions reachable from a Kuba position in exactly
+#               a given number of plies (perft), with the full rules of KubaGame: push room,
+#               self capture and the repetition rule. The counts check that a board backend
+#               generates the same moves as GameBoard, and the nodes per second compare the
+#               speed of the backends.
+import argparse
+import sys
+import time
+
+from KubaGame import KubaGame, GameBoard, BitBoard, Ruleset, STANDARD, REPEAT_PREVIOUS, \
+    REPEAT_SUPERKO
+
+BACKENDS = {'gameboard': GameBoard, 'bitboard': BitBoard}
+PLAYERS = (('White', 'W'), ('Black', 'B'))
+
+
+def perft(game, player_name, depth):
+    """
+    Counts the positions reached after exactly depth plies, starting with a player's move.
+        A game that is won before then adds nothing to the count. The moves are tried with
+        apply_move and taken back with undo_move, so the game ends as it started.
+    Parameters: KubaGame object, name of the player to move (string), depth in plies (number)
+    Returns: number of positions (leaf nodes)
+    """
+    if depth == 0:
+        return 1
+    moves = game.legal_moves(player_name)
+    if depth == 1:
+        # every legal move reaches one leaf, so the leaves don't need to be made
+        return len(moves)
+    other_name = game.get_other_player(player_name).get_name()
+    nodes = 0
+    for position, direction in moves:
+        record = game.apply_move(player_name, position, direction)
+        nodes += perft(game, other_name, depth - 1)
+        game.undo_move(record)
+    return nodes
+
+
+def divide(game, player_name, depth):
+    """
+    Splits a perft count by the first move, to find the move whose subtree differs
+        between two backends
+    Parameters: KubaGame object, name of the player to move (string), depth in plies (at
+        least 1)
+    Returns: list of ((position (tuple), direction (string)), number of positions) pairs,
+        in legal_moves order
+    """
+    other_name = game.get_other_player(player_name).get_name()
+    counts = []
+    for position, direction in game.legal_moves(player_name):
+        record = game.apply_move(player_name, position, direction)
+        counts.append(((position, direction), perft(game, other_name, depth - 1)))
+        game.undo_move(record)
+    return counts
+
+
+def run_perft(game, player_name, depth, split=False):
+    """
+    Times a perft count
+    Parameters: KubaGame object, name of the player to move (string), depth in plies
+        (number), True to split the count by the first move (see divide)
+    Returns: dictionary with 'depth', 'nodes', 'seconds', 'nodes_per_sec' and, when split,
+        'divide' (the divide list)
+    """
+    start = time.perf_counter()
+    if split and depth > 0:
+        counts = divide(game, player_name, depth)
+        nodes = sum(count for _, count in counts)
+    else:
+        counts = None
+        nodes = perft(game, player_name, depth)
+    seconds = time.perf_counter() - start
+    result = {'depth': depth, 'nodes': nodes, 'seconds': seconds,
+              'nodes_per_sec': nodes / seconds if seconds > 0 else 0.0}
+    if counts is not None:
+        result['divide'] = counts
+    return result
+
+
+def main(argv=None):
+    """
+    Command line entry point. Runs perft from the starting position on each chosen backend
+        and exits with status 1 if the backends' counts differ.
+    """
+    parser = argparse.ArgumentParser(description="Count Kuba positions N plies deep (perft)")
+    parser.add_argument('depth', type=int, help="plies to search")
+    parser.add_argument('--board', choices=sorted(BACKENDS) + ['both'], default='both',
+                        help="board backend(s) to count with (default both)")
+    parser.add_argument('--divide', action='store_true', help="split the count by the first move")
+    parser.add_argument('--size', type=int, default=None,
+                        help="play the standard layout scaled to this board size")
+    parser.add_argument('--superko', action='store_true',
+                        help="forbid repeating any earlier board, not just the previous one")
+    args = parser.parse_args(argv)
+
+    ruleset = STANDARD if args.size is None else Ruleset.scaled(args.size)
+    rule = REPEAT_SUPERKO if args.superko else REPEAT_PREVIOUS
+    backends = sorted(BACKENDS) if args.board == 'both' else [args.board]
+    totals = {}
+    for backend in backends:
+        game = KubaGame(PLAYERS[0], PLAYERS[1], BACKENDS[backend], rule, ruleset)
+        result = run_perft(game, PLAYERS[0][0], args.depth, args.divide)
+        for (position, direction), count in result.get('divide', ()):
+            print("%s %d %d %s: %d" % (backend, position[0], position[1], direction, count))
+        print("%s depth %d: %d nodes in %.3f s (%.0f nodes/sec)"
+              % (backend, args.depth, result['nodes'], result['seconds'], result['nodes_per_sec']))
+        totals[backend] = result['nodes']
+
+    if len(set(totals.values())) > 1:
+        sys.stderr.write("MISMATCH: %s\n" % ', '.join('%s %d' % item for item in totals.items()))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+# Description: This program stores Kuba games in a compact binary record: one byte per move
+#               (see KubaGame.encode_move) plus a board checkpoint every few moves, so a
+#               replayer can jump to any ply by loading the nearest checkpoint and replaying
+#               at most one interval of moves. Records can be concatenated into an archive.
+import struct
+
+from KubaGame import KubaGame, BitBoard, REPEAT_PREVIOUS, REPEAT_SUPERKO, STANDARD, decode_move, \
+    pack_tiles, unpack_tiles, PACKED_TILES_SIZE
+
+PLAYERS = (('White', 'W'), ('Black', 'B'))
+
+# plies between board checkpoints
+CHECKPOINT_INTERVAL = 32
+
+# record header: magic, format version, flags, winner, checkpoint interval, number of plies.
+#  The header is followed by the two players (name length, UTF-8 name, color), the move
+#  codes (one byte per ply) and the checkpoints (one after every CHECKPOINT_INTERVAL plies).
+_MAGIC = b'KUBR'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBBBHI')
+_SECOND_OPENED = 1      # flag: player 2 made the first move
+_SUPERKO = 2            # flag: the game was played with REPEAT_SUPERKO
+
+# checkpoint: the board and the previous board as packed tiles, the reds captured by each
+#  player and the turn and winner (0 for none, else 1 or 2 for a player)
+_CHECKPOINT_BYTES = 2 * PACKED_TILES_SIZE + 3
+
+
+class GameRecord:
+    """
+    This class represents one recorded game: the players, who moved first, the one-byte
+        move codes, the winner and the board checkpoints used to seek.
+    This class communicates with the following classes:
+     - KubaGame: GameRecord records a KubaGame's move log and rebuilds KubaGame objects
+            at any ply of the game.
+    """
+    def __init__(self, moves=b'', players=PLAYERS, first_player=None, winner=None,
+                 repetition_rule=REPEAT_PREVIOUS, interval=CHECKPOINT_INTERVAL, checkpoints=None):
+        """
+        Initializes a record
+        Parameters: move codes (bytes), the (name, color) pairs of player 1 and 2, name of
+            the player who moved first (player 1 by default), winner's name (or None),
+            repetition rule, plies between checkpoints, and optionally the packed
+            checkpoints (they are rebuilt by replaying the moves when not given)
+        Returns: N/A
+        """
+        if not 0 < interval < 65536:
+            raise ValueError("checkpoint interval must be 1-65535")
+        self._moves = bytes(moves)
+        self._players = (tuple(players[0]), tuple(players[1]))
+        self._second_opened = first_player is not None and first_player == players[1][0]
+        self._winner = winner
+        self._repetition_rule = repetition_rule
+        self._interval = interval
+        if checkpoints is None:
+            checkpoints = self._build_checkpoints()
+        self._checkpoints = checkpoints
+
+    @classmethod
+    def from_game(cls, game, players=PLAYERS, interval=CHECKPOINT_INTERVAL):
+        """
+        Records a game from its move log. Records hold games of the STANDARD ruleset only.
+        Parameters: KubaGame object, the (name, color) pairs the game was created with,
+            plies between checkpoints
+        Returns: GameRecord object
+        """
+        if game.get_ruleset() != STANDARD:
+            raise ValueError("records hold standard games only, not " + game.get_ruleset().get_name())
+        return cls(game.get_moves(), players, game.get_first_player(), game.get_winner(),
+                   game.get_repetition_rule(), interval)
+
+    def __len__(self):
+        return len(self._moves)
+
+    def get_moves(self):
+        """returns the move codes as bytes"""
+        return self._moves
+
+    def get_winner(self):
+        """returns the winner's name, or None if the game was not won"""
+        return self._winner
+
+    def get_player_names(self):
+        """returns the names of player 1 and player 2, in the order they moved"""
+        names = (self._players[0][0], self._players[1][0])
+        if self._second_opened:
+            return names[1], names[0]
+        return names
+
+    def get_move(self, ply):
+        """
+        Returns one move of the game
+        Parameters: ply index (number, 0 for the first move)
+        Returns: (player name (string), position (tuple), direction (string))
+        """
+        position, direction = decode_move(self._moves[ply])
+        return (self.get_player_names()[ply % 2],) + (position, direction)
+
+    def new_game(self, board_class=BitBoard):
+        """returns a KubaGame at the start of the recorded game"""
+        return KubaGame(self._players[0], self._players[1], board_class, self._repetition_rule)
+
+    def get_game(self, ply=None, board_class=BitBoard):
+        """
+        Rebuilds the game as it was after a number of moves, starting from the nearest
+            checkpoint before the ply, so at most one checkpoint interval is replayed.
+            The moves are trusted and made without data validation.
+        Parameters: number of moves to make (all of them by default), board backend class
+        Returns: KubaGame object
+        """
+        if ply is None:
+            ply = len(self._moves)
+        if not 0 <= ply <= len(self._moves):
+            raise IndexError("ply out of range")
+        game = self.new_game(board_class)
+        names = self.get_player_names()
+
+        start = min(ply // self._interval, len(self._checkpoints))
+        if start:
+            self._load_checkpoint(game, start - 1)
+            start *= self._interval
+        for index in range(start, ply):
+            position, direction = decode_move(self._moves[index])
+            game.apply_move(names[index % 2], position, direction)
+
+        # a player who resigned or had no legal moves lost without a move being made
+        if ply == len(self._moves) and self._winner is not None:
+            game.set_winner(self._winner)
+        return game
+
+    def iter_games(self, board_class=BitBoard):
+        """
+        Replays the whole game, yielding the game after each move (the same KubaGame
+            object each time)
+        Parameters: board backend class
+        Returns: generator of KubaGame objects
+        """
+        game = self.new_game(board_class)
+        names = self.get_player_names()
+        for index, code in enumerate(self._moves):
+            position, direction = decode_move(code)
+            game.apply_move(names[index % 2], position, direction)
+            yield game
+
+    def _player_index(self, name):
+        """returns 1 or 2 for a player's name and 0 for None"""
+        if name is None:
+            return 0
+        return 1 if name == self._players[0][0] else 2
+
+    def _build_checkpoints(self):
+        """
+        Replays the moves and packs a checkpoint after every interval plies
+        """
+        checkpoints = []
+        for index, game in enumerate(self.iter_games(), 1):
+            if index % self._interval == 0:
+                checkpoints.append(
+                    pack_tiles(game.get_board()) + pack_tiles(game.get_board_prev())
+                    + bytes((game.get_captured(self._players[0][0]),
+                             game.get_captured(self._players[1][0]),
+                             self._player_index(game.get_current_turn())
+                             | self._player_index(game.get_winner()) << 2)))
+        return checkpoints
+
+    def _load_checkpoint(self, game, index):
+        """
+        Sets up a game from one of the checkpoints
+        """
+        data = self._checkpoints[index]
+        names = (None, self._players[0][0], self._players[1][0])
+        ply = (index + 1) * self._interval
+        game.load_position(unpack_tiles(data[:PACKED_TILES_SIZE]),
+                           unpack_tiles(data[PACKED_TILES_SIZE:2 * PACKED_TILES_SIZE]),
+                           (data[-3], data[-2]), names[data[-1] & 3], names[data[-1] >> 2],
+                           self._moves[:ply], self.get_player_names()[0])
+
+    def to_bytes(self):
+        """
+        Packs the record into its binary format
+        Parameters: N/A
+        Returns: bytes
+        """
+        flags = 0
+        if self._second_opened:
+            flags |= _SECOND_OPENED
+        if self._repetition_rule == REPEAT_SUPERKO:
+            flags |= _SUPERKO
+        parts = [_HEADER.pack(_MAGIC, _VERSION, flags, self._player_index(self._winner),
+                              self._interval, len(self._moves))]
+        for name, color in self._players:
+            encoded = name.encode('utf-8')
+            parts.append(bytes((len(encoded),)) + encoded + color.encode('ascii'))
+        parts.append(self._moves)
+        parts.extend(bytes(checkpoint) for checkpoint in self._checkpoints)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        """
+        Reads a record from its binary format. The moves and checkpoints are kept as
+            views of the data, so reading from a memory-mapped archive copies nothing.
+        Parameters: bytes-like object (bytes, bytearray, mmap), offset of the record
+        Returns: (GameRecord object, offset just past the record)
+        """
+        data = memoryview(data)
+        magic, version, flags, winner, interval, plies = _HEADER.unpack_from(data, offset)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("not a version %d Kuba game record" % _VERSION)
+        offset += _HEADER.size
+
+        players = []
+        for _ in range(2):
+            length = data[offset]
+            name = bytes(data[offset + 1:offset + 1 + length]).decode('utf-8')
+            color = chr(data[offset + 1 + length])
+            players.append((name, color))
+            offset += length + 2
+
+        moves = data[offset:offset + plies]
+        offset += plies
+        checkpoints = []
+        for _ in range(plies // interval):
+            checkpoints.append(data[offset:offset + _CHECKPOINT_BYTES])
+            offset += _CHECKPOINT_BYTES
+
+        names = (None, players[0][0], players[1][0])
+        record = cls.__new__(cls)
+        record._moves = moves
+        record._players = tuple(players)
+        record._second_opened = bool(flags & _SECOND_OPENED)
+        record._winner = names[winner]
+        record._repetition_rule = REPEAT_SUPERKO if flags & _SUPERKO else REPEAT_PREVIOUS
+        record._interval = interval
+        record._checkpoints = checkpoints
+        return record, offset
+
+
+def iter_records(data):
+    """
+    Reads every record of an archive of concatenated records
+    Parameters: bytes-like object (bytes, bytearray, mmap)
+    Returns: generator of GameRecord objects
+    """
+    offset = 0
+    while offset < len(data):
+        record, offset = GameRecord.from_bytes(data, offset)
+        yield record
@@ -0,0 +1,186 @@
+# Description: This program plays large numbers of headless Kuba games between computer
+#               policies on a pool of worker processes and streams the results to disk.
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+from KubaGame import KubaGame, BitBoard, MARBLES
+from KubaEngine import KubaEngine
+from KubaRecord import GameRecord
+
+PLAYERS = (('White', 'W'), ('Black', 'B'))
+
+# move policies
+RANDOM_POLICY = 'random'
+GREEDY_POLICY = 'greedy'
+ENGINE_POLICY = 'engine'
+POLICIES = (RANDOM_POLICY, GREEDY_POLICY, ENGINE_POLICY)
+
+# one engine per worker process, created the first time a worker needs it
+_engines = {}
+
+
+def choose_move(policy, game, player_name, rng, engine_ms=100, engine_depth=64):
+    """
+    Picks a move for a player with one of the move policies:
+     - RANDOM_POLICY: any legal move
+     - GREEDY_POLICY: a move that pushes off a red, else one that pushes off an
+            opposing marble, else any legal move
+     - ENGINE_POLICY: the KubaEngine search result
+    Parameters: policy name (string), KubaGame object, name of the player to move (string),
+        random.Random object, engine time budget in milliseconds, engine depth limit
+    Returns: move as (position, direction), or None if the player has no legal move
+    """
+    moves = game.legal_moves(player_name)
+    if not moves:
+        return None
+
+    if policy == GREEDY_POLICY:
+        own_color = game.get_player(player_name).get_color()
+        reds = []
+        marbles = []
+        for move in moves:
+            pushed_off = game.get_pushed_off(move[0], move[1])
+            if pushed_off == 'R':
+                reds.append(move)
+            elif pushed_off in MARBLES and pushed_off != own_color:
+                marbles.append(move)
+        moves = reds or marbles or moves
+    elif policy == ENGINE_POLICY:
+        engine = _engines.get(player_name)
+        if engine is None:
+            engine = _engines[player_name] = KubaEngine()
+        return engine.search(game, player_name, time_ms=engine_ms, max_depth=engine_depth).move
+
+    return moves[rng.randrange(len(moves))]
+
+
+def play_game(job):
+    """
+    Plays one game between two policies, moving through KubaGame.make_move.
+        The game's random generator is seeded with its own seed, so a game can be
+        replayed exactly from its seed (the engine policy is only repeatable with a
+        depth limit and a generous time budget).
+    Parameters: tuple of (game number, seed, white policy, black policy, longest game
+        in plies, engine time budget in milliseconds, engine depth limit, True to
+        return the binary game record)
+    Returns: result dictionary (game, seed, winner, plies, captured reds per player, and
+        the packed GameRecord under 'record' when asked for)
+    """
+    number, seed, white_policy, black_policy, max_plies, engine_ms, engine_depth, record = job
+    rng = random.Random(seed)
+    game = KubaGame(PLAYERS[0], PLAYERS[1], board_class=BitBoard)
+    policies = {'White': white_policy, 'Black': black_policy}
+    for engine in _engines.values():
+        engine.clear()
+
+    # alternate which player opens the game
+    player_name = PLAYERS[number % 2][0]
+    plies = 0
+    while plies < max_plies and game.get_winner() is None:
+        move = choose_move(policies[player_name], game, player_name, rng, engine_ms, engine_depth)
+        if move is None:
+            # a player with no legal moves loses
+            game.set_winner(game.get_other_player(player_name).get_name())
+            break
+        game.make_move(player_name, move[0], move[1])
+        player_name = game.get_current_turn()
+        plies += 1
+
+    result = {'game': number,
+              'seed': seed,
+              'white': white_policy,
+              'black': black_policy,
+              'winner': game.get_winner(),
+              'plies': plies,
+              'captured': {'White': game.get_player('White').get_captured(),
+                           'Black': game.get_player('Black').get_captured()}}
+    if record:
+        result['record'] = GameRecord.from_game(game, PLAYERS).to_bytes()
+    return result
+
+
+def run_self_play(games, out_path, white_policy=RANDOM_POLICY, black_policy=RANDOM_POLICY,
+                  processes=None, seed=0, max_plies=500, engine_ms=100, engine_depth=64,
+                  window=None, report=None, records_path=None):
+    """
+    Plays a number of games on a process pool and writes one JSON line per game to a file
+        as each game finishes. Games are handed to the pool a window at a time, so only
+        that many games are ever waiting in memory.
+    Parameters: number of games, output file path, white and black policies, number of
+        worker processes (all cores by default), base seed (game N uses seed + N), longest
+        game in plies, engine time budget in ms, engine depth limit, number of games
+        queued at once, optional stream to print progress to, optional path of a
+        binary archive to append every game's GameRecord to (see KubaRecord)
+    Returns: summary dictionary (games, moves, seconds, games/sec, moves/sec, wins)
+    """
+    for policy in (white_policy, black_policy):
+        if policy not in POLICIES:
+            raise ValueError("unknown policy: " + str(policy))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if window is None:
+        window = processes * 256
+
+    start = time.perf_counter()
+    total_moves = 0
+    finished = 0
+    wins = {'White': 0, 'Black': 0, None: 0}
+    records_file = open(records_path, 'ab') if records_path else None
+    with open(out_path, 'w') as out_file, multiprocessing.Pool(processes) as pool:
+        for window_start in range(0, games, window):
+            jobs = ((number, seed + number, white_policy, black_policy, max_plies,
+                     engine_ms, engine_depth, records_file is not None)
+                    for number in range(window_start, min(games, window_start + window)))
+            for result in pool.imap_unordered(play_game, jobs, chunksize=16):
+                if records_file is not None:
+                    records_file.write(result.pop('record'))
+                out_file.write(json.dumps(result) + '\n')
+                finished += 1
+                total_moves += result['plies']
+                wins[result['winner']] += 1
+            if report is not None:
+                elapsed = time.perf_counter() - start
+                report.write("%d/%d games, %.1f games/sec, %.0f moves/sec\n"
+                             % (finished, games, finished / elapsed, total_moves / elapsed))
+    if records_file is not None:
+        records_file.close()
+
+    elapsed = time.perf_counter() - start
+    return {'games': finished,
+            'moves': total_moves,
+            'seconds': elapsed,
+            'games_per_sec': finished / elapsed if elapsed else 0.0,
+            'moves_per_sec': total_moves / elapsed if elapsed else 0.0,
+            'wins': {'White': wins['White'], 'Black': wins['Black'], 'draw': wins[None]}}
+
+
+def main(argv=None):
+    """
+    Command line entry point for headless self-play
+    """
+    parser = argparse.ArgumentParser(description="Play headless Kuba self-play games")
+    parser.add_argument('games', type=int, help="number of games to play")
+    parser.add_argument('--out', default='selfplay.jsonl', help="results file (JSON lines)")
+    parser.add_argument('--white', choices=POLICIES, default=RANDOM_POLICY)
+    parser.add_argument('--black', choices=POLICIES, default=RANDOM_POLICY)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-plies', type=int, default=500)
+    parser.add_argument('--engine-ms', type=int, default=100)
+    parser.add_argument('--engine-depth', type=int, default=64)
+    parser.add_argument('--records', default=None,
+                        help="append binary game records to this archive file")
+    args = parser.parse_args(argv)
+
+    summary = run_self_play(args.games, args.out, args.white, args.black, args.processes,
+                            args.seed, args.max_plies, args.engine_ms, args.engine_depth,
+                            report=sys.stderr, records_path=args.records)
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,646 @@
+# Description: This program hosts many Kuba games at once on one asyncio event loop over a
+#               TCP line protocol, and includes a local load generator to test it.
+#
+# Protocol: one command or update per line, words separated by spaces.
+#   client -> server:
+#     NEW                   start a session and wait as White; answered SESSION <id> White
+#     JOIN <id>             join a waiting session as Black; answered SESSION <id> Black
+#     RESUME <id> <player>  take a seat again in a session saved in the server's session
+#                           store (see KubaStore); answered SESSION <id> <player> and then
+#                           POSITION <board> <captured by White> <captured by Black>
+#                           <current turn or -> <winner or ->
+#     MOVE <row> <col> <direction>
+#                           make a move with KubaGame.make_move (ERR invalid move <reason>
+#                           if it is rejected, e.g. ERR invalid move not_your_turn)
+#     RESIGN                give up the game
+#     STATS                 answered STATS <json> with the server statistics (including
+#                           move validation statistics when the server runs with --instrument)
+#     QUIT                  close the connection
+#   server -> both players of a session:
+#     START <id>            both players have joined
+#     UPDATE <player> <row> <col> <direction> <board> <captured by White> <captured by Black>
+#            <current turn> <winner or ->
+#                           a move was made; <board> is the 49 tiles of rows 0-6 (X, W, B, R)
+#     END <winner or -> <reason>
+#                           the game is over (reason: win, resign, timeout or disconnect)
+#   errors are answered ERR <message>.
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+from KubaGame import KubaGame, BitBoard, get_instrumentation, set_instrumentation
+from KubaStats import ValidationStats
+from KubaStore import SessionStore
+
+PLAYERS = (('White', 'W'), ('Black', 'B'))
+
+# longest command line the server reads; longer lines close the connection
+MAX_LINE = 256
+
+
+def percentile(values, fraction):
+    """
+    Returns a percentile of a list of numbers (nearest rank)
+    Parameters: sorted list of numbers, fraction (0.99 for the 99th percentile)
+    Returns: number, or 0.0 for an empty list
+    """
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def board_text(game):
+    """returns the 49 playing tiles of a game as one string, row by row"""
+    return ''.join(''.join(row[1:8]) for row in game.get_board()[1:8])
+
+
+class Connection:
+    """
+    This class represents one client connection.
+    Data members:
+     - writer: asyncio StreamWriter of the connection
+     - session: Session the client plays in (None while in the lobby)
+     - name: the client's player name in its session
+     - last_active: event loop time of the last line received
+    """
+    __slots__ = ('writer', 'session', 'name', 'last_active')
+
+    def __init__(self, writer, now):
+        self.writer = writer
+        self.session = None
+        self.name = None
+        self.last_active = now
+
+
+class Session:
+    """
+    This class represents one hosted match: a KubaGame and the connections of its players.
+    Data members:
+     - id: session number
+     - game: KubaGame object
+     - players: dictionary of player name -> Connection
+     - last_active: event loop time of the last join or move
+    """
+    __slots__ = ('id', 'game', 'players', 'last_active')
+
+    def __init__(self, session_id, now, game=None):
+        self.id = session_id
+        if game is None:
+            game = KubaGame(PLAYERS[0], PLAYERS[1], board_class=BitBoard)
+        self.game = game
+        self.players = {}
+        self.last_active = now
+
+
+class KubaServer:
+    """
+    This class hosts Kuba sessions over the line protocol described at the top of this file.
+        Every session is idle-timed-out by one sweeper task rather than a timer per session.
+        Backpressure: each client's commands are read one at a time and the next line is
+        only read once that client's replies have drained, a session cap refuses new
+        sessions, and a client whose unread updates pass max_buffer bytes is dropped.
+        With a session store, started games are saved to it in batches by the sweeper
+        task (not on every move), and survive a server restart: players take their seats
+        again with RESUME.
+    This class communicates with the following classes:
+     - KubaGame: every session is a KubaGame, and every move is made with make_move
+            (check_move reports why a rejected move was rejected).
+     - SessionStore: KubaServer can save and restore sessions in a SessionStore.
+    """
+    def __init__(self, idle_timeout=60.0, max_sessions=20000, max_buffer=64 * 1024,
+                 latency_samples=100000, store=None):
+        """
+        Initializes the server
+        Parameters: seconds a session or lobby connection may stay idle, most sessions
+            hosted at once, most unsent bytes buffered per client, number of recent move
+            latencies kept for the percentiles, optional SessionStore
+        Returns: N/A
+        """
+        self._idle_timeout = idle_timeout
+        self._max_sessions = max_sessions
+        self._max_buffer = max_buffer
+        self._sessions = {}
+        self._connections = set()
+        self._store = store
+        self._unsaved = set()       # started sessions changed since they were last saved
+        first_id = max(store.session_ids(), default=0) + 1 if store is not None else 1
+        self._session_ids = itertools.count(first_id)
+        self._server = None
+        self._sweeper = None
+        self._closing = False
+        self._handlers = set()      # the running connection handler tasks
+
+        # statistics
+        self._started = time.perf_counter()
+        self._latencies = collections.deque(maxlen=latency_samples)
+        self._counts = collections.Counter()
+
+    async def start(self, host='127.0.0.1', port=8765, backlog=4096):
+        """
+        Starts listening for connections
+        Parameters: host (string), port (number, 0 picks a free port), connections the
+            operating system may queue before the server accepts them
+        Returns: the port the server listens on
+        """
+        self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_LINE,
+                                                  backlog=backlog)
+        self._sweeper = asyncio.get_running_loop().create_task(self._sweep())
+        self._started = time.perf_counter()
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """
+        Stops the server and closes every connection. Sessions are saved, not ended,
+            so with a session store they can be resumed after a restart.
+        """
+        self._closing = True
+        self.save_sessions()
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        if self._server is not None:
+            self._server.close()
+        for conn in list(self._connections):
+            conn.writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    def save_sessions(self):
+        """
+        Saves every session changed since it was last saved to the session store (if any)
+        Parameters: N/A
+        Returns: number of sessions saved
+        """
+        if self._store is None:
+            return 0
+        saved = len(self._unsaved)
+        for session in self._unsaved:
+            self._store.put(session.id, session.game)
+        self._unsaved.clear()
+        return saved
+
+    async def serve_forever(self):
+        """Serves until cancelled"""
+        await self._server.serve_forever()
+
+    def get_stats(self):
+        """
+        Returns the server statistics
+        Parameters: N/A
+        Returns: dictionary of connection and session counts, sessions and moves per second
+            since the server started, move latency percentiles in milliseconds (from
+            reading a MOVE line to queueing the updates for both players), and the move
+            validation statistics if instrumentation is installed (see KubaStats)
+        """
+        elapsed = time.perf_counter() - self._started
+        latencies = sorted(self._latencies)
+        stats = {'connections': len(self._connections),
+                 'sessions_active': len(self._sessions),
+                 'sessions_started': self._counts['started'],
+                 'sessions_finished': self._counts['finished'],
+                 'sessions_per_sec': self._counts['finished'] / elapsed if elapsed else 0.0,
+                 'moves': self._counts['moves'],
+                 'moves_per_sec': self._counts['moves'] / elapsed if elapsed else 0.0,
+                 'timeouts': self._counts['timeouts'],
+                 'dropped_slow': self._counts['dropped_slow'],
+                 'refused_busy': self._counts['refused_busy'],
+                 'resumed': self._counts['resumed'],
+                 'latency_ms': {'p50': percentile(latencies, 0.50) * 1000,
+                                'p90': percentile(latencies, 0.90) * 1000,
+                                'p99': percentile(latencies, 0.99) * 1000,
+                                'max': latencies[-1] * 1000 if latencies else 0.0}}
+        instrumentation = get_instrumentation()
+        if instrumentation is not None:
+            stats['validation'] = instrumentation.get_stats()
+        return stats
+
+    def _send(self, conn, line):
+        """
+        Queues a line for a client, dropping the client if it stops reading
+        """
+        writer = conn.writer
+        if writer.is_closing():
+            return
+        writer.write(line.encode() + b'\n')
+        if writer.transport.get_write_buffer_size() > self._max_buffer:
+            self._counts['dropped_slow'] += 1
+            writer.transport.abort()
+
+    async def _handle(self, reader, writer):
+        """
+        Reads and answers one client's commands until it quits or disconnects
+        """
+        loop = asyncio.get_running_loop()
+        conn = Connection(writer, loop.time())
+        self._connections.add(conn)
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    # the line was longer than MAX_LINE, or the connection was reset
+                    break
+                if not line:
+                    break
+                conn.last_active = loop.time()
+                if not self._command(conn, line.decode('utf-8', 'replace').split(), loop):
+                    break
+                # backpressure: don't read more from a client that isn't reading replies
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(conn)
+            self._handlers.discard(handler)
+            session = conn.session
+            if session is not None and not self._closing:
+                other = [name for name in session.players if name != conn.name]
+                self._end_session(session, other[0] if other else None, 'disconnect')
+            writer.close()
+
+    def _command(self, conn, words, loop):
+        """
+        Runs one command line
+        Returns: False if the connection should be closed. True otherwise.
+        """
+        if not words:
+            return True
+        command = words[0].upper()
+        session = conn.session
+
+        if command == 'MOVE':
+            start = time.perf_counter()
+            if session is None or len(session.players) < 2 or len(words) != 4:
+                self._send(conn, "ERR not in a game")
+                return True
+            try:
+                position = (int(words[1]), int(words[2]))
+            except ValueError:
+                self._send(conn, "ERR invalid move")
+                return True
+            game = session.game
+            direction = words[3].upper()
+            if not game.make_move(conn.name, position, direction):
+                # only a rejected move is checked again, to tell the client why
+                reason = game.check_move(conn.name, position, direction)
+                self._send(conn, "ERR invalid move " + reason)
+                return True
+            session.last_active = loop.time()
+            self._counts['moves'] += 1
+            self._unsaved.add(session)
+
+            # a player with no legal moves loses
+            turn = game.get_current_turn()
+            if game.get_winner() is None and not game.legal_moves(turn):
+                game.set_winner(game.get_other_player(turn).get_name())
+            winner = game.get_winner()
+            update = "UPDATE %s %d %d %s %s %d %d %s %s" % (
+                conn.name, position[0], position[1], words[3].upper(), board_text(game),
+                game.get_captured(PLAYERS[0][0]), game.get_captured(PLAYERS[1][0]),
+                turn, winner or '-')
+            for player in session.players.values():
+                self._send(player, update)
+            if winner is not None:
+                self._end_session(session, winner, 'win')
+            self._latencies.append(time.perf_counter() - start)
+
+        elif command == 'NEW':
+            if session is not None:
+                self._send(conn, "ERR already in a game")
+            elif len(self._sessions) >= self._max_sessions:
+                self._counts['refused_busy'] += 1
+                self._send(conn, "ERR busy")
+            else:
+                session = Session(next(self._session_ids), loop.time())
+                self._sessions[session.id] = session
+                self._counts['started'] += 1
+                self._join(conn, session, PLAYERS[0][0])
+
+        elif command == 'JOIN':
+            try:
+                session = self._sessions.get(int(words[1]))
+            except (IndexError, ValueError):
+                session = None
+            if conn.session is not None:
+                self._send(conn, "ERR already in a game")
+            elif session is None or len(session.players) != 1:
+                self._send(conn, "ERR no such session")
+            else:
+                session.last_active = loop.time()
+                self._join(conn, session, PLAYERS[1][0])
+                self._unsaved.add(session)
+                for player in session.players.values():
+                    self._send(player, "START %d" % session.id)
+
+        elif command == 'RESUME':
+            self._resume(conn, words, loop)
+
+        elif command == 'RESIGN':
+            if session is None:
+                self._send(conn, "ERR not in a game")
+            else:
+                other = session.game.get_other_player(conn.name).get_name()
+                winner = other if other in session.players else None
+                self._end_session(session, winner, 'resign')
+
+        elif command == 'STATS':
+            self._send(conn, "STATS " + json.dumps(self.get_stats()))
+
+        elif command == 'QUIT':
+            return False
+
+        else:
+            self._send(conn, "ERR unknown command")
+        return True
+
+    def _resume(self, conn, words, loop):
+        """
+        Seats a player again in a saved session, restoring it from the store if needed
+        """
+        try:
+            session_id = int(words[1])
+            name = words[2]
+        except (IndexError, ValueError):
+            self._send(conn, "ERR no such session")
+            return
+        session = self._sessions.get(session_id)
+        if session is None and self._store is not None and session_id in self._store:
+            if len(self._sessions) >= self._max_sessions:
+                self._counts['refused_busy'] += 1
+                self._send(conn, "ERR busy")
+                return
+            session = Session(session_id, loop.time(), self._store.get(session_id))
+            self._sessions[session_id] = session
+            self._counts['resumed'] += 1
+        if conn.session is not None:
+            self._send(conn, "ERR already in a game")
+        elif session is None or name not in (PLAYERS[0][0], PLAYERS[1][0]):
+            self._send(conn, "ERR no such session")
+        elif name in session.players:
+            self._send(conn, "ERR seat taken")
+        else:
+            session.last_active = loop.time()
+            self._join(conn, session, name)
+            game = session.game
+            self._send(conn, "POSITION %s %d %d %s %s" % (
+                board_text(game), game.get_captured(PLAYERS[0][0]),
+                game.get_captured(PLAYERS[1][0]), game.get_current_turn() or '-',
+                game.get_winner() or '-'))
+            if len(session.players) == 2:
+                for player in session.players.values():
+                    self._send(player, "START %d" % session.id)
+
+    def _join(self, conn, session, name):
+        """
+        Seats a connection in a session as one of the players
+        """
+        session.players[name] = conn
+        conn.session = session
+        conn.name = name
+        self._send(conn, "SESSION %d %s" % (session.id, name))
+
+    def _end_session(self, session, winner, reason):
+        """
+        Ends a session: tells both players and returns them to the lobby
+        """
+        if self._sessions.pop(session.id, None) is None:
+            return
+        self._counts['finished'] += 1
+        self._unsaved.discard(session)
+        if self._store is not None:
+            self._store.delete(session.id)
+        if winner is not None and session.game.get_winner() is None:
+            session.game.set_winner(winner)
+        for conn in session.players.values():
+            self._send(conn, "END %s %s" % (winner or '-', reason))
+            conn.session = None
+            conn.name = None
+
+    async def _sweep(self):
+        """
+        Ends sessions and closes lobby connections that have been idle for too long.
+            In a started game the player to move forfeits. Also saves the changed
+            sessions to the session store.
+        """
+        loop = asyncio.get_running_loop()
+        interval = min(1.0, self._idle_timeout / 2)
+        while True:
+            await asyncio.sleep(interval)
+            deadline = loop.time() - self._idle_timeout
+            for session in [session for session in self._sessions.values()
+                            if session.last_active < deadline]:
+                self._counts['timeouts'] += 1
+                turn = session.game.get_current_turn()
+                winner = None
+                if turn is not None and len(session.players) == 2:
+                    winner = session.game.get_other_player(turn).get_name()
+                players = list(session.players.values())
+                self._end_session(session, winner, 'timeout')
+                for conn in players:
+                    conn.writer.close()
+            for conn in [conn for conn in self._connections
+                         if conn.session is None and conn.last_active < deadline]:
+                conn.writer.close()
+            self.save_sessions()
+
+
+################################################################################
+# Load Generator ###############################################################
+################################################################################
+
+async def _read_words(reader):
+    """reads one line from the server and splits it into words (empty at end of stream)"""
+    return (await reader.readline()).decode().split()
+
+
+async def _play_session(host, port, rng, max_plies, latencies):
+    """
+    Plays one session over two connections with random legal moves. A local KubaGame
+        mirrors the game to pick the moves.
+    Returns: number of moves made
+    """
+    readers = {}
+    writers = {}
+    moves = 0
+    try:
+        for name, _ in PLAYERS:
+            readers[name], writers[name] = await asyncio.open_connection(host, port)
+        white_reader, white_writer = readers['White'], writers['White']
+        black_writer = writers['Black']
+        white_writer.write(b'NEW\n')
+        words = await _read_words(white_reader)
+        if words[:1] != ['SESSION']:
+            return 0
+        black_writer.write(b'JOIN %s\n' % words[1].encode())
+        for reader in readers.values():
+            while (await _read_words(reader))[:1] not in (['START'], []):
+                pass
+
+        mirror = KubaGame(PLAYERS[0], PLAYERS[1], board_class=BitBoard)
+        player_name = PLAYERS[0][0]
+        while moves < max_plies:
+            legal = mirror.legal_moves(player_name)
+            if not legal:
+                break
+            position, direction = legal[rng.randrange(len(legal))]
+            start = time.perf_counter()
+            writers[player_name].write(b'MOVE %d %d %s\n' % (position[0], position[1],
+                                                             direction.encode()))
+            words = await _read_words(readers[player_name])
+            latencies.append(time.perf_counter() - start)
+            other_words = await _read_words(readers[mirror.get_other_player(player_name)
+                                                     .get_name()])
+            if words[:1] != ['UPDATE'] or other_words[:1] != ['UPDATE']:
+                break
+            mirror.make_move(player_name, position, direction)
+            moves += 1
+            if words[-1] != '-':
+                break
+            player_name = mirror.get_current_turn()
+        else:
+            writers[player_name].write(b'RESIGN\n')
+    finally:
+        for writer in writers.values():
+            writer.write(b'QUIT\n')
+            writer.close()
+    return moves
+
+
+async def _load_sessions(host, port, sessions, concurrency, max_plies, seed):
+    """
+    Plays sessions against a server, keeping a number of them open at once
+    Returns: (moves made, failed sessions, list of move round trip seconds)
+    """
+    rng = random.Random(seed)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def one_session():
+        nonlocal failures
+        async with semaphore:
+            try:
+                return await _play_session(host, port, random.Random(rng.random()),
+                                           max_plies, latencies)
+            except (ConnectionError, OSError):
+                failures += 1
+                return 0
+
+    moves = sum(await asyncio.gather(*(one_session() for _ in range(sessions))))
+    return moves, failures, latencies
+
+
+def _load_worker(job):
+    """runs one load generator process's share of the sessions"""
+    return asyncio.run(_load_sessions(*job))
+
+
+async def _server_stats(host, port):
+    """asks a server for its STATS"""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'STATS\nQUIT\n')
+    words = (await reader.readline()).decode().split(' ', 1)
+    writer.close()
+    return json.loads(words[1]) if words[0] == 'STATS' else None
+
+
+def run_load(host='127.0.0.1', port=8765, sessions=1000, concurrency=100, max_plies=60,
+             seed=0, processes=1):
+    """
+    Plays sessions against a running server. The sessions are split between a number of
+        client processes, so the load generator itself is not the bottleneck.
+    Parameters: server host and port, total sessions to play, sessions open at once (over
+        all processes), moves per session before one player resigns, random seed,
+        number of client processes
+    Returns: dictionary of the client-side results and the server's STATS
+    """
+    jobs = [(host, port, sessions // processes + (index < sessions % processes),
+             max(1, concurrency // processes), max_plies, seed + index)
+            for index in range(processes)]
+    start = time.perf_counter()
+    if processes == 1:
+        results = [_load_worker(jobs[0])]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_load_worker, jobs)
+    elapsed = time.perf_counter() - start
+
+    moves = sum(result[0] for result in results)
+    latencies = sorted(itertools.chain.from_iterable(result[2] for result in results))
+    return {'sessions': sessions,
+            'failures': sum(result[1] for result in results),
+            'moves': moves,
+            'seconds': elapsed,
+            'sessions_per_sec': sessions / elapsed if elapsed else 0.0,
+            'moves_per_sec': moves / elapsed if elapsed else 0.0,
+            'round_trip_ms': {'p50': percentile(latencies, 0.50) * 1000,
+                              'p90': percentile(latencies, 0.90) * 1000,
+                              'p99': percentile(latencies, 0.99) * 1000},
+            'server': asyncio.run(_server_stats(host, port))}
+
+
+async def _serve(args):
+    """runs the server until interrupted"""
+    store = SessionStore(args.store, players=PLAYERS) if args.store else None
+    if args.instrument:
+        set_instrumentation(ValidationStats())
+    server = KubaServer(args.idle_timeout, args.max_sessions, store=store)
+    port = await server.start(args.host, args.port)
+    sys.stderr.write("serving Kuba on %s:%d\n" % (args.host, port))
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+        if store is not None:
+            store.close()
+
+
+def main(argv=None):
+    """
+    Command line entry point: "serve" or "load"
+    """
+    parser = argparse.ArgumentParser(description="Kuba game server")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help="host games")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--idle-timeout', type=float, default=60.0)
+    serve_parser.add_argument('--max-sessions', type=int, default=20000)
+    serve_parser.add_argument('--store', default=None,
+                              help="session store file, so games survive a restart")
+    serve_parser.add_argument('--instrument', action='store_true',
+                              help="collect move validation statistics (reported by STATS)")
+    load_parser = commands.add_parser('load', help="play test sessions against a server")
+    load_parser.add_argument('--host', default='127.0.0.1')
+    load_parser.add_argument('--port', type=int, default=8765)
+    load_parser.add_argument('--sessions', type=int, default=1000)
+    load_parser.add_argument('--concurrency', type=int, default=100,
+                             help="sessions open at once (each uses two connections)")
+    load_parser.add_argument('--max-plies', type=int, default=60)
+    load_parser.add_argument('--seed', type=int, default=0)
+    load_parser.add_argument('--processes', type=int, default=1,
+                             help="client processes to split the sessions between")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(_serve(args))
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(json.dumps(run_load(args.host, args.port, args.sessions, args.concurrency,
+                                  args.max_plies, args.seed, args.processes)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
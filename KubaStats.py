@@ -0,0 +1,179 @@
+# Description: This program collects opt-in statistics about Kuba move validation: how
+#               many move checks ran, a latency histogram of the checks, calls, rejections
+#               and a latency histogram for every validation stage, why moves were rejected,
+#               the number of marbles moved by each push and the number of board deep
+#               copies. Install a ValidationStats with KubaGame.set_instrumentation; while
+#               none is installed, the rules engine only pays one check per move.
+import bisect
+
+from KubaGame import VALIDATION_STAGES, REJECTION_STAGES, MOVE_VALID
+
+# latency histogram bucket upper bounds in seconds (a last +Inf bucket is implied)
+LATENCY_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001,
+                   0.00025, 0.0005, 0.001, 0.01)
+# push chain histogram bucket upper bounds in marbles (a standard row holds at most 7)
+CHAIN_BUCKETS = (1, 2, 3, 4, 5, 6, 7)
+
+
+class ValidationStats:
+    """
+    This class counts what the rules engine does while it is installed with
+        KubaGame.set_instrumentation, and exports the counts as a dictionary or as a
+        Prometheus text exposition snapshot.
+    This class communicates with the following classes:
+     - KubaGame: KubaGame reports each move check (check_move, valid_make_move and so
+            make_move) and each of its validation stages, push and deep copy to the
+            installed ValidationStats.
+    """
+    def __init__(self, latency_buckets=LATENCY_BUCKETS):
+        """
+        Init method for ValidationStats data members
+        Parameters: latency histogram bucket upper bounds in seconds (ascending)
+        Returns: N/A
+        """
+        self._latency_buckets = tuple(latency_buckets)
+        # bucket bounds in nanoseconds, to compare with time.perf_counter_ns differences
+        self._latency_bounds = [round(bound * 1e9) for bound in self._latency_buckets]
+        self.reset()
+
+    def reset(self):
+        """Sets every count back to zero"""
+        self._checks = 0
+        self._check_time = 0                # nanoseconds
+        self._latencies = [0] * (len(self._latency_bounds) + 1)
+        self._reasons = dict.fromkeys((MOVE_VALID,) + tuple(REJECTION_STAGES), 0)
+        # stage name -> [calls, rejections, total nanoseconds, per-bucket counts]
+        self._stages = {stage: [0, 0, 0, [0] * (len(self._latency_bounds) + 1)]
+                        for stage in VALIDATION_STAGES}
+        self._pushes = 0
+        self._pushed_marbles = 0
+        self._chains = [0] * (len(CHAIN_BUCKETS) + 1)
+        self._deepcopies = 0
+
+    def record_check(self, reason, nanoseconds):
+        """
+        Records one move check
+        Parameters: result of the check (MOVE_VALID or a rejection reason, see
+            KubaGame.check_move), time taken in nanoseconds
+        Returns: N/A
+        """
+        self._checks += 1
+        self._check_time += nanoseconds
+        self._latencies[bisect.bisect_left(self._latency_bounds, nanoseconds)] += 1
+        self._reasons[reason] += 1
+
+    def record_stage(self, stage, nanoseconds, rejected):
+        """
+        Records one run of a validation stage
+        Parameters: stage name (string), time taken in nanoseconds, True if the stage
+            rejected the move
+        Returns: N/A
+        """
+        entry = self._stages[stage]
+        entry[0] += 1
+        if rejected:
+            entry[1] += 1
+        entry[2] += nanoseconds
+        entry[3][bisect.bisect_left(self._latency_bounds, nanoseconds)] += 1
+
+    def record_push(self, marbles):
+        """
+        Records one push
+        Parameters: number of marbles the push moved
+        Returns: N/A
+        """
+        self._pushes += 1
+        self._pushed_marbles += marbles
+        self._chains[bisect.bisect_left(CHAIN_BUCKETS, marbles)] += 1
+
+    def record_deepcopy(self):
+        """Records one deep copy of a GameBoard or BitBoard (including those made by
+            copy.deepcopy of a KubaGame)"""
+        self._deepcopies += 1
+
+    def get_stats(self):
+        """
+        Returns the counts as a dictionary. Histogram buckets are cumulative, keyed by
+            their upper bound, like Prometheus histograms.
+        Parameters: N/A
+        Returns: dictionary with 'checks', 'seconds' and 'buckets' (check latency),
+            'reasons' (checks per result), 'stages' (per stage: calls, rejections, seconds,
+            buckets), 'push_chain' (pushes, marbles, buckets) and 'deepcopies'
+        """
+        stages = {}
+        for stage, (calls, rejections, nanoseconds, counts) in self._stages.items():
+            stages[stage] = {'calls': calls,
+                             'rejections': rejections,
+                             'seconds': nanoseconds / 1e9,
+                             'buckets': _cumulative(self._latency_buckets, counts)}
+        return {'checks': self._checks,
+                'seconds': self._check_time / 1e9,
+                'buckets': _cumulative(self._latency_buckets, self._latencies),
+                'reasons': dict(self._reasons),
+                'stages': stages,
+                'push_chain': {'pushes': self._pushes,
+                               'marbles': self._pushed_marbles,
+                               'buckets': _cumulative(CHAIN_BUCKETS, self._chains)},
+                'deepcopies': self._deepcopies}
+
+    def to_prometheus(self, prefix='kuba'):
+        """
+        Returns the counts in the Prometheus text exposition format
+        Parameters: metric name prefix (string)
+        Returns: string
+        """
+        stats = self.get_stats()
+        lines = ["# HELP %s_move_checks_total Move checks by result." % prefix,
+                 "# TYPE %s_move_checks_total counter" % prefix]
+        for reason, count in stats['reasons'].items():
+            lines.append('%s_move_checks_total{result="%s"} %d' % (prefix, reason, count))
+        lines += ["# HELP %s_validation_calls_total Moves checked by a validation stage." % prefix,
+                  "# TYPE %s_validation_calls_total counter" % prefix]
+        for stage, entry in stats['stages'].items():
+            lines.append('%s_validation_calls_total{stage="%s"} %d' % (prefix, stage, entry['calls']))
+        lines += ["# HELP %s_validation_rejections_total Moves rejected by a validation stage." % prefix,
+                  "# TYPE %s_validation_rejections_total counter" % prefix]
+        for stage, entry in stats['stages'].items():
+            lines.append('%s_validation_rejections_total{stage="%s"} %d'
+                         % (prefix, stage, entry['rejections']))
+        lines += ["# HELP %s_move_check_seconds Move check latency." % prefix,
+                  "# TYPE %s_move_check_seconds histogram" % prefix]
+        lines += _histogram_lines('%s_move_check_seconds' % prefix, '', stats['buckets'],
+                                  stats['seconds'], stats['checks'])
+        lines += ["# HELP %s_validation_seconds Validation stage latency." % prefix,
+                  "# TYPE %s_validation_seconds histogram" % prefix]
+        for stage, entry in stats['stages'].items():
+            labels = 'stage="%s",' % stage
+            lines += _histogram_lines('%s_validation_seconds' % prefix, labels, entry['buckets'],
+                                      entry['seconds'], entry['calls'])
+
+        chain = stats['push_chain']
+        lines += ["# HELP %s_push_chain_marbles Marbles moved by each push." % prefix,
+                  "# TYPE %s_push_chain_marbles histogram" % prefix]
+        lines += _histogram_lines('%s_push_chain_marbles' % prefix, '', chain['buckets'],
+                                  chain['marbles'], chain['pushes'])
+        lines += ["# HELP %s_deepcopies_total Board deep copies." % prefix,
+                  "# TYPE %s_deepcopies_total counter" % prefix,
+                  "%s_deepcopies_total %d" % (prefix, stats['deepcopies'])]
+        return "\n".join(lines) + "\n"
+
+
+def _cumulative(bounds, counts):
+    """returns a {upper bound: cumulative count} dictionary, ending with '+Inf'"""
+    buckets = {}
+    total = 0
+    for bound, count in zip(tuple(bounds) + ('+Inf',), counts):
+        total += count
+        buckets[bound] = total
+    return buckets
+
+
+def _histogram_lines(name, labels, buckets, total, count):
+    """returns the bucket, sum and count lines of one Prometheus histogram"""
+    lines = ['%s_bucket{%sle="%s"} %d' % (name, labels, bound, cumulative)
+             for bound, cumulative in buckets.items()]
+    labels = labels.rstrip(',')
+    labels = '{%s}' % labels if labels else ''
+    lines.append('%s_sum%s %s' % (name, labels, repr(float(total))))
+    lines.append('%s_count%s %d' % (name, labels, count))
+    return lines
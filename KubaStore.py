@@ -0,0 +1,152 @@
+# Description: This program keeps suspended Kuba games in a memory-mapped file of fixed-size
+#               slots keyed by session id. Each slot holds a KubaGame snapshot (see
+#               KubaGame.to_bytes), so saving or restoring a game is a copy in or out of the
+#               mapping, with no file I/O of its own.
+import mmap
+import os
+import struct
+
+from KubaGame import KubaGame, BitBoard, SNAPSHOT_SIZE
+
+PLAYERS = (('White', 'W'), ('Black', 'B'))
+
+# file header: magic, format version, slot size, number of slots
+_MAGIC = b'KUBS'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBxHI')
+# slot: session id (0 for an empty slot) followed by the game snapshot
+_SLOT_ID = struct.Struct('<Q')
+SLOT_SIZE = _SLOT_ID.size + SNAPSHOT_SIZE
+
+
+class SessionStore:
+    """
+    This class stores KubaGame snapshots in a memory-mapped file, one fixed-size slot per
+        session. The players are stored by reference: every game in a store is played
+        between the same two (name, color) players. The file grows by doubling when
+        every slot is in use.
+    This class communicates with the following classes:
+     - KubaGame: SessionStore saves games with KubaGame.to_bytes and restores them with
+            KubaGame.from_bytes.
+    """
+    def __init__(self, path, capacity=1024, players=PLAYERS, board_class=BitBoard):
+        """
+        Opens a store file, creating it if it doesn't exist
+        Parameters: file path, number of slots of a new file, the (name, color) pairs of
+            player 1 and 2, board backend class of restored games
+        Returns: N/A
+        """
+        self._players = players
+        self._board_class = board_class
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as new_file:
+                new_file.write(_HEADER.pack(_MAGIC, _VERSION, SLOT_SIZE, capacity))
+                new_file.truncate(_HEADER.size + capacity * SLOT_SIZE)
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, slot_size, self._capacity = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC or version != _VERSION or slot_size != SLOT_SIZE:
+            self.close()
+            raise ValueError("not a version %d Kuba session store: %s" % (_VERSION, path))
+
+        # index the slots: session id -> slot number, and the empty slots
+        self._slots = {}
+        self._free = []
+        for slot in range(self._capacity - 1, -1, -1):
+            session_id = _SLOT_ID.unpack_from(self._map, self._offset(slot))[0]
+            if session_id:
+                self._slots[session_id] = slot
+            else:
+                self._free.append(slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, session_id):
+        return session_id in self._slots
+
+    def session_ids(self):
+        """returns a list of the stored session ids"""
+        return list(self._slots)
+
+    def put(self, session_id, game):
+        """
+        Saves a game in its session's slot (overwriting an earlier save)
+        Parameters: session id (number above 0), KubaGame object
+        Returns: N/A
+        """
+        if session_id <= 0:
+            raise ValueError("session ids start at 1")
+        slot = self._slots.get(session_id)
+        if slot is None:
+            if not self._free:
+                self._grow()
+            slot = self._slots[session_id] = self._free.pop()
+        offset = self._offset(slot)
+        self._map[offset:offset + SLOT_SIZE] = _SLOT_ID.pack(session_id) + game.to_bytes()
+
+    def get(self, session_id):
+        """
+        Restores a saved game
+        Parameters: session id (number)
+        Returns: KubaGame object
+        """
+        offset = self._offset(self._slots[session_id]) + _SLOT_ID.size
+        return KubaGame.from_bytes(self._map[offset:offset + SNAPSHOT_SIZE],
+                                   self._players[0], self._players[1], self._board_class)
+
+    def delete(self, session_id):
+        """
+        Frees a session's slot (nothing happens if the session isn't stored)
+        Parameters: session id (number)
+        Returns: N/A
+        """
+        slot = self._slots.pop(session_id, None)
+        if slot is not None:
+            _SLOT_ID.pack_into(self._map, self._offset(slot), 0)
+            self._free.append(slot)
+
+    def items(self):
+        """
+        Restores every saved game
+        Parameters: N/A
+        Returns: generator of (session id, KubaGame object) pairs
+        """
+        for session_id in list(self._slots):
+            yield session_id, self.get(session_id)
+
+    def flush(self):
+        """Asks the operating system to write the mapped slots to disk"""
+        self._map.flush()
+
+    def close(self):
+        """Flushes and closes the store"""
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    @staticmethod
+    def _offset(slot):
+        """returns the file offset of a slot"""
+        return _HEADER.size + slot * SLOT_SIZE
+
+    def _grow(self):
+        """
+        Doubles the number of slots and maps the larger file
+        """
+        capacity = self._capacity * 2
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(self._offset(capacity))
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        _HEADER.pack_into(self._map, 0, _MAGIC, _VERSION, SLOT_SIZE, capacity)
+        self._free.extend(range(capacity - 1, self._capacity - 1, -1))
+        self._capacity = capacity
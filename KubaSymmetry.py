@@ -0,0 +1,242 @@
+# Description: This program maps Kuba positions onto the symmetries of the board, so that
+#               position caches (transposition tables, opening books, tablebases) can share
+#               one entry between symmetric positions. The push rules are the same under the
+#               eight rotations and reflections of the square board (with the move
+#               directions turned the same way) and under swapping the W and B colours (with
+#               the side to move and the captured reds swapped too). The starting layout of
+#               GameBoard is itself unchanged by every rotation and reflection, each one
+#               combined with a colour swap where needed.
+#
+#               A transform is a number from 0 to 15: the rotation or reflection in
+#               GEOMETRIC order, plus COLOR_SWAP when the colours are swapped. canonicalize
+#               swaps the colours when black is to move, so a canonical position always has
+#               white to move, and then picks the rotation or reflection with the smallest
+#               tiles. Captured reds and the rule against repeating the previous board are
+#               not part of the canonical position: store the captured reds as (player to
+#               move, opponent) next to it.
+from operator import itemgetter
+
+# rotations and reflections, in transform order, as maps of (row, col) on a board whose last
+#  row and column are m
+GEOMETRIC = ('identity', 'rotate_90', 'rotate_180', 'rotate_270',
+             'flip_left_right', 'flip_up_down', 'transpose', 'anti_transpose')
+_GEOMETRIC_MAPS = (lambda row, col, m: (row, col),
+                   lambda row, col, m: (col, m - row),
+                   lambda row, col, m: (m - row, m - col),
+                   lambda row, col, m: (m - col, row),
+                   lambda row, col, m: (row, m - col),
+                   lambda row, col, m: (m - row, col),
+                   lambda row, col, m: (col, row),
+                   lambda row, col, m: (m - col, m - row))
+IDENTITY = 0
+COLOR_SWAP = len(GEOMETRIC)
+TRANSFORM_COUNT = 2 * len(GEOMETRIC)
+
+# row and col offsets of one push step (see KubaGame)
+_STEPS = {'F': (-1, 0), 'B': (1, 0), 'L': (0, -1), 'R': (0, 1)}
+_SWAP_COLORS = str.maketrans('WB', 'BW')
+
+
+class _Symmetries:
+    """
+    The transform tables of one board size, built once by symmetry_table: for every
+        transform, the source square of each square of the transformed tiles, the square
+        each square moves to, the direction each direction turns into and the inverse
+        transform.
+    """
+    __slots__ = ('size', 'gathers', 'squares', 'directions', 'inverses')
+
+    def __init__(self, size):
+        self.size = size
+        last = size - 1
+        count = size * size
+        gathers = []
+        squares = []
+        directions = []
+        for geometric in _GEOMETRIC_MAPS:
+            # square (row * size + col) -> square it is moved to
+            moved = [0] * count
+            for row in range(size):
+                for col in range(size):
+                    new_row, new_col = geometric(row, col, last)
+                    moved[row * size + col] = new_row * size + new_col
+            source = [0] * count
+            for square, target in enumerate(moved):
+                source[target] = square
+            gathers.append(itemgetter(*source))
+            squares.append(tuple(moved))
+
+            # the transform of a step is where it moves one square relative to the origin
+            origin = geometric(0, 0, last)
+            turned = {}
+            for direction, (row_step, col_step) in _STEPS.items():
+                new_row, new_col = geometric(row_step, col_step, last)
+                step = (new_row - origin[0], new_col - origin[1])
+                turned[direction] = next(name for name, offset in _STEPS.items() if offset == step)
+            directions.append(turned)
+
+        # a colour swap doesn't move the squares, so transform t and t + COLOR_SWAP share them
+        self.gathers = tuple(gathers) * 2
+        self.squares = tuple(squares) * 2
+        self.directions = tuple(directions) * 2
+        inverses = [next(other for other in range(len(GEOMETRIC))
+                         if all(squares[other][squares[geometric][square]] == square
+                                for square in range(count)))
+                    for geometric in range(len(GEOMETRIC))]
+        self.inverses = tuple(inverses) + tuple(inverse + COLOR_SWAP for inverse in inverses)
+
+
+# board size -> _Symmetries, filled in as sizes are first used
+_SYMMETRIES = {}
+
+
+def symmetry_table(size=7):
+    """
+    Returns the shared transform tables of a board size
+    Parameters: board size (playing area, tray excluded)
+    Returns: _Symmetries object
+    """
+    table = _SYMMETRIES.get(size)
+    if table is None:
+        table = _SYMMETRIES[size] = _Symmetries(size)
+    return table
+
+
+def board_tiles(board):
+    """
+    Returns the tiles of the playing area of a board, row by row, as one string
+    Parameters: game board (list of lists, tray border included, as returned by get_board)
+    Returns: string of size * size tile characters
+    """
+    return ''.join(''.join(row[1:-1]) for row in board[1:-1])
+
+
+def tiles_board(tiles, size):
+    """
+    Builds a board with an empty tray border from a string of playing area tiles
+    Parameters: string of size * size tile characters (see board_tiles), board size
+    Returns: game board (list of lists)
+    """
+    width = size + 2
+    board = [['-'] * width]
+    for start in range(0, size * size, size):
+        board.append(['|'] + list(tiles[start:start + size]) + ['|'])
+    board.append(['-'] * width)
+    return board
+
+
+def inverse_transform(transform, size=7):
+    """
+    Returns the transform that undoes a transform
+    Parameters: transform (number), board size
+    Returns: transform (number)
+    """
+    return symmetry_table(size).inverses[transform]
+
+
+def transform_tiles(tiles, transform, size=7):
+    """
+    Applies a transform to the playing area tiles of a board
+    Parameters: string of tiles (see board_tiles), transform (number), board size
+    Returns: string of the transformed tiles
+    """
+    tiles = ''.join(symmetry_table(size).gathers[transform](tiles))
+    if transform >= COLOR_SWAP:
+        tiles = tiles.translate(_SWAP_COLORS)
+    return tiles
+
+
+def transform_board(board, transform):
+    """
+    Applies a transform to a board (the tray of the result is empty)
+    Parameters: game board (list of lists, tray border included), transform (number)
+    Returns: transformed game board (list of lists)
+    """
+    size = len(board) - 2
+    return tiles_board(transform_tiles(board_tiles(board), transform, size), size)
+
+
+def transform_move(move, transform, size=7):
+    """
+    Maps a move on a board to the same move on the transformed board
+    Parameters: move as ((row, col) in make_move coordinates, direction), transform
+        (number), board size
+    Returns: move as ((row, col), direction)
+    """
+    table = symmetry_table(size)
+    (row, col), direction = move
+    square = table.squares[transform][row * size + col]
+    return divmod(square, size), table.directions[transform][direction]
+
+
+def untransform_move(move, transform, size=7):
+    """
+    Maps a move on a transformed board (such as a canonical position found in a book)
+        back to the same move on the board the transform was applied to
+    Parameters: move as ((row, col) in make_move coordinates, direction), the transform
+        that made the transformed board (number), board size
+    Returns: move as ((row, col), direction)
+    """
+    return transform_move(move, inverse_transform(transform, size), size)
+
+
+def canonical_key(board, color):
+    """
+    Finds the canonical form of a position quickly, as a key for position caches. The
+        colours are swapped when black is to move, and of the eight rotations and
+        reflections the one giving the smallest tiles is used (the first in GEOMETRIC
+        order if several do).
+    Parameters: game board (list of lists, tray border included), marble color of the
+        player to move ('W' or 'B')
+    Returns: tuple of (canonical tiles as ASCII bytes, transform (number) that maps the
+        position onto them)
+    """
+    size = len(board) - 2
+    tiles = board_tiles(board)
+    swap = 0
+    if color == 'B':
+        tiles = tiles.translate(_SWAP_COLORS)
+        swap = COLOR_SWAP
+    best = tiles
+    best_transform = 0
+    for transform, gather in enumerate(symmetry_table(size).gathers[1:COLOR_SWAP], 1):
+        candidate = ''.join(gather(tiles))
+        if candidate < best:
+            best = candidate
+            best_transform = transform
+    return best.encode('ascii'), best_transform + swap
+
+
+def canonicalize(board, color):
+    """
+    Maps a position to its canonical representative, which has white to move
+        (see canonical_key)
+    Parameters: game board (list of lists, tray border included), marble color of the
+        player to move ('W' or 'B')
+    Returns: tuple of (canonical game board (list of lists), transform (number) that maps
+        the position onto it)
+    """
+    key, transform = canonical_key(board, color)
+    return tiles_board(key.decode('ascii'), len(board) - 2), transform
+
+
+def game_key(game, player_name):
+    """
+    Returns the canonical key of a game's position with a given player to move
+    Parameters: KubaGame object, name of the player to move (string)
+    Returns: tuple of (canonical tiles (bytes), transform (number)), see canonical_key
+    """
+    return canonical_key(game.get_board(), game.get_player(player_name).get_color())
+
+
+def start_symmetries(ruleset):
+    """
+    Finds the transforms that leave a ruleset's starting board unchanged
+    Parameters: Ruleset object
+    Returns: list of transforms (numbers)
+    """
+    size = ruleset.get_size()
+    tiles = board_tiles(ruleset.get_board())
+    return [transform for transform in range(TRANSFORM_COUNT)
+            if transform_tiles(tiles, transform, size) == tiles]
+
@@ -0,0 +1,538 @@
+# Description: This program builds and reads an endgame tablebase for Kuba: every position
+#               with at most a given number of marbles on the board (white, black and red
+#               together) solved by retrograde analysis to a win, loss or draw for the
+#               player to move and the number of plies to the end of the game with best play.
+#               The table is one memory-mapped file with an index of slices (one slice per
+#               material balance), so a player or engine looks a position up in O(1).
+#
+#               The positions are solved with the push rules of GameBoard.push_marble and
+#               the win rules of KubaGame (7 captured reds, no opposing marbles left, or no
+#               legal moves for the opponent). The rule against repeating the previous board
+#               is not part of a tablebase position: positions where only it decides the
+#               game, and positions where both players can keep pushing forever, are draws.
+import argparse
+import json
+import mmap
+import multiprocessing
+import struct
+import sys
+import time
+from array import array
+
+from KubaGame import DIRECTIONS, MARBLES
+
+# probe results for the player to move
+WIN = 'win'
+LOSS = 'loss'
+DRAW = 'draw'
+
+# file header: magic, format version, most marbles on the board, number of slices. The
+#  magic is written last, so a table whose build was interrupted won't open.
+_MAGIC = b'KUBT'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBBxxI')
+# slice index entry: white, black and red marbles on the board, reds captured by white, and
+#  the file offset of the slice's values. Every slice holds one value per position, two
+#  positions (white or black to move) per placement of the marbles.
+_SLICE = struct.Struct('<BBBBQ')
+# position value: 0 for a draw, d > 0 for a win in d plies and -(d + 1) for a loss in d plies
+_VALUE = struct.Struct('<h')
+
+_SIZE = 7
+_SQUARES = _SIZE * _SIZE
+_REDS = 13
+_REDS_TO_WIN = 7
+_MARBLES_PER_PLAYER = 8
+_WHITE, _BLACK, _RED = range(3)
+
+_BINOMIAL = [[0] * (_REDS + 2) for _ in range(_SQUARES + 1)]
+for _n in range(_SQUARES + 1):
+    _BINOMIAL[_n][0] = 1
+    for _k in range(1, min(_n, _REDS + 1) + 1):
+        _BINOMIAL[_n][_k] = _BINOMIAL[_n - 1][_k - 1] + _BINOMIAL[_n - 1][_k]
+
+
+def _square_lines():
+    """
+    Returns, for every square (row * 7 + col in make_move coordinates) and direction in
+        DIRECTIONS order, the squares from that square to the board edge and the square the
+        marble is pushed from (-1 for the tray)
+    """
+    steps = {'F': (-1, 0), 'B': (1, 0), 'L': (0, -1), 'R': (0, 1)}
+    rays = []
+    behind = []
+    for square in range(_SQUARES):
+        row, col = divmod(square, _SIZE)
+        square_rays = []
+        square_behind = []
+        for direction in DIRECTIONS:
+            row_step, col_step = steps[direction]
+            ray = []
+            ray_row, ray_col = row, col
+            while 0 <= ray_row < _SIZE and 0 <= ray_col < _SIZE:
+                ray.append(ray_row * _SIZE + ray_col)
+                ray_row += row_step
+                ray_col += col_step
+            square_rays.append(tuple(ray))
+            back_row, back_col = row - row_step, col - col_step
+            if 0 <= back_row < _SIZE and 0 <= back_col < _SIZE:
+                square_behind.append(back_row * _SIZE + back_col)
+            else:
+                square_behind.append(-1)
+        rays.append(tuple(square_rays))
+        behind.append(tuple(square_behind))
+    return tuple(rays), tuple(behind)
+
+
+_RAYS, _BEHIND_SQUARES = _square_lines()
+
+
+def decode_value(value):
+    """
+    Turns a stored position value into a result
+    Parameters: position value (number)
+    Returns: (WIN, LOSS or DRAW, plies to the end of the game (0 for a draw))
+    """
+    if value > 0:
+        return WIN, value
+    if value < 0:
+        return LOSS, -value - 1
+    return DRAW, 0
+
+
+def table_slices(max_marbles):
+    """
+    Lists the material balances of a tablebase, smallest first. Every red that left the
+        board was captured by one of the players, so the reds captured by white also fix
+        black's.
+    Parameters: most marbles on the board (number)
+    Returns: list of (white marbles, black marbles, red marbles, reds captured by white)
+    """
+    slices = []
+    for total in range(3, max_marbles + 1):
+        for whites in range(1, min(_MARBLES_PER_PLAYER, total - 2) + 1):
+            for blacks in range(1, min(_MARBLES_PER_PLAYER, total - whites - 1) + 1):
+                reds = total - whites - blacks
+                if reds > _REDS:
+                    continue
+                captured = _REDS - reds
+                for white_captured in range(max(0, captured - _REDS_TO_WIN + 1),
+                                            min(captured, _REDS_TO_WIN - 1) + 1):
+                    slices.append((whites, blacks, reds, white_captured))
+    return slices
+
+
+def _slice_sizes(key):
+    """returns a slice's (black placements, red placements, number of positions)"""
+    whites, blacks, reds = key[:3]
+    black_size = _BINOMIAL[_SQUARES - whites][blacks]
+    red_size = _BINOMIAL[_SQUARES - whites - blacks][reds]
+    return black_size, red_size, _BINOMIAL[_SQUARES][whites] * black_size * red_size * 2
+
+
+def _position_index(occupied, side, black_size, red_size):
+    """
+    Ranks a position within its slice. Each color's squares are ranked as a combination of
+        the squares the colors before it leave free.
+    Parameters: dictionary of square -> color, color to move, the slice's black and red
+        placement counts
+    Returns: position index (number)
+    """
+    white_rank = black_rank = red_rank = 0
+    whites = blacks = reds = 0
+    for square in sorted(occupied):
+        color = occupied[square]
+        if color == _WHITE:
+            whites += 1
+            white_rank += _BINOMIAL[square][whites]
+        elif color == _BLACK:
+            blacks += 1
+            black_rank += _BINOMIAL[square - whites][blacks]
+        else:
+            reds += 1
+            red_rank += _BINOMIAL[square - whites - blacks][reds]
+    return ((white_rank * black_size + black_rank) * red_size + red_rank) * 2 + side
+
+
+def _unrank(rank, count):
+    """returns the ascending squares of the combination with the given rank"""
+    squares = []
+    square = _SQUARES - 1
+    for index in range(count, 0, -1):
+        while _BINOMIAL[square][index] > rank:
+            square -= 1
+        squares.append(square)
+        rank -= _BINOMIAL[square][index]
+        square -= 1
+    squares.reverse()
+    return squares
+
+
+def _spread(relative, taken):
+    """maps squares numbered among the free squares back to board squares"""
+    squares = []
+    for square in relative:
+        for other in taken:
+            if other > square:
+                break
+            square += 1
+        squares.append(square)
+    return squares
+
+
+def _position_at(index, key, black_size, red_size):
+    """
+    Rebuilds the position with the given index in a slice
+    Parameters: position index, slice key, the slice's black and red placement counts
+    Returns: (dictionary of square -> color, color to move)
+    """
+    side = index & 1
+    index, red_rank = divmod(index >> 1, red_size)
+    white_rank, black_rank = divmod(index, black_size)
+    whites = _unrank(white_rank, key[0])
+    blacks = _spread(_unrank(black_rank, key[1]), whites)
+    reds = _spread(_unrank(red_rank, key[2]), sorted(whites + blacks))
+    occupied = dict.fromkeys(whites, _WHITE)
+    occupied.update(dict.fromkeys(blacks, _BLACK))
+    occupied.update(dict.fromkeys(reds, _RED))
+    return occupied, side
+
+
+def _moves(occupied, mover):
+    """
+    Makes every legal push for a color, with the rules of KubaGame.legal_moves apart from
+        the repetition rule
+    Parameters: dictionary of square -> color, color to move
+    Returns: list of (position after the push, color pushed off the board or None)
+    """
+    moves = []
+    for square, color in occupied.items():
+        if color != mover:
+            continue
+        for direction in range(4):
+            # the tile the marble is pushed from must be empty or the tray
+            behind = _BEHIND_SQUARES[square][direction]
+            if behind >= 0 and behind in occupied:
+                continue
+            ray = _RAYS[square][direction]
+            length = 1
+            while length < len(ray) and ray[length] in occupied:
+                length += 1
+            pushed_off = None
+            if length == len(ray):
+                pushed_off = occupied[ray[-1]]
+                if pushed_off == mover:
+                    continue
+            after = dict(occupied)
+            del after[square]
+            for index in range(min(length, len(ray) - 1)):
+                after[ray[index + 1]] = occupied[ray[index]]
+            moves.append((after, pushed_off))
+    return moves
+
+
+def _unmoves(occupied, mover):
+    """
+    Takes back every push that could have led to a position without pushing a marble off,
+        the reverse of _moves
+    Parameters: dictionary of square -> color, color that made the last push
+    Returns: list of positions before the push
+    """
+    positions = []
+    for square, color in occupied.items():
+        if color != mover:
+            continue
+        for direction in range(4):
+            # the pushed marble came from the empty square behind it, and the square it
+            #  was pushed from must be empty or the tray
+            start = _BEHIND_SQUARES[square][direction]
+            if start < 0 or start in occupied:
+                continue
+            behind = _BEHIND_SQUARES[start][direction]
+            if behind >= 0 and behind in occupied:
+                continue
+            ray = _RAYS[square][direction]
+            # any part of the run of marbles ahead may have been pushed
+            for length in range(1, len(ray) + 1):
+                if ray[length - 1] not in occupied:
+                    break
+                before = dict(occupied)
+                before[start] = color
+                for index in range(length - 1):
+                    before[ray[index]] = occupied[ray[index + 1]]
+                del before[ray[length - 1]]
+                positions.append(before)
+    return positions
+
+
+class Tablebase:
+    """
+    This class reads (and, while it is built, writes) a tablebase file.
+    This class communicates with the following classes:
+     - KubaGame: Tablebase.probe looks up the position of a KubaGame.
+    """
+    def __init__(self, path, building=False):
+        """
+        Maps a tablebase file
+        Parameters: file path, whether the table is being built (opens it for writing and
+            accepts a table that isn't finished)
+        Returns: N/A
+        """
+        self._file = open(path, 'r+b' if building else 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0,
+                              access=mmap.ACCESS_WRITE if building else mmap.ACCESS_READ)
+        magic, version, self._max_marbles, count = _HEADER.unpack_from(self._map)
+        if (magic != _MAGIC and not building) or version != _VERSION:
+            self.close()
+            raise ValueError("not a complete version %d Kuba tablebase: %s" % (_VERSION, path))
+
+        # slice key -> (file offset, black placements, red placements, number of positions)
+        self._slices = {}
+        for number in range(count):
+            whites, blacks, reds, white_captured, offset = _SLICE.unpack_from(
+                self._map, _HEADER.size + number * _SLICE.size)
+            key = (whites, blacks, reds, white_captured)
+            self._slices[key] = (offset,) + _slice_sizes(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return sum(entry[3] for entry in self._slices.values())
+
+    def get_max_marbles(self):
+        """returns the most marbles on the board of a position in the table"""
+        return self._max_marbles
+
+    def close(self):
+        """Closes the table"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def probe(self, game, player_name):
+        """
+        Looks up a game's position for the player to move
+        Parameters: KubaGame object, name of the player to move (string)
+        Returns: (WIN, LOSS or DRAW, plies to the end of the game), or None if the game is
+            over, is not played on the standard board, or the position has more marbles
+            than the table holds
+        """
+        ruleset = game.get_ruleset()
+        if (ruleset.get_size(), ruleset.get_marble_count()[2], ruleset.get_reds_to_win()) \
+                != (_SIZE, _REDS, _REDS_TO_WIN):
+            return None
+        if game.get_winner() is not None or sum(game.get_marble_count()) > self._max_marbles:
+            return None
+        player = game.get_player(player_name)
+        other_player = game.get_other_player(player_name)
+        if player.get_color() == 'W':
+            side, white_captured = _WHITE, player.get_captured()
+        else:
+            side, white_captured = _BLACK, other_player.get_captured()
+
+        occupied = {}
+        board = game.get_board()
+        for row in range(_SIZE):
+            for col, tile in enumerate(board[row + 1][1:_SIZE + 1]):
+                if tile != 'X':
+                    occupied[row * _SIZE + col] = MARBLES.index(tile)
+        value = self.probe_position(occupied, side, white_captured)
+        if value is None:
+            return None
+        return decode_value(value)
+
+    def probe_position(self, occupied, side, white_captured):
+        """
+        Looks up a position
+        Parameters: dictionary of square (row * 7 + col in make_move coordinates) -> color
+            index in MARBLES, index in MARBLES of the color to move, reds captured by white
+        Returns: position value (see decode_value), or None if the table doesn't hold it
+        """
+        counts = [0, 0, 0]
+        for color in occupied.values():
+            counts[color] += 1
+        entry = self._slices.get((counts[0], counts[1], counts[2], white_captured))
+        if entry is None:
+            return None
+        offset, black_size, red_size = entry[:3]
+        index = _position_index(occupied, side, black_size, red_size)
+        return _VALUE.unpack_from(self._map, offset + index * _VALUE.size)[0]
+
+    def _solve_slice(self, key):
+        """
+        Solves every position of one material balance by retrograde analysis. Pushes that
+            capture lead to smaller slices, which are already solved; the positions are
+            then settled from the shortest wins and losses outwards, so every win is as
+            short and every loss as long as possible.
+        Parameters: slice key
+        Returns: array of position values
+        """
+        offset, black_size, red_size, size = self._slices[key]
+        values = array('h', bytes(2 * size))
+        remaining = bytearray(size)             # pushes within the slice not yet lost
+        longest = array('H', bytes(2 * size))   # longest loss among the lost pushes
+        escapes = bytearray(size)               # 1: a capture draws, 2: a capture wins
+        settled = bytearray(size)
+        pending = [[]]                          # pending[plies]: positions that may settle
+
+        def schedule(plies, index, won):
+            while len(pending) <= plies:
+                pending.append([])
+            pending[plies].append((index, won))
+
+        for index in range(size):
+            occupied, side = _position_at(index, key, black_size, red_size)
+            moves = _moves(occupied, side)
+            if not moves:
+                # a player with no legal moves loses
+                schedule(0, index, False)
+                continue
+            in_slice = 0
+            win = None
+            loss = 0
+            for after, pushed_off in moves:
+                if pushed_off is None:
+                    in_slice += 1
+                    continue
+                white_captured = key[3]
+                if pushed_off == _RED:
+                    captured = white_captured if side == _WHITE else _REDS - key[2] - white_captured
+                    if captured + 1 == _REDS_TO_WIN:
+                        win = 1
+                        break
+                    if side == _WHITE:
+                        white_captured += 1
+                elif key[pushed_off] == 1:
+                    win = 1         # the opponent's last marble
+                    break
+                value = self.probe_position(after, 1 - side, white_captured)
+                if value < 0:
+                    if win is None or -value < win:
+                        win = -value
+                elif value > 0:
+                    loss = max(loss, value + 1)
+                else:
+                    escapes[index] |= 1
+            remaining[index] = in_slice
+            longest[index] = loss
+            if win is not None:
+                escapes[index] |= 2
+                schedule(win, index, True)
+            elif in_slice == 0 and not escapes[index]:
+                schedule(loss, index, False)
+
+        plies = 0
+        while plies < len(pending):
+            for index, won in pending[plies]:
+                if settled[index]:
+                    continue
+                settled[index] = 1
+                values[index] = plies if won else -plies - 1
+                occupied, side = _position_at(index, key, black_size, red_size)
+                for before in _unmoves(occupied, 1 - side):
+                    previous = _position_index(before, 1 - side, black_size, red_size)
+                    if settled[previous]:
+                        continue
+                    if not won:
+                        schedule(plies + 1, previous, True)
+                    elif not escapes[previous]:
+                        # a position with a drawing or winning capture never loses
+                        remaining[previous] -= 1
+                        if plies + 1 > longest[previous]:
+                            longest[previous] = plies + 1
+                        if remaining[previous] == 0:
+                            schedule(longest[previous], previous, False)
+            pending[plies] = None
+            plies += 1
+        return values
+
+    def _write_slice(self, key, values):
+        """copies a solved slice into the file"""
+        if sys.byteorder != 'little':
+            values.byteswap()
+        offset = self._slices[key][0]
+        self._map[offset:offset + len(values) * _VALUE.size] = values.tobytes()
+        self._map.flush()
+
+
+def _solve_job(job):
+    """
+    Worker process entry point: solves one slice and writes it into the table
+    Parameters: (table path, slice key)
+    Returns: (slice key, wins, losses, draws, longest win in plies)
+    """
+    path, key = job
+    with Tablebase(path, building=True) as table:
+        values = table._solve_slice(key)
+        table._write_slice(key, values)
+    wins = sum(1 for value in values if value > 0)
+    losses = sum(1 for value in values if value < 0)
+    return key, wins, losses, len(values) - wins - losses, max(values)
+
+
+def build_tablebase(path, max_marbles=4, processes=None, report=None):
+    """
+    Builds a tablebase of every position with at most max_marbles marbles on the board.
+        Slices with the same number of marbles only depend on smaller slices, so each
+        size is solved a slice per worker process.
+    Parameters: output file path, most marbles on the board (3 or more), number of worker
+        processes (all cores by default), optional stream to print progress to
+    Returns: summary dictionary (positions, wins, losses, draws, longest win, seconds)
+    """
+    if max_marbles < 3:
+        raise ValueError("a position has at least one marble of each color")
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    start = time.perf_counter()
+
+    slices = table_slices(max_marbles)
+    offset = _HEADER.size + len(slices) * _SLICE.size
+    with open(path, 'wb') as new_file:
+        new_file.write(_HEADER.pack(b'\0' * len(_MAGIC), _VERSION, max_marbles, len(slices)))
+        for key in slices:
+            new_file.write(_SLICE.pack(*key, offset))
+            offset += _slice_sizes(key)[2] * _VALUE.size
+        new_file.truncate(offset)
+
+    summary = {'positions': 0, 'wins': 0, 'losses': 0, 'draws': 0, 'longest_win': 0}
+    with multiprocessing.Pool(processes) as pool:
+        for total in range(3, max_marbles + 1):
+            jobs = [(path, key) for key in slices if sum(key[:3]) == total]
+            for key, wins, losses, draws, longest in pool.imap_unordered(_solve_job, jobs):
+                summary['positions'] += wins + losses + draws
+                summary['wins'] += wins
+                summary['losses'] += losses
+                summary['draws'] += draws
+                summary['longest_win'] = max(summary['longest_win'], longest)
+                if report is not None:
+                    report.write("slice %s: %d wins, %d losses, %d draws (%.1fs)\n"
+                                 % (key, wins, losses, draws, time.perf_counter() - start))
+
+    with open(path, 'r+b') as table_file:
+        table_file.write(_MAGIC)
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def main(argv=None):
+    """
+    Command line entry point for building a tablebase
+    """
+    parser = argparse.ArgumentParser(description="Build a Kuba endgame tablebase")
+    parser.add_argument('path', help="tablebase file to write")
+    parser.add_argument('--marbles', type=int, default=4,
+                        help="most marbles (white, black and red) on the board")
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    summary = build_tablebase(args.path, args.marbles, args.processes, report=sys.stderr)
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,899 @@
+# Description: Tests for the Kuba rules engine. Run with: python -m pytest KubaTesting.py
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from KubaBatch import BatchBoard, WHITE, BLACK, EMPTY
+from KubaEngine import KubaEngine, material_evaluation, mobility_evaluation
+from KubaExport import ShardWriter, ShardDataset, play_game as export_game
+from KubaGame import KubaGame, GameBoard, BitBoard, DIRECTIONS, MARBLES, VALIDATION_STAGES, \
+    REJECTION_STAGES, MOVE_VALID, REPEAT, REPEAT_PREVIOUS, REPEAT_SUPERKO, SNAPSHOT_SIZE, \
+    STANDARD, Ruleset, set_instrumentation
+from KubaMCTS import MCTSPlayer
+from KubaPerft import perft, divide
+from KubaRecord import GameRecord, CHECKPOINT_INTERVAL, iter_records
+from KubaSelfPlay import run_self_play, play_game as self_play_game
+from KubaServer import KubaServer, _load_sessions
+from KubaStats import ValidationStats
+from KubaStore import SessionStore
+from KubaSymmetry import GEOMETRIC, COLOR_SWAP, board_tiles, canonical_key, canonicalize, \
+    inverse_transform, tiles_board, transform_board, transform_move, untransform_move
+from KubaTablebase import Tablebase, build_tablebase, WIN, LOSS, DRAW
+from KubaTournament import Tournament, schedule, match_elo, score_from_elo, sprt_llr, \
+    sprt_bounds, fit_ratings
+
+# importing the headless core (KubaGame) must take less than this many seconds
+IMPORT_TIME_BUDGET = 0.05
+
+# perft counts from the starting position, White to move (depth -> positions). Depths 1-5
+#  agree with brute force over every make_move call of the original GameBoard engine.
+PERFT_START = {1: 8, 2: 64, 3: 640, 4: 6384, 5: 70812}
+
+# Ruleset.scaled board size -> ((# white marbles, # black, # red), reds to win, depth 3
+#  perft count from its starting position, White to move)
+SCALED_RULESETS = {5: ((2, 2, 5), 3, 80), 7: ((8, 8, 13), 7, 640),
+                   9: ((8, 8, 25), 13, 704), 11: ((18, 18, 41), 21, 2160)}
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_core_import_is_headless_and_within_budget():
+    """
+    Imports KubaGame in fresh interpreters: the import must not load pygame and must
+        fit the startup-time budget (best of three, so the first run can write the .pyc)
+    """
+    script = ("import sys, time\n"
+              "start = time.perf_counter()\n"
+              "import KubaGame\n"
+              "print(time.perf_counter() - start, 'pygame' in sys.modules)\n")
+    # the budget is for a cached import: let the first run write the .pyc even where the
+    #  environment turns bytecode writing off
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    timings = []
+    for _ in range(3):
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=_HERE, text=True,
+                                         env=env)
+        seconds, pygame_loaded = output.split()
+        assert pygame_loaded == 'False'
+        timings.append(float(seconds))
+    assert min(timings) < IMPORT_TIME_BUDGET, timings
+
+
+def test_perft_start_position_matches_reference_counts():
+    """
+    Counts the positions reachable from the start on both board backends, and checks
+        that perft leaves the game as it found it
+    """
+    for board_class in (GameBoard, BitBoard):
+        game = KubaGame(('White', 'W'), ('Black', 'B'), board_class)
+        board = game.get_board()
+        for depth in (1, 2, 3, 4):
+            assert perft(game, 'White', depth) == PERFT_START[depth], (board_class, depth)
+        assert game.get_board() == board
+        assert game.get_current_turn() is None
+        assert len(game.get_moves()) == 0
+
+
+def test_scaled_rulesets():
+    """
+    Ruleset.scaled builds the standard game at size 7 and scaled marble sets and win
+        thresholds at other sizes, and both board backends count the same positions from
+        each scaled start
+    """
+    assert Ruleset.scaled(7) == STANDARD
+    for size in (3, 4, 6):
+        try:
+            Ruleset.scaled(size)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("size %d should be rejected" % size)
+    for size, (marble_count, reds_to_win, nodes) in SCALED_RULESETS.items():
+        ruleset = Ruleset.scaled(size)
+        assert ruleset.get_size() == size
+        assert ruleset.get_marble_count() == marble_count
+        assert ruleset.get_reds_to_win() == reds_to_win
+        for board_class in (GameBoard, BitBoard):
+            game = KubaGame(('White', 'W'), ('Black', 'B'), board_class, ruleset=ruleset)
+            assert game.get_marble_count() == marble_count
+            assert len(game.get_board()) == size + 2
+            assert perft(game, 'White', 3) == nodes, (board_class, size)
+
+
+def test_reds_to_win_threshold():
+    """
+    A player wins on the capture that brings them to the ruleset's reds_to_win, and not
+        one capture earlier
+    """
+    ruleset = Ruleset.scaled(5)     # 3 reds to win
+    # White pushing (0, 3) right drops the red at (0, 4) off the board
+    board = tiles_board('XXXWR'
+                        'XXXXX'
+                        'XXRXX'
+                        'XXXXX'
+                        'BXXXW', 5)
+    for board_class in (GameBoard, BitBoard):
+        for captured, winner in ((1, None), (2, 'White')):
+            game = KubaGame(('White', 'W'), ('Black', 'B'), board_class, ruleset=ruleset)
+            game.load_position(board, board, (captured, 0), 'White', None)
+            assert game.get_winner() is None
+            assert game.make_move('White', (0, 3), 'R')
+            assert game.get_captured('White') == captured + 1
+            assert game.get_winner() == winner, (board_class, captured)
+
+def test_perft_divide_adds_up():
+    """
+    The divide counts of every first move add up to the perft count
+    """
+    game = KubaGame(('White', 'W'), ('Black', 'B'))
+    counts = divide(game, 'White', 3)
+    assert len(counts) == PERFT_START[1]
+    assert sum(count for _, count in counts) == PERFT_START[3]
+
+
+def test_instrumentation_times_every_validation_stage():
+    """
+    Runs moves that each stage rejects, and moves that pass them all, with a
+        ValidationStats installed: every stage's latency histogram must be filled, with
+        one sample per call, and its rejections must match the rejection reasons counted
+    """
+    game = KubaGame(('White', 'W'), ('Black', 'B'))
+    attempts = [('White', (9, 9), 'F'),         # BAD_POSITION
+                ('White', (0, 0), 'X'),         # BAD_DIRECTION
+                ('Nobody', (0, 0), 'B'),        # UNKNOWN_PLAYER
+                ('White', (0, 5), 'B'),         # NOT_YOUR_MARBLE
+                ('White', (1, 1), 'B'),         # NO_ROOM
+                ('White', (0, 1), 'L'),         # SELF_CAPTURE
+                ('White', (0, 1), 'B'),
+                ('White', (1, 1), 'R'),         # NOT_YOUR_TURN
+                ('Black', (0, 5), 'B'),
+                ('White', (2, 1), 'R'),
+                ('Black', (2, 6), 'L'),         # REPEAT
+                ('Black', (1, 5), 'B')]
+    stats = ValidationStats()
+    set_instrumentation(stats)
+    try:
+        reasons = [game.check_move(*attempt) for attempt in attempts[:6]]
+        for name, coordinates, direction in attempts[6:]:
+            reasons.append(game.check_move(name, coordinates, direction))
+            game.make_move(name, coordinates, direction)
+        game.set_winner('White')
+        reasons.append(game.check_move('Black', (0, 5), 'B'))     # GAME_OVER
+    finally:
+        set_instrumentation(None)
+
+    assert set(reasons) == {MOVE_VALID} | set(REJECTION_STAGES)
+    result = stats.get_stats()
+    for stage in VALIDATION_STAGES:
+        entry = result['stages'][stage]
+        assert entry['calls'] > 0, stage
+        assert entry['buckets']['+Inf'] == entry['calls'], stage
+        # make_move checks each move again, so compare with every check the stats saw
+        assert entry['rejections'] == sum(count for reason, count in result['reasons'].items()
+                                          if REJECTION_STAGES.get(reason) == stage), stage
+    assert result['stages']['winner_check']['calls'] == result['checks']
+
+
+def test_batch_board_matches_kuba_game():
+    """
+    Steps a BatchBoard and one KubaGame per batch entry through the same seeded random
+        moves (mostly legal ones, some by the wrong player or off the board, and moves the
+        repetition rule forbids whenever there is one): the legal move masks, the move
+        results, the boards and the winners must agree with KubaGame after every step
+    """
+    rng = random.Random(8)
+    count = 12
+    names = {WHITE: 'White', BLACK: 'Black'}
+    codes = {'White': WHITE, 'Black': BLACK, None: EMPTY}
+    games = [KubaGame(('White', 'W'), ('Black', 'B')) for _ in range(count)]
+    batch = BatchBoard(count)
+    repeats = 0
+    for _ in range(120):
+        colors = np.array([codes[game.get_current_turn()] or rng.choice((WHITE, BLACK))
+                           for game in games], dtype=np.int8)
+        masks = batch.legal_move_masks(colors)
+        positions = []
+        directions = []
+        for index, game in enumerate(games):
+            name = names[int(colors[index])]
+            legal = game.legal_moves(name)
+            assert sorted(zip(*np.nonzero(masks[index]))) == \
+                sorted((row, col, DIRECTIONS.index(direction))
+                       for (row, col), direction in legal), index
+            repeating = [((row, col), direction) for row in range(7) for col in range(7)
+                         for direction in DIRECTIONS
+                         if game.get_board()[row + 1][col + 1] == game.get_player(name).get_color()
+                         and game.check_move(name, (row, col), direction) == REPEAT]
+            roll = rng.random()
+            if repeating and roll < 0.5:
+                move = rng.choice(repeating)
+                repeats += 1
+            elif legal and roll < 0.85:
+                move = rng.choice(legal)
+            else:
+                move = ((rng.randrange(-1, 8), rng.randrange(-1, 8)), rng.choice(DIRECTIONS))
+            if roll > 0.95:
+                colors[index] = WHITE + BLACK - colors[index]
+            positions.append(move[0])
+            directions.append(move[1])
+
+        valid = batch.make_moves(colors, positions, directions)
+        for index, game in enumerate(games):
+            made = game.make_move(names[int(colors[index])], positions[index], directions[index])
+            assert bool(valid[index]) == made, index
+            assert [row[1:-1] for row in batch.get_board(index)[1:-1]] == \
+                [row[1:-1] for row in game.get_board()[1:-1]], index
+            assert batch.winner[index] == codes[game.get_winner()], index
+    assert repeats > 0
+
+
+def test_symmetry_transforms_commute_with_pushes():
+    """
+    On positions from seeded random games: a move pushed on a transformed board and mapped
+        back gives the same board as the move pushed directly, for all eight rotations and
+        reflections (with and without the colour swap) and for the canonical transform,
+        and every symmetric copy of a position has the same canonical key
+    """
+    def pushed(board, move):
+        game_board = GameBoard()
+        game_board.set_board(board)
+        game_board.push_marble((move[0][0] + 1, move[0][1] + 1), move[1])
+        game_board.clear_tray()
+        return game_board.get_board()
+
+    rng = random.Random(25)
+    for _ in range(6):
+        game = KubaGame(('White', 'W'), ('Black', 'B'))
+        name = 'White'
+        for _ in range(rng.randrange(0, 30)):
+            moves = game.legal_moves(name)
+            if game.get_winner() is not None or not moves:
+                break
+            game.make_move(name, *rng.choice(moves))
+            name = game.get_current_turn()
+        board = [list(row) for row in game.get_board()]
+        color = game.get_player(name).get_color()
+        other = 'B' if color == 'W' else 'W'
+        key = canonical_key(board, color)[0]
+
+        canonical, transform = canonicalize(board, color)
+        assert board_tiles(canonical) == key.decode('ascii')
+        for move in game.legal_moves(name)[:6]:
+            expected = pushed(board, move)
+            via_canonical = pushed(canonical, transform_move(move, transform))
+            assert untransform_move(transform_move(move, transform), transform) == move
+            assert transform_board(via_canonical, inverse_transform(transform)) == expected
+            for geometric in range(len(GEOMETRIC)):
+                for symmetry in (geometric, geometric + COLOR_SWAP):
+                    result = pushed(transform_board(board, symmetry), transform_move(move, symmetry))
+                    assert transform_board(result, inverse_transform(symmetry)) == expected
+
+        for geometric in range(len(GEOMETRIC)):
+            assert canonical_key(transform_board(board, geometric), color)[0] == key
+            assert canonical_key(transform_board(board, geometric + COLOR_SWAP), other)[0] == key
+
+
+def _brute_force_analysis(board, color):
+    """
+    Works out a color's pushes and threats, and the marbles those threats push off, by
+        walking every push chain of a standard list of lists board
+    """
+    steps = {'F': (-1, 0), 'B': (1, 0), 'L': (0, -1), 'R': (0, 1)}
+    pushes = set()
+    threats = set()
+    exposed = set()
+    for row in range(1, 8):
+        for col in range(1, 8):
+            if board[row][col] != color:
+                continue
+            for direction, (row_step, col_step) in steps.items():
+                if board[row - row_step][col - col_step] in MARBLES:
+                    continue
+                end_row, end_col = row, col
+                while board[end_row + row_step][end_col + col_step] in MARBLES:
+                    end_row, end_col = end_row + row_step, end_col + col_step
+                pushed_off = None
+                if end_row + row_step in (0, 8) or end_col + col_step in (0, 8):
+                    pushed_off = board[end_row][end_col]
+                    if pushed_off == color:
+                        continue
+                    threats.add(((row - 1, col - 1), direction, pushed_off))
+                    exposed.add((pushed_off, (end_row - 1, end_col - 1)))
+                pushes.add(((row - 1, col - 1), direction))
+    return pushes, threats, exposed
+
+
+def test_position_analysis_matches_brute_force():
+    """
+    Keeps a PositionAnalysis through seeded random games on both board backends, moves
+        taken back with undo_move included: its pushes, mobility, threats and exposed
+        marbles must always match a brute force walk of every push chain
+    """
+    rng = random.Random(18)
+    for board_class in (GameBoard, BitBoard):
+        for _ in range(8):
+            game = KubaGame(('White', 'W'), ('Black', 'B'), board_class)
+            analysis = game.get_analysis()
+            name = 'White'
+            records = []
+            for _ in range(rng.randrange(10, 80)):
+                moves = game.legal_moves(name)
+                if game.get_winner() is not None or not moves:
+                    break
+                if records and rng.random() < 0.2:
+                    game.undo_move(records.pop())
+                    name = game.get_other_player(name).get_name()
+                else:
+                    records.append(game.apply_move(name, *rng.choice(moves)))
+                    name = game.get_other_player(name).get_name()
+
+                board = [list(row) for row in game.get_board()]
+                found = {color: _brute_force_analysis(board, color) for color in 'WB'}
+                for color in 'WB':
+                    pushes, threats, _ = found[color]
+                    assert set(analysis.get_pushes(color)) == pushes
+                    assert analysis.get_mobility(color) == len(pushes)
+                    assert set(analysis.get_threats(color)) == threats
+                for color in 'WBR':
+                    assert analysis.get_exposed(color) == sorted(
+                        {position for other in 'WB' if other != color
+                         for pushed_off, position in found[other][2] if pushed_off == color})
+
+
+def _game_state(game):
+    """returns what a game's play depends on: the playing areas of the board and the
+        previous board, the captured reds, the turn, the winner and the marble counts"""
+    return ([row[1:-1] for row in game.get_board()[1:-1]],
+            [row[1:-1] for row in game.get_board_prev()[1:-1]],
+            game.get_captured('White'), game.get_captured('Black'),
+            game.get_current_turn(), game.get_winner(), game.get_marble_count())
+
+
+def test_bitboard_matches_gameboard():
+    """
+    Plays the same seeded stream of move attempts (legal moves, moves by the wrong player
+        and moves off the board) on a GameBoard game and a BitBoard game: every move
+        result, legal move list and game state must agree
+    """
+    rng = random.Random(1)
+    for _ in range(10):
+        games = [KubaGame(('White', 'W'), ('Black', 'B'), board_class)
+                 for board_class in (GameBoard, BitBoard)]
+        for _ in range(150):
+            name = games[0].get_current_turn() or rng.choice(('White', 'Black'))
+            moves = games[0].legal_moves(name)
+            assert games[1].legal_moves(name) == moves
+            if games[0].get_winner() is not None or not moves:
+                break
+            roll = rng.random()
+            if roll < 0.8:
+                move = rng.choice(moves)
+            else:
+                move = ((rng.randrange(-1, 8), rng.randrange(-1, 8)), rng.choice(DIRECTIONS))
+                if roll > 0.9:
+                    name = games[0].get_other_player(name).get_name()
+            results = [game.make_move(name, *move) for game in games]
+            assert results[0] == results[1]
+            assert _game_state(games[0]) == _game_state(games[1])
+
+
+def test_game_copy_moves_to_another_backend():
+    """
+    A copy of a game on the other board backend keeps the whole game, superko history
+        included, and plays on exactly like the original
+    """
+    rng = random.Random(3)
+    for board_class, other_class in ((GameBoard, BitBoard), (BitBoard, GameBoard)):
+        game = KubaGame(('White', 'W'), ('Black', 'B'), board_class, REPEAT_SUPERKO)
+        name = 'White'
+        for _ in range(30):
+            game.make_move(name, *rng.choice(game.legal_moves(name)))
+            name = game.get_current_turn()
+        copied = game.copy(other_class)
+        assert copied.get_hash_history() == game.get_hash_history()
+        assert copied.get_moves() == game.get_moves()
+        for _ in range(60):
+            moves = game.legal_moves(name)
+            assert copied.legal_moves(name) == moves
+            assert _game_state(copied) == _game_state(game)
+            if not moves:
+                break
+            move = rng.choice(moves)
+            assert copied.make_move(name, *move) and game.make_move(name, *move)
+            name = game.get_current_turn()
+
+
+def test_mcts_searches_a_copy():
+    """
+    MCTSPlayer picks a legal move and leaves the game it was given unchanged
+    """
+    game = KubaGame(('White', 'W'), ('Black', 'B'))
+    game.make_move('White', (0, 0), 'B')
+    state = _game_state(game)
+    with MCTSPlayer(processes=1, seed=2) as player:
+        move = player.choose_move(game, 'Black', iterations=40)
+    assert move in game.legal_moves('Black')
+    assert _game_state(game) == state
+    assert len(game.get_moves()) == 1
+
+def test_bitboard_repetition_matches_gameboard():
+    """
+    Loads random positions whose previous board is one push away from the current one, so
+        that some pushes repeat it, and checks that both backends find the same legal
+        moves, push chains and pushed off marbles under both repetition rules
+    """
+    rng = random.Random(5)
+    repeats = 0
+    for _ in range(60):
+        game = KubaGame(('White', 'W'), ('Black', 'B'))
+        name = 'White'
+        for _ in range(rng.randrange(40)):
+            moves = game.legal_moves(name)
+            if not moves or game.get_winner() is not None:
+                break
+            game.make_move(name, *rng.choice(moves))
+            name = game.get_current_turn()
+        board = game.get_board()
+        previous = GameBoard()
+        previous.set_board(board)
+        previous.apply_move((rng.randrange(1, 8), rng.randrange(1, 8)), rng.choice(DIRECTIONS))
+        for rule in (REPEAT_PREVIOUS, REPEAT_SUPERKO):
+            games = []
+            for board_class in (GameBoard, BitBoard):
+                loaded = KubaGame(('White', 'W'), ('Black', 'B'), board_class, rule)
+                loaded.load_position(board, previous.get_board(), (0, 0), name, None)
+                games.append(loaded)
+            moves = games[0].legal_moves(name)
+            assert games[1].legal_moves(name) == moves
+            color = games[0].get_player(name).get_color()
+            repeats += len(games[0]._board.legal_pushes(color, lambda board_hash: False)) \
+                - len(moves)
+            for row in range(1, 8):
+                for col in range(1, 8):
+                    for direction in DIRECTIONS:
+                        assert games[0]._board.get_push_chain((row, col), direction) \
+                            == games[1]._board.get_push_chain((row, col), direction)
+                        assert games[0].get_pushed_off((row - 1, col - 1), direction) \
+                            == games[1].get_pushed_off((row - 1, col - 1), direction)
+    assert repeats > 0
+
+def test_game_record_seek_matches_replay():
+    """
+    Records seeded random games, round trips the records through an archive of their
+        binary format, and seeks to plies around every checkpoint: each seek must give
+        the same game state as replaying the moves from the start
+    """
+    rng = random.Random(13)
+    games = []
+    for number in range(3):
+        game = KubaGame(('White', 'W'), ('Black', 'B'))
+        name = ('White', 'Black')[number % 2]
+        while len(game.get_moves()) < 4 * CHECKPOINT_INTERVAL + 5 and game.get_winner() is None:
+            moves = game.legal_moves(name)
+            if not moves:
+                game.set_winner(game.get_other_player(name).get_name())
+                break
+            game.make_move(name, *rng.choice(moves))
+            name = game.get_current_turn()
+        games.append(game)
+
+    archive = b''.join(GameRecord.from_game(game).to_bytes() for game in games)
+    records = list(iter_records(archive))
+    assert len(records) == len(games)
+    for game, record in zip(games, records):
+        assert bytes(record.get_moves()) == bytes(game.get_moves())
+        assert record.get_winner() == game.get_winner()
+        replayed = [_game_state(record.new_game())]
+        replayed += [_game_state(step) for step in record.iter_games()]
+        plies = {0, 1, len(record)}
+        for checkpoint in range(CHECKPOINT_INTERVAL, len(record) + 1, CHECKPOINT_INTERVAL):
+            plies.update((checkpoint - 1, checkpoint, checkpoint + 1))
+        for ply in sorted(ply for ply in plies if ply <= len(record)):
+            state = _game_state(record.get_game(ply))
+            if ply == len(record):
+                assert state == _game_state(game)
+            else:
+                assert state == replayed[ply], ply
+
+
+def test_snapshot_round_trip():
+    """
+    Snapshots seeded random games at every ply with to_bytes and restores them with
+        from_bytes on both board backends: the snapshot has the fixed size, the restored
+        game has the same state and legal moves, and snapshots it again to the same bytes
+    """
+    players = (('White', 'W'), ('Black', 'B'))
+    rng = random.Random(16)
+    for number in range(4):
+        rule = REPEAT_SUPERKO if number == 3 else REPEAT_PREVIOUS
+        game = KubaGame(players[0], players[1], GameBoard, rule)
+        name = players[number % 2][0]
+        for _ in range(60):
+            data = game.to_bytes()
+            assert len(data) == SNAPSHOT_SIZE
+            for board_class in (GameBoard, BitBoard):
+                restored = KubaGame.from_bytes(data, players[0], players[1], board_class)
+                assert _game_state(restored) == _game_state(game)
+                assert restored.get_first_player() == game.get_first_player()
+                assert restored.get_repetition_rule() == game.get_repetition_rule()
+                assert restored.to_bytes() == data
+                # a restored game only knows the previous board, not the superko history
+                if rule == REPEAT_PREVIOUS:
+                    for player_name in ('White', 'Black'):
+                        assert restored.legal_moves(player_name) == game.legal_moves(player_name)
+            moves = game.legal_moves(name)
+            if game.get_winner() is not None or not moves:
+                break
+            game.make_move(name, *rng.choice(moves))
+            name = game.get_current_turn()
+
+
+
+def test_tournament_schedule_alternates_colours():
+    """
+    Every pairing of a round-robin schedule plays each colour in turn, game numbers count
+        up, and each opening number is played once with each colour by the same pairing
+    """
+    for players, games_per_pair in ((2, 4), (3, 6), (4, 3)):
+        games = schedule(players, games_per_pair)
+        assert [game[0] for game in games] == list(range(len(games)))
+        pairings = {}
+        openings = {}
+        for _, white, black, opening in games:
+            pairings.setdefault(frozenset((white, black)), []).append(white)
+            openings.setdefault(opening, []).append((white, black))
+        assert len(pairings) == players * (players - 1) // 2
+        for whites in pairings.values():
+            assert len(whites) == games_per_pair
+            assert all(whites[number] != whites[number + 1] for number in range(len(whites) - 1))
+        for colours in openings.values():
+            assert len(colours) <= 2
+            if len(colours) == 2:
+                assert colours[0] == colours[1][::-1]
+
+
+def test_match_elo_and_sprt():
+    """
+    match_elo estimates lie inside their intervals and change sign with the colours of the
+        result, a one-sided result has an interval open on one side only, and the SPRT
+        log-likelihood ratio changes sign when the result and hypotheses are mirrored
+    """
+    assert match_elo(0, 0, 0) == (None, None, None)
+    for wins, draws, losses in ((5, 2, 3), (12, 30, 8), (1, 0, 1), (0, 10, 0), (3, 0, 9)):
+        elo, lower, upper = match_elo(wins, draws, losses)
+        assert lower < elo < upper
+        mirrored = match_elo(losses, draws, wins)
+        assert math.isclose(-mirrored[0], elo, abs_tol=1e-9)
+        assert math.isclose(-mirrored[1], upper) and math.isclose(-mirrored[2], lower)
+        score = (wins + 0.5 * draws) / (wins + draws + losses)
+        assert abs(score_from_elo(elo) - score) < 1e-9
+    # a clean sweep has an infinite estimate but a finite lower bound
+    elo, lower, upper = match_elo(10, 0, 0)
+    assert elo == upper == math.inf and 0 < lower < math.inf
+    elo, lower, upper = match_elo(0, 0, 10)
+    assert elo == lower == -math.inf and -math.inf < upper < 0
+
+    lower, upper = sprt_bounds(0.05, 0.05)
+    assert abs(lower + math.log(19)) < 1e-12 and abs(upper - math.log(19)) < 1e-12
+    assert sprt_bounds(0.05, 0.1)[0] > lower
+    for wins, draws, losses in ((30, 20, 10), (10, 50, 12), (0, 5, 8), (7, 0, 0)):
+        llr = sprt_llr(wins, draws, losses, 0, 20)
+        assert abs(llr + sprt_llr(losses, draws, wins, -20, 0)) < 1e-9
+    assert abs(sprt_llr(20, 10, 20, -10, 10)) < 1e-9
+    assert sprt_llr(60, 20, 20, 0, 20) > upper
+    assert sprt_llr(20, 20, 60, 0, 20) < lower
+
+
+def test_fit_ratings():
+    """
+    fit_ratings averages 0, orders the players by result, matches the Bradley-Terry odds of
+        a single pairing (with its one virtual draw) and keeps a player who won every game
+        finite
+    """
+    def results(pairs):
+        return [{'white': white, 'black': black, 'winner': winner}
+                for white, black, winner, times in pairs for _ in range(times)]
+
+    ratings = fit_ratings(['a', 'b'], results([('a', 'b', 'a', 3), ('b', 'a', 'b', 1)]))
+    assert abs(ratings['a'][0] + ratings['b'][0]) < 1e-6
+    # 3.5 points to 1.5 with the virtual draw
+    assert abs(ratings['a'][0] - ratings['b'][0] - 400 * math.log10(3.5 / 1.5)) < 1e-6
+    for elo, lower, upper in ratings.values():
+        assert lower < elo < upper
+
+    games = results([('a', 'b', 'a', 4), ('b', 'c', 'b', 3), ('c', 'b', None, 2),
+                     ('a', 'c', 'a', 5), ('c', 'a', 'c', 1)])
+    ratings = fit_ratings(['a', 'b', 'c', 'd'], games)
+    assert ratings['a'][0] > ratings['b'][0] > ratings['c'][0]
+    assert all(math.isfinite(value) for value in ratings['a'])
+    assert abs(sum(elo for elo, _, _ in ratings.values())) < 1e-6
+    # a player without games has no interval
+    assert ratings['d'][1:] == (None, None)
+
+
+def test_tournament_resumes_from_a_cut_last_line(tmp_path):
+    """
+    A results file whose last line was cut short by an interrupted write is resumed: the
+        cut line is dropped, the SPRT decision still owed is appended after the last
+        complete line, and the file then reads back cleanly
+    """
+    path = str(tmp_path / 'tournament.jsonl')
+    players = [{'name': 'first', 'policy': 'random'}, {'name': 'second', 'policy': 'random'}]
+    sprt = {'elo0': 0, 'elo1': 50, 'alpha': 0.05, 'beta': 0.05}
+    Tournament(players, path, games_per_pair=40, sprt=sprt)
+    with open(path, 'a') as results_file:
+        for number in range(30):
+            white, black = ('first', 'second') if number % 2 == 0 else ('second', 'first')
+            results_file.write(json.dumps({'game': number, 'white': white, 'black': black,
+                                           'winner': 'first', 'plies': 20}) + '\n')
+        # the decision line the first player's clean sweep led to, cut short
+        results_file.write('{"sprt": {"players": ["first", "sec')
+
+    tournament = Tournament(players, path, games_per_pair=40, sprt=sprt)
+    assert tournament.sprt_status('first', 'second')[1] == 'H1'
+    with open(path, 'rb') as results_file:
+        lines = results_file.read().split(b'\n')
+    assert lines[-1] == b'' and b'\x00' not in b''.join(lines)
+    assert len(lines) == 33 and json.loads(lines[-2])['sprt']['decision'] == 'H1'
+
+    resumed = Tournament(players, path, games_per_pair=40, sprt=sprt)
+    assert resumed.pair_record('first', 'second') == (30, 0, 0)
+    assert resumed.sprt_status('first', 'second')[1] == 'H1'
+    assert list(resumed._jobs()) == []
+    with open(path, 'rb') as results_file:
+        assert results_file.read().split(b'\n') == lines
+
+
+
+def test_tablebase_matches_one_ply_lookahead(tmp_path):
+    """
+    Builds the 3-marble tablebase and checks seeded random positions against a one-ply
+        lookahead through KubaGame: a position is won if some move wins at once or leaves
+        the opponent lost (in the fewest plies), lost if every move leaves the opponent
+        won (in the most plies) or there are no moves, and drawn otherwise
+    """
+    path = str(tmp_path / 'kuba3.kbt')
+    summary = build_tablebase(path, max_marbles=3, processes=1)
+    players = (('White', 'W'), ('Black', 'B'))
+    names = ('White', 'Black')
+    rng = random.Random(17)
+    seen = set()
+    with Tablebase(path) as table:
+        assert len(table) == summary['positions']
+        for _ in range(300):
+            board = [['X'] * 9 for _ in range(9)]
+            for tile, square in zip(MARBLES, rng.sample(range(49), 3)):
+                board[square // 7 + 1][square % 7 + 1] = tile
+            side = rng.randrange(2)
+            game = KubaGame(players[0], players[1], rng.choice((GameBoard, BitBoard)))
+            # one red left on the board: each player has captured six
+            game.load_position(board, [['X'] * 9 for _ in range(9)], (6, 6), names[side], None)
+            best = None
+            for move in game.legal_moves(names[side]):
+                record = game.apply_move(names[side], *move)
+                if game.get_winner() == names[side]:
+                    outcome = (WIN, 1)
+                else:
+                    result, plies = table.probe(game, names[1 - side])
+                    outcome = {WIN: (LOSS, plies + 1),
+                               LOSS: (WIN, plies + 1),
+                               DRAW: (DRAW, 0)}[result]
+                game.undo_move(record)
+                rank = {WIN: (2, -outcome[1]), DRAW: (1, 0),
+                        LOSS: (0, outcome[1])}[outcome[0]]
+                if best is None or rank > best[0]:
+                    best = (rank, outcome)
+            expected = best[1] if best is not None else (LOSS, 0)
+            assert table.probe(game, names[side]) == expected
+            seen.add(expected[0])
+    assert seen == {WIN, LOSS, DRAW}
+
+
+
+def test_shard_round_trip(tmp_path):
+    """
+    Writes seeded random games with small shard and block sizes and reads them back:
+        every shard but the last is full, the last one is trimmed to its positions, the
+        manifest counts the positions and games, and batches (some spanning two shards)
+        give back every position in order
+    """
+    games = [export_game((number, 24 + number, 'random', 'random', 30 + number, 0, 0, None))
+             for number in range(12)]
+    expected = {name: np.concatenate([positions[name] for positions in games])
+                for name in games[0]}
+    total = len(expected['turn'])
+    shard_size, block_size, batch_size = 37, 8, 7
+    assert total % shard_size and total % batch_size
+
+    directory = str(tmp_path / 'dataset')
+    with ShardWriter(directory, shard_size=shard_size, block_size=block_size,
+                     meta={'seed': 24}) as writer:
+        for positions in games:
+            writer.add_game(positions)
+    manifest = ShardDataset(directory).get_manifest()
+    assert manifest['positions'] == total and manifest['games'] == len(games)
+    assert manifest['meta'] == {'seed': 24}
+    sizes = [shard['positions'] for shard in manifest['shards']]
+    assert sizes == [shard_size] * (total // shard_size) + [total % shard_size]
+
+    dataset = ShardDataset(directory)
+    assert len(dataset) == total
+    for shard, size in zip(dataset.shards(), sizes):
+        assert all(len(array) == size for array in shard.values())
+    batches = list(dataset.batches(batch_size))
+    assert [len(batch['turn']) for batch in batches] == \
+        [batch_size] * (total // batch_size) + [total % batch_size]
+    for name, array in expected.items():
+        read = np.concatenate([batch[name] for batch in batches])
+        assert read.dtype == array.dtype and np.array_equal(read, array), name
+    batches = list(dataset.batches(batch_size, ['result', 'ply']))
+    assert set(batches[0]) == {'result', 'ply'}
+    assert np.array_equal(np.concatenate([batch['ply'] for batch in batches]), expected['ply'])
+
+
+
+def test_self_play_is_reproducible_from_its_seeds(tmp_path):
+    """
+    A self-play game replays exactly from its seed, down to its binary game record, and a
+        seeded run writes the same games whatever the number of worker processes
+    """
+    for policies in (('random', 'random'), ('greedy', 'random')):
+        for number in range(4):
+            job = (number, 7 + number) + policies + (200, 0, 0, True)
+            first = self_play_game(job)
+            assert self_play_game(job) == first
+            record, _ = GameRecord.from_bytes(first['record'])
+            assert len(record) == first['plies'] and record.get_winner() == first['winner']
+            replayed = record.get_game()
+            assert {name: replayed.get_captured(name) for name in ('White', 'Black')} == \
+                first['captured']
+        assert self_play_game((0, 1) + policies + (200, 0, 0, True)) != \
+            self_play_game((0, 2) + policies + (200, 0, 0, True))
+
+    runs = []
+    for processes in (1, 2):
+        path = str(tmp_path / ('games-%d.jsonl' % processes))
+        summary = run_self_play(12, path, 'greedy', 'random', processes=processes, seed=7,
+                                max_plies=200, window=5)
+        assert summary['games'] == 12
+        with open(path) as games_file:
+            runs.append(sorted((json.loads(line) for line in games_file),
+                               key=lambda result: result['game']))
+    assert runs[0] == runs[1]
+    assert runs[0][3] == self_play_game((3, 10, 'greedy', 'random', 200, 0, 0, False))
+
+
+
+def test_session_store_round_trip(tmp_path):
+    """
+    Saves seeded random games to a session store small enough to grow, overwrites and
+        deletes some, and restores them after reopening the file: every stored game comes
+        back in the same state on both board backends, and deleted ones are gone
+    """
+    players = (('White', 'W'), ('Black', 'B'))
+    path = str(tmp_path / 'sessions.kbs')
+    rng = random.Random(15)
+    saved = {}
+    with SessionStore(path, capacity=2) as store:
+        for session_id in range(1, 10):
+            game = KubaGame(players[0], players[1], GameBoard)
+            name = players[session_id % 2][0]
+            for _ in range(rng.randrange(60)):
+                moves = game.legal_moves(name)
+                if game.get_winner() is not None or not moves:
+                    break
+                game.make_move(name, *rng.choice(moves))
+                name = game.get_current_turn()
+            store.put(session_id, game)
+            saved[session_id] = game
+        # a later save of a session replaces the earlier one
+        game = saved[1]
+        name = game.get_current_turn()
+        game.make_move(name, *game.legal_moves(name)[0])
+        store.put(1, game)
+        store.delete(4)
+        del saved[4]
+        store.delete(4)
+        assert len(store) == len(saved)
+
+    for board_class in (GameBoard, BitBoard):
+        with SessionStore(path, players=players, board_class=board_class) as store:
+            assert sorted(store.session_ids()) == sorted(saved)
+            assert 4 not in store
+            for session_id, restored in store.items():
+                assert _game_state(restored) == _game_state(saved[session_id])
+                assert restored.to_bytes() == saved[session_id].to_bytes()
+
+
+
+def test_server_sessions():
+    """
+    Plays sessions against a KubaServer: a push of the other player's marble is rejected
+        with its reason, a legal move is sent to both players, and seeded sessions of
+        random legal moves all finish with every move counted
+    """
+    async def run():
+        server = KubaServer(idle_timeout=10)
+        port = await server.start('127.0.0.1', 0)
+        try:
+            white_reader, white_writer = await asyncio.open_connection('127.0.0.1', port)
+            black_reader, black_writer = await asyncio.open_connection('127.0.0.1', port)
+            white_writer.write(b'NEW\n')
+            session_id = (await white_reader.readline()).split()[1]
+            black_writer.write(b'JOIN %s\n' % session_id)
+            assert (await black_reader.readline()).split()[0] == b'SESSION'
+            for reader in (white_reader, black_reader):
+                assert (await reader.readline()).split() == [b'START', session_id]
+            black_writer.write(b'MOVE 0 0 B\n')
+            assert await black_reader.readline() == b'ERR invalid move not_your_marble\n'
+            white_writer.write(b'MOVE 0 0 B\n')
+            for reader in (white_reader, black_reader):
+                words = (await reader.readline()).split()
+                assert words[:5] == [b'UPDATE', b'White', b'0', b'0', b'B']
+                assert words[-2:] == [b'Black', b'-']
+            for writer in (white_writer, black_writer):
+                writer.write(b'QUIT\n')
+                writer.close()
+
+            moves, failures, latencies = await _load_sessions('127.0.0.1', port, 20, 5, 40, 14)
+            assert failures == 0 and moves == len(latencies) > 0
+            stats = server.get_stats()
+            assert stats['moves'] == moves + 1 and stats['sessions_started'] == 21
+        finally:
+            await server.close()
+
+    asyncio.run(run())
+
+
+
+def test_engine_search_keeps_its_time_budget():
+    """
+    Timed engine searches from seeded random positions return within their budget (with
+        a little slack for the clock) with a legal move and a principal variation that
+        starts with it and plays out legally, and leave the game unchanged
+    """
+    players = (('White', 'W'), ('Black', 'B'))
+    rng = random.Random(5)
+    budget_ms = 30
+    for number in range(8):
+        board_class = (GameBoard, BitBoard)[number % 2]
+        evaluate = (material_evaluation, mobility_evaluation)[number // 2 % 2]
+        game = KubaGame(players[0], players[1], board_class)
+        name = players[number % 2][0]
+        for _ in range(rng.randrange(30)):
+            moves = game.legal_moves(name)
+            if game.get_winner() is not None or not moves:
+                break
+            game.make_move(name, *rng.choice(moves))
+            name = game.get_current_turn()
+        if game.get_winner() is not None or not game.legal_moves(name):
+            continue
+        snapshot = game.to_bytes()
+        engine = KubaEngine(evaluate)
+        start = time.perf_counter()
+        result = engine.search(game, name, time_ms=budget_ms)
+        assert time.perf_counter() - start < (budget_ms + 5) / 1000.0
+        assert game.to_bytes() == snapshot
+        assert result.move in game.legal_moves(name)
+        assert result.pv and result.pv[0] == result.move
+        for move in result.pv:
+            assert game.make_move(name, *move)
+            name = game.get_current_turn()
+
+    # without a deadline in reach the search stops at its depth limit
+    game = KubaGame(players[0], players[1], GameBoard)
+    result = KubaEngine().search(game, 'White', time_ms=60000, max_depth=2)
+    assert result.depth == 2 and len(result.pv) == 2
+
+
 # game = KubaGame(('PlayerA', 'W'), ('PlayerB', 'B'))
 # print("Board start (below)")
 # game.display_board()
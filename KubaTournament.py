@@ -0,0 +1,624 @@
+# Description: This program runs round-robin tournaments between computer player
+#               configurations on a pool of worker processes. Every pair of players meets
+#               the same number of times with colours alternating, each game is played through
+#               KubaGame.make_move and appended to a results file as it finishes, so an
+#               interrupted tournament resumes where it stopped. The results are summarized
+#               as Elo ratings with confidence intervals, and a sequential probability ratio
+#               test (SPRT) can stop a pairing as soon as its result is clear.
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import time
+
+from KubaGame import KubaGame, BitBoard, Ruleset, STANDARD
+from KubaEngine import KubaEngine, material_evaluation, mobility_evaluation
+from KubaSelfPlay import choose_move, RANDOM_POLICY, GREEDY_POLICY, ENGINE_POLICY
+
+PLAYERS = (('White', 'W'), ('Black', 'B'))
+
+# player configurations: policy -> the options it takes (option -> default)
+POLICY_OPTIONS = {RANDOM_POLICY: {},
+                  GREEDY_POLICY: {},
+                  ENGINE_POLICY: {'time_ms': 100, 'depth': 64, 'eval': 'material'}}
+EVALUATIONS = {'material': material_evaluation, 'mobility': mobility_evaluation}
+
+# two-sided 95% confidence intervals
+_Z95 = 1.959963984540054
+# Elo points per natural log unit of the odds of winning
+_ELO_PER_NAT = 400.0 / math.log(10.0)
+
+# one engine per (worker process, player configuration), created when first needed
+_engines = {}
+
+
+def parse_player(spec):
+    """
+    Parses a player configuration written as NAME=POLICY[,OPTION=VALUE...], for example
+        deep=engine,depth=4,eval=mobility
+    Parameters: configuration (string)
+    Returns: configuration dictionary (see check_player)
+    """
+    name, _, rest = spec.partition('=')
+    fields = rest.split(',')
+    config = {'name': name, 'policy': fields[0]}
+    for field in fields[1:]:
+        option, _, value = field.partition('=')
+        config[option] = int(value) if value.isdigit() else value
+    return check_player(config)
+
+
+def check_player(config):
+    """
+    Checks a player configuration and fills in the default options of its policy
+    Parameters: dictionary with 'name', 'policy' and the policy's options
+    Returns: new configuration dictionary
+    """
+    policy = config.get('policy')
+    if not config.get('name'):
+        raise ValueError("every player needs a name")
+    if policy not in POLICY_OPTIONS:
+        raise ValueError("unknown policy for %s: %s" % (config['name'], policy))
+    checked = {'name': config['name'], 'policy': policy}
+    checked.update(POLICY_OPTIONS[policy])
+    for option, value in config.items():
+        if option in ('name', 'policy'):
+            continue
+        if option not in POLICY_OPTIONS[policy]:
+            raise ValueError("%s policy has no option %s" % (policy, option))
+        checked[option] = value
+    if policy == ENGINE_POLICY and checked['eval'] not in EVALUATIONS:
+        raise ValueError("unknown evaluation: " + str(checked['eval']))
+    return checked
+
+
+def schedule(players, games_per_pair):
+    """
+    Lists the games of a round robin, round by round so every pairing progresses evenly.
+        Within a pairing the colours alternate, and each two games (one with each
+        colour) share an opening number.
+    Parameters: number of players, games each pair of players plays (number)
+    Returns: list of (game number, white player index, black player index, opening number)
+    """
+    pairs = [(first, second) for first in range(players) for second in range(first + 1, players)]
+    games = []
+    for game_round in range(games_per_pair):
+        for pair, (first, second) in enumerate(pairs):
+            if game_round % 2 == 0:
+                white, black = first, second
+            else:
+                white, black = second, first
+            games.append((len(games), white, black, game_round // 2 * len(pairs) + pair))
+    return games
+
+
+def play_game(job):
+    """
+    Plays one tournament game through KubaGame.make_move. The first plies are random
+        moves drawn from the opening seed, so colour-swapped games start from the same
+        position; White moves first.
+    Parameters: tuple of (game number, white configuration, black configuration, seed,
+        random opening plies, longest game in plies, board size)
+    Returns: result dictionary (game, white, black, winner name or None for a draw, plies)
+    """
+    number, white, black, seed, opening_plies, max_plies, size = job
+    ruleset = STANDARD if size is None else Ruleset.scaled(size)
+    game = KubaGame(PLAYERS[0], PLAYERS[1], BitBoard, ruleset=ruleset)
+    configs = {'White': white, 'Black': black}
+    rng = random.Random(seed)
+    for config in (white, black):
+        engine = _engines.get(config['name'])
+        if engine is not None:
+            engine.clear()
+
+    player_name = PLAYERS[0][0]
+    plies = 0
+    while plies < max_plies and game.get_winner() is None:
+        if plies < opening_plies:
+            move = choose_move(RANDOM_POLICY, game, player_name, rng)
+        else:
+            move = _choose_move(configs[player_name], game, player_name, rng)
+        if move is None:
+            # a player with no legal moves loses
+            game.set_winner(game.get_other_player(player_name).get_name())
+            break
+        game.make_move(player_name, move[0], move[1])
+        player_name = game.get_current_turn()
+        plies += 1
+
+    winner = game.get_winner()
+    return {'game': number,
+            'white': white['name'],
+            'black': black['name'],
+            'winner': configs[winner]['name'] if winner is not None else None,
+            'plies': plies}
+
+
+def _choose_move(config, game, player_name, rng):
+    """
+    Picks a move for a player configuration
+    """
+    if config['policy'] != ENGINE_POLICY:
+        return choose_move(config['policy'], game, player_name, rng)
+    engine = _engines.get(config['name'])
+    if engine is None:
+        engine = _engines[config['name']] = KubaEngine(EVALUATIONS[config['eval']])
+    return engine.search(game, player_name, time_ms=config['time_ms'],
+                         max_depth=config['depth']).move
+
+
+def elo_from_score(score):
+    """
+    Converts an expected score to an Elo difference
+    Parameters: score fraction (number between 0 and 1)
+    Returns: Elo difference (number, infinite for a score of 0 or 1)
+    """
+    if score <= 0.0:
+        return -math.inf
+    if score >= 1.0:
+        return math.inf
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+
+def score_from_elo(elo):
+    """
+    Converts an Elo difference to an expected score
+    Parameters: Elo difference (number)
+    Returns: score fraction (number between 0 and 1)
+    """
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+def match_elo(wins, draws, losses):
+    """
+    Estimates the Elo difference of a match from its result, with a 95% confidence interval
+        from the per-game variance of the score
+    Parameters: wins, draws and losses of the first player (numbers)
+    Returns: (Elo difference, lower bound, upper bound), all None without games. An
+        interval reaching a score of 0 or 1 is open on that side (a bound of -inf or
+        +inf), as is the one of a match won or lost in every game.
+    """
+    games = wins + draws + losses
+    if games == 0:
+        return None, None, None
+    score = (wins + 0.5 * draws) / games
+    if wins == 0 or losses == 0:
+        # the variance of a one-sided result is 0: add half a win and half a loss to it,
+        #  as sprt_llr does
+        wins, losses = wins + 0.5, losses + 0.5
+    adjusted = (wins + 0.5 * draws) / (wins + draws + losses)
+    variance = (wins * (1.0 - adjusted) ** 2 + draws * (0.5 - adjusted) ** 2
+                + losses * adjusted ** 2) / (wins + draws + losses)
+    margin = _Z95 * math.sqrt(variance / games)
+    return (elo_from_score(score), elo_from_score(score - margin),
+            elo_from_score(score + margin))
+
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    """
+    Returns the log-likelihood ratio of the hypothesis elo1 against elo0 for a match
+        result, with the trinomial (win/draw/loss) normal approximation used by chess
+        engine testing frameworks
+    Parameters: wins, draws and losses of the first player, Elo difference under the null
+        and the alternative hypothesis (numbers)
+    Returns: log-likelihood ratio (number)
+    """
+    games = wins + draws + losses
+    if wins == 0 or losses == 0:
+        # the variance is not defined yet: add half a win and half a loss
+        wins, draws, losses = wins + 0.5, draws, losses + 0.5
+        games += 1
+    score = (wins + 0.5 * draws) / games
+    variance = (wins * (1.0 - score) ** 2 + draws * (0.5 - score) ** 2
+                + losses * score ** 2) / games
+    score0 = score_from_elo(elo0)
+    score1 = score_from_elo(elo1)
+    return (score1 - score0) * (2.0 * score - score0 - score1) / (2.0 * variance / games)
+
+
+def sprt_bounds(alpha, beta):
+    """
+    Returns the (lower, upper) log-likelihood ratio bounds of an SPRT: below the lower
+        bound elo0 is accepted, above the upper bound elo1 is accepted
+    Parameters: false positive rate alpha and false negative rate beta (numbers)
+    Returns: tuple of two numbers
+    """
+    return math.log(beta / (1.0 - alpha)), math.log((1.0 - beta) / alpha)
+
+
+def fit_ratings(names, results, iterations=1000, tolerance=1e-9):
+    """
+    Fits Bradley-Terry Elo ratings to every game played (a draw counts half a win for
+        each side) by minorization-maximization, with the ratings averaging 0. Every
+        pairing that played also gets one virtual draw, so a player who won or lost every
+        game still has a finite rating. The 95% intervals come from the curvature of the
+        likelihood at the fitted ratings.
+    Parameters: player names (list), game results (dictionaries with 'white', 'black'
+        and 'winner'), iteration limit, convergence tolerance (numbers)
+    Returns: dictionary of name -> (Elo, lower bound, upper bound)
+    """
+    index = {name: number for number, name in enumerate(names)}
+    count = len(names)
+    points = [[0.0] * count for _ in range(count)]      # points[i][j]: i's points against j
+    for result in results:
+        white, black = index[result['white']], index[result['black']]
+        if result['winner'] is None:
+            points[white][black] += 0.5
+            points[black][white] += 0.5
+        elif result['winner'] == result['white']:
+            points[white][black] += 1.0
+        else:
+            points[black][white] += 1.0
+    games = [[points[first][second] + points[second][first] for second in range(count)]
+             for first in range(count)]
+    for first in range(count):
+        for second in range(count):
+            if games[first][second]:
+                points[first][second] += 0.5
+                games[first][second] += 1.0
+
+    strengths = [1.0] * count
+    for _ in range(iterations):
+        change = 0.0
+        for player in range(count):
+            won = sum(points[player])
+            weight = sum(games[player][other] / (strengths[player] + strengths[other])
+                         for other in range(count) if other != player and games[player][other])
+            if weight:
+                strength = won / weight
+                change = max(change, abs(strength - strengths[player]) / strengths[player])
+                strengths[player] = strength
+        # keep the geometric mean at 1, so the ratings average 0
+        mean = math.exp(sum(math.log(strength) for strength in strengths) / count)
+        strengths = [strength / mean for strength in strengths]
+        if change < tolerance:
+            break
+
+    ratings = {}
+    for player, name in enumerate(names):
+        information = 0.0
+        for other in range(count):
+            if other != player and games[player][other]:
+                expected = strengths[player] / (strengths[player] + strengths[other])
+                information += games[player][other] * expected * (1.0 - expected)
+        elo = _ELO_PER_NAT * math.log(strengths[player])
+        if information:
+            margin = _Z95 * _ELO_PER_NAT / math.sqrt(information)
+            ratings[name] = (elo, elo - margin, elo + margin)
+        else:
+            ratings[name] = (elo, None, None)
+    return ratings
+
+
+class Tournament:
+    """
+    This class runs a round-robin tournament and keeps its results file. The file holds
+        one JSON line describing the tournament, then one JSON line per finished game and
+        per SPRT decision, so a tournament opened again on the same file skips the games
+        already played and the pairings already decided.
+    This class communicates with the following classes:
+     - KubaGame: every game is played in a worker process through KubaGame.make_move.
+     - KubaEngine: engine players search with a KubaEngine kept per worker process.
+    """
+    def __init__(self, players, results_path, games_per_pair=2, seed=0, opening_plies=2,
+                 max_plies=500, size=None, sprt=None):
+        """
+        Sets up a tournament, reading back the games of an earlier run on the same file
+        Parameters: player configurations (list of dictionaries, see check_player; at least
+            two, with distinct names), results file path, games each pair plays (number),
+            base seed, random opening plies, longest game in plies (a longer game is a
+            draw), board size of a scaled ruleset (None for the standard game), and
+            optionally SPRT parameters as a dictionary with elo0, elo1, alpha and beta
+        Returns: N/A
+        """
+        self._players = [check_player(config) for config in players]
+        names = [config['name'] for config in self._players]
+        if len(names) < 2 or len(set(names)) != len(names):
+            raise ValueError("a tournament needs at least two players with distinct names")
+        self._names = names
+        self._path = results_path
+        self._sprt = None
+        if sprt is not None:
+            self._sprt = {'elo0': sprt['elo0'], 'elo1': sprt['elo1'],
+                          'alpha': sprt.get('alpha', 0.05), 'beta': sprt.get('beta', 0.05)}
+        # the settings as they read back from the results file
+        self._settings = json.loads(json.dumps({
+            'players': self._players, 'games_per_pair': games_per_pair, 'seed': seed,
+            'opening_plies': opening_plies, 'max_plies': max_plies, 'size': size,
+            'sprt': self._sprt}))
+        self._games = schedule(len(self._players), games_per_pair)
+        self._results = {}
+        # (first name, second name) -> [wins, draws, losses] of the first, names in
+        #  player order
+        self._records = {(names[first], names[second]): [0, 0, 0]
+                         for first in range(len(names)) for second in range(first + 1, len(names))}
+        # (first name, second name) -> SPRT decision line, kept from the moment the
+        #  log-likelihood ratio first crosses a bound
+        self._decisions = {}
+        self._load()
+
+    def _add_result(self, result):
+        """
+        Adds a finished game to the results and its pairing's record
+        """
+        self._results[result['game']] = result
+        first, second = self._pair(result)
+        record = self._records[(first, second)]
+        if result['winner'] is None:
+            record[1] += 1
+        elif result['winner'] == first:
+            record[0] += 1
+        else:
+            record[2] += 1
+
+    def _pair(self, result):
+        """returns the (first name, second name) pairing of a game, names in player order"""
+        if self._names.index(result['white']) < self._names.index(result['black']):
+            return result['white'], result['black']
+        return result['black'], result['white']
+
+    def _decide(self, first, second):
+        """
+        Checks an undecided pairing against the SPRT bounds
+        Returns: the new decision line, or None if the pairing stays undecided
+        """
+        if self._sprt is None or (first, second) in self._decisions:
+            return None
+        llr, decision = self.sprt_status(first, second)
+        if decision is None:
+            return None
+        line = {'sprt': {'players': [first, second], 'decision': decision, 'llr': llr,
+                         'games': sum(self._records[(first, second)])}}
+        self._decisions[(first, second)] = line
+        return line
+
+    def _load(self):
+        """
+        Reads the games and SPRT decisions already in the results file. A last line cut
+            short by an interrupted write is dropped, so the next line is appended after
+            the last complete one.
+        """
+        if not os.path.exists(self._path) or os.path.getsize(self._path) == 0:
+            with open(self._path, 'w') as results_file:
+                results_file.write(json.dumps({'tournament': self._settings}) + '\n')
+            return
+        with open(self._path, 'rb+') as results_file:
+            lines = results_file.read().split(b'\n')
+            if lines[-1]:
+                # the last line has no newline: it was cut short. Truncating doesn't move
+                #  the file position, so seek back to the new end before writing to it.
+                length = sum(len(line) + 1 for line in lines[:-1])
+                results_file.truncate(length)
+                results_file.seek(length)
+                if length == 0:
+                    results_file.write(json.dumps({'tournament': self._settings}).encode()
+                                       + b'\n')
+                    return
+            header = json.loads(lines[0])
+            if header.get('tournament') != self._settings:
+                raise ValueError("%s holds the results of a different tournament" % self._path)
+            for line in lines[1:-1]:
+                entry = json.loads(line)
+                if 'sprt' in entry:
+                    self._decisions[tuple(entry['sprt']['players'])] = entry
+                else:
+                    self._add_result(entry)
+            # a run stopped between a game and the decision it led to decides it now
+            for first, second in self._records:
+                line = self._decide(first, second)
+                if line is not None:
+                    results_file.write(json.dumps(line).encode() + b'\n')
+
+    def get_results(self):
+        """returns the finished games' result dictionaries, in game number order"""
+        return [self._results[number] for number in sorted(self._results)]
+
+    def pair_record(self, first, second):
+        """
+        Returns a pairing's result so far
+        Parameters: the two player names (strings)
+        Returns: (wins, draws, losses) of the first player against the second
+        """
+        record = self._records.get((first, second))
+        if record is not None:
+            return tuple(record)
+        wins, draws, losses = self._records[(second, first)]
+        return losses, draws, wins
+
+    def sprt_status(self, first, second):
+        """
+        Returns a pairing's SPRT state
+        Parameters: the two player names (strings)
+        Returns: (log-likelihood ratio of every game so far, 'H0' if elo0 was accepted,
+            'H1' if elo1 was accepted or None while undecided), or None without SPRT.
+            A decision stands once made: games that were already being played when it
+            was made still count towards the ratio, but don't reopen the pairing.
+        """
+        if self._sprt is None:
+            return None
+        wins, draws, losses = self.pair_record(first, second)
+        if wins + draws + losses == 0:
+            return 0.0, None
+        llr = sprt_llr(wins, draws, losses, self._sprt['elo0'], self._sprt['elo1'])
+        line = self._decisions.get((first, second)) or self._decisions.get((second, first))
+        if line is not None:
+            return llr, line['sprt']['decision']
+        lower, upper = sprt_bounds(self._sprt['alpha'], self._sprt['beta'])
+        if llr <= lower:
+            return llr, 'H0'
+        if llr >= upper:
+            return llr, 'H1'
+        return llr, None
+
+    def _decided(self, white, black):
+        """returns True if SPRT has stopped the pairing of two player indexes"""
+        first, second = sorted((white, black))
+        return (self._names[first], self._names[second]) in self._decisions
+
+    def _jobs(self):
+        """
+        Yields the jobs of the games still to play, skipping pairings SPRT has decided
+            (checked as each job is handed out)
+        """
+        for number, white, black, opening in self._games:
+            if number in self._results or self._decided(white, black):
+                continue
+            yield (number, self._players[white], self._players[black],
+                   self._settings['seed'] + opening,
+                   self._settings['opening_plies'], self._settings['max_plies'],
+                   self._settings['size'])
+
+    def run(self, processes=None, report=None):
+        """
+        Plays the remaining games on a process pool, appending each result to the results
+            file as it arrives. Only a few games per worker are handed out at a time, so
+            a pairing stopped by SPRT wastes at most those games.
+        Parameters: number of worker processes (all cores by default), optional stream to
+            print progress to
+        Returns: summary dictionary (see summary)
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        start = time.perf_counter()
+        played = 0
+        finished = queue.Queue()
+        jobs = self._jobs()
+        with open(self._path, 'a') as results_file, multiprocessing.Pool(processes) as pool:
+            running = 0
+            for job in jobs:
+                pool.apply_async(play_game, (job,), callback=finished.put,
+                                 error_callback=finished.put)
+                running += 1
+                if running == 2 * processes:
+                    break
+            while running:
+                result = finished.get()
+                running -= 1
+                if isinstance(result, BaseException):
+                    raise result
+                self._add_result(result)
+                results_file.write(json.dumps(result) + '\n')
+                decision = self._decide(*self._pair(result))
+                if decision is not None:
+                    results_file.write(json.dumps(decision) + '\n')
+                results_file.flush()
+                played += 1
+                if report is not None:
+                    report.write("%d/%d games, %.1f games/sec\n" % (
+                        len(self._results), len(self._games),
+                        played / (time.perf_counter() - start)))
+                job = next(jobs, None)
+                if job is not None:
+                    pool.apply_async(play_game, (job,), callback=finished.put,
+                                     error_callback=finished.put)
+                    running += 1
+        return self.summary()
+
+    def summary(self):
+        """
+        Summarizes the results so far
+        Parameters: N/A
+        Returns: dictionary with 'games' (finished and scheduled), 'ratings' (name ->
+            Elo, 95% interval, games and score fraction, best first) and 'pairs' (one entry
+            per pairing: players, wins/draws/losses of the first, Elo difference with its
+            95% interval, and the SPRT log-likelihood ratio and decision when enabled)
+        """
+        results = self.get_results()
+        ratings = fit_ratings(self._names, results)
+        table = []
+        for name in self._names:
+            games = score = 0.0
+            for result in results:
+                if name in (result['white'], result['black']):
+                    games += 1
+                    score += 0.5 if result['winner'] is None else float(result['winner'] == name)
+            elo, lower, upper = ratings[name]
+            table.append({'name': name, 'elo': elo, 'interval': [lower, upper],
+                          'games': int(games), 'score': score / games if games else None})
+        table.sort(key=lambda entry: -entry['elo'])
+
+        pairs = []
+        for first in range(len(self._names)):
+            for second in range(first + 1, len(self._names)):
+                names = (self._names[first], self._names[second])
+                wins, draws, losses = self.pair_record(*names)
+                elo, lower, upper = match_elo(wins, draws, losses)
+                entry = {'players': list(names), 'wins': wins, 'draws': draws,
+                         'losses': losses, 'elo': elo, 'interval': [lower, upper]}
+                status = self.sprt_status(*names)
+                if status is not None:
+                    entry['llr'], entry['sprt'] = status
+                pairs.append(entry)
+        return {'games': {'finished': len(results), 'scheduled': len(self._games)},
+                'ratings': table, 'pairs': pairs}
+
+
+def _format_elo(value):
+    """returns an Elo value as text"""
+    if value is None:
+        return '?'
+    if math.isinf(value):
+        return '+inf' if value > 0 else '-inf'
+    return '%+.0f' % value
+
+
+def main(argv=None):
+    """
+    Command line entry point for round-robin tournaments
+    """
+    parser = argparse.ArgumentParser(description="Play a Kuba round-robin tournament")
+    parser.add_argument('players', nargs='*',
+                        help="player as NAME=POLICY[,OPTION=VALUE...], e.g. "
+                             "deep=engine,depth=4,eval=mobility")
+    parser.add_argument('--config', default=None,
+                        help="JSON file with a list of player configurations")
+    parser.add_argument('--out', default='tournament.jsonl',
+                        help="results file (JSON lines); an existing file is resumed")
+    parser.add_argument('--games', type=int, default=2, help="games per pair of players")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--opening-plies', type=int, default=2,
+                        help="random moves at the start of each game")
+    parser.add_argument('--max-plies', type=int, default=500)
+    parser.add_argument('--size', type=int, default=None,
+                        help="play the standard layout scaled to this board size")
+    parser.add_argument('--sprt', type=float, nargs=2, metavar=('ELO0', 'ELO1'), default=None,
+                        help="stop a pairing once SPRT accepts elo0 or elo1")
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    players = [parse_player(spec) for spec in args.players]
+    if args.config:
+        with open(args.config) as config_file:
+            players += json.load(config_file)
+    sprt = None
+    if args.sprt is not None:
+        sprt = {'elo0': args.sprt[0], 'elo1': args.sprt[1], 'alpha': args.alpha,
+                'beta': args.beta}
+    tournament = Tournament(players, args.out, args.games, args.seed, args.opening_plies,
+                            args.max_plies, args.size, sprt)
+    summary = tournament.run(args.processes, report=sys.stderr)
+
+    print("%d/%d games" % (summary['games']['finished'], summary['games']['scheduled']))
+    for entry in summary['ratings']:
+        lower, upper = entry['interval']
+        print("%-20s %6s  [%s, %s]  %d games" % (entry['name'], _format_elo(entry['elo']),
+                                                 _format_elo(lower), _format_elo(upper),
+                                                 entry['games']))
+    for entry in summary['pairs']:
+        line = "%s vs %s: +%d =%d -%d, Elo %s [%s, %s]" % (
+            entry['players'][0], entry['players'][1], entry['wins'], entry['draws'],
+            entry['losses'], _format_elo(entry['elo']), _format_elo(entry['interval'][0]),
+            _format_elo(entry['interval'][1]))
+        if 'llr' in entry:
+            line += ", LLR %.2f %s" % (entry['llr'], entry['sprt'] or 'undecided')
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
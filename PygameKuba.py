@@ -3,11 +3,12 @@
 ################################################################################
 # Imports ######################################################################
 ################################################################################
-import pygame, sys, math
+import pygame, sys, math, argparse, time, copy, threading
 
 from pygame.locals import *
 
 from KubaGame import KubaGame
+from KubaEngine import KubaEngine
 
 ################################################################################
 # Kuba Game Setup ##############################################################
@@ -16,6 +17,18 @@ from KubaGame import KubaGame
 # initialize the board to starting position
 game = KubaGame(('White', 'W'), ('Black', 'B'))
 
+# optionally let the computer play one side (e.g. python PygameKuba.py --computer Black)
+parser = argparse.ArgumentParser(description="Kuba Board Game")
+parser.add_argument('--computer', choices=['White', 'Black'], default=None,
+                    help="the player the computer engine plays")
+parser.add_argument('--think-ms', type=int, default=1000,
+                    help="time the computer may think per move, in milliseconds")
+parser.add_argument('--ponder', action='store_true',
+                    help="let the computer think during the human's turn")
+args = parser.parse_args()
+computer_player = args.computer
+engine = KubaEngine()
+
 ################################################################################
 # Board Setup #################################################################
 ################################################################################
@@ -44,131 +57,290 @@ dark_green = (0, 150, 0)
 
 # create the board object
 board = pygame.display.set_mode((BOARD_WIDTH, BOARD_HEIGHT))
+pygame.display.set_caption("Kuba Board Game")  # set window title
+
+# mouse motion never changes what is drawn, so don't queue events for it
+pygame.event.set_blocked(MOUSEMOTION)
+
+# the game loop runs at most this many frames per second
+FPS = 60
+clock = pygame.time.Clock()
+
+# the background search posts its move back to the game loop with this event
+COMPUTER_MOVE = pygame.USEREVENT + 1
 
 # create marble selector
 marble_select = False
 select_color = None
-marble_color = None
-select_pos = (0, 0)
 
 marble_index = None
 direction = None
 
-
 ################################################################################
-# Game Loop ####################################################################
+# Cached Drawing ###############################################################
 ################################################################################
-running = True
-while running:
-    # since the game will be a series of events, this syntax will help empty the events'
-    #  queue before adding a new one
-    for event in pygame.event.get():
-
-        # fill the background with a color
-        board.fill(grey)
-
-        # start editing the output window
-        pygame.display.set_caption("Kuba Board Game")  # set window title
 
-        # ------------ game info section ------------------------
-        # add a white line to separate board game from info section
-        pygame.draw.rect(board, dark_green, pygame.Rect(0, 9*tile_spacing + 7*2*tile_radius, BOARD_WIDTH, tile_spacing*4))
-
-        # display current turn
-        myfont = pygame.font.SysFont("Comic Sans MS", int((tile_radius + tile_spacing)/1.5))
-
-        turn_label = myfont.render('Current Turn: ' + str(game.get_current_turn()), 1, black)
+# fonts are created once instead of on every redraw
+label_font = pygame.font.SysFont("Comic Sans MS", int((tile_radius + tile_spacing)/1.5))
+win_font = pygame.font.SysFont("Comic Sans MS", int((tile_radius + tile_spacing)*2))
+
+# pre-render one sprite per tile state (the grey background is part of the sprite,
+#  so blitting a sprite also erases whatever was drawn in that tile before)
+marble_sprites = {}
+for tile, tile_color in (('W', white), ('B', black), ('R', red), ('X', None)):
+    sprite = pygame.Surface((2 * tile_radius, 2 * tile_radius))
+    sprite.fill(grey)
+    if tile_color is not None:
+        pygame.draw.circle(sprite, tile_color, (tile_radius, tile_radius), tile_radius)
+    marble_sprites[tile] = sprite
+
+# the info section below the board, redrawn only when a label changes
+INFO_TOP = 9*tile_spacing + 7*2*tile_radius
+info_rect = pygame.Rect(0, INFO_TOP, BOARD_WIDTH, BOARD_HEIGHT - INFO_TOP)
+winner_rect = pygame.Rect(tile_spacing * 2,
+                          7 * tile_radius + 4 * tile_spacing,
+                          BOARD_WIDTH - 4 * tile_spacing,
+                          tile_spacing * 4 + tile_radius * 2)
+
+# what is currently on screen, so only the differences are redrawn
+drawn_tiles = [[None] * 7 for _ in range(7)]
+drawn_labels = None
+drawn_select = None
+drawn_winner = False
+label_surfaces = {}
+
+
+def tile_center(row, col):
+    """returns the pixel center of the tile at the given board row and col (0-6)"""
+    return (tile_radius + tile_spacing + col * (2 * tile_radius + tile_spacing),
+            tile_radius + tile_spacing + row * (2 * tile_radius + tile_spacing))
+
+
+def tile_rect(row, col):
+    """returns the pixel rectangle of the tile at the given board row and col (0-6)"""
+    x_pos, y_pos = tile_center(row, col)
+    return pygame.Rect(x_pos - tile_radius, y_pos - tile_radius, 2 * tile_radius, 2 * tile_radius)
+
+
+def render_label(text):
+    """returns the rendered surface for a label, rendering each distinct text only once"""
+    if text not in label_surfaces:
+        label_surfaces[text] = label_font.render(text, 1, black)
+    return label_surfaces[text]
+
+
+def render():
+    """
+    Redraws only what changed since the last call: the tiles whose marble changed,
+        the selection highlight, the info labels and the winner overlay.
+    Returns the list of changed rectangles (empty if nothing changed).
+    """
+    global drawn_labels, drawn_select, drawn_winner
+    dirty = []
+
+    # marbles: blit the cached sprite of every tile that changed
+    if not drawn_winner:
+        tiles = game.get_board()
+        for row in range(7):
+            for col in range(7):
+                tile = tiles[row + 1][col + 1]
+                if drawn_tiles[row][col] != tile:
+                    drawn_tiles[row][col] = tile
+                    board.blit(marble_sprites[tile], tile_rect(row, col))
+                    dirty.append(tile_rect(row, col))
+
+        # selection highlight: erase the old ring and draw the new one (also when the
+        #  selected tile was just redrawn, which erased its ring)
+        select = (marble_index, select_color) if marble_select else None
+        if select != drawn_select or (select is not None and tile_rect(*select[0]) in dirty):
+            if drawn_select is not None:
+                old_row, old_col = drawn_select[0]
+                board.blit(marble_sprites[drawn_tiles[old_row][old_col]], tile_rect(old_row, old_col))
+                dirty.append(tile_rect(old_row, old_col))
+            if select is not None:
+                pygame.draw.circle(board, select_color, tile_center(*marble_index), tile_radius, 5)
+                dirty.append(tile_rect(*marble_index))
+            drawn_select = select
+
+    # ------------ game info section ------------------------
+    labels = (game.get_current_turn(), game.get_captured('White'),
+              game.get_captured('Black'), game.get_winner())
+    if labels != drawn_labels:
+        drawn_labels = labels
+        board.fill(grey, info_rect)
+        # add a dark green line to separate board game from info section
+        pygame.draw.rect(board, dark_green, pygame.Rect(0, INFO_TOP, BOARD_WIDTH, tile_spacing*4))
+
+        turn_label = render_label('Current Turn: ' + str(labels[0]))
         board.blit(turn_label, (tile_spacing, 13*tile_spacing + 7*2*tile_radius))
 
-        white_label = myfont.render('Reds captured by white: ' + str(game.get_captured('White')), 1, black)
+        white_label = render_label('Reds captured by white: ' + str(labels[1]))
         board.blit(white_label, (tile_spacing, 23 * tile_spacing + 7 * 2 * tile_radius))
 
-        black_label = myfont.render('Reds captured by black: ' + str(game.get_captured('Black')), 1, black)
+        black_label = render_label('Reds captured by black: ' + str(labels[2]))
         board.blit(black_label, (tile_spacing, 33 * tile_spacing + 7 * 2 * tile_radius))
 
-        winner_label = myfont.render('Winner: ' + str(game.get_winner()), 1, black)
+        winner_label = render_label('Winner: ' + str(labels[3]))
         board.blit(winner_label, (tile_spacing, 43 * tile_spacing + 7 * 2 * tile_radius))
-        # -----------------------------------
+        dirty.append(info_rect)
+    # -----------------------------------
+
+    if game.get_winner() is not None and not drawn_winner:
+        drawn_winner = True
+        # show a giant winner's rectangle
+        pygame.draw.rect(board, white, winner_rect)
+        winner_overlay = win_font.render(str(game.get_winner()) + ' wins!!', 1, dark_green)
+        board.blit(winner_overlay, (tile_radius + tile_spacing, 6.5 * tile_radius + 5 * tile_spacing))
+        dirty.append(winner_rect)
+
+    return dirty
+
+
+def show_frame():
+    """
+    Renders the changes and pushes only the changed rectangles to the screen.
+        The render time and frame rate are shown in the window title.
+    """
+    frame_start = time.perf_counter()
+    dirty = render()
+    if dirty:
+        pygame.display.update(dirty)
+        frame_ms = (time.perf_counter() - frame_start) * 1000
+        pygame.display.set_caption("Kuba Board Game (frame: %.1f ms, %.0f fps)"
+                                   % (frame_ms, clock.get_fps()))
+
+
+def reset_drawing():
+    """forgets what is on screen, so the next frame redraws the whole window"""
+    global drawn_labels, drawn_select, drawn_winner
+    for row in drawn_tiles:
+        row[:] = [None] * 7
+    drawn_labels = None
+    drawn_select = None
+    drawn_winner = False
+    board.fill(grey)
+    pygame.display.flip()
+
 
-        # display all marbles on the board
-        x_counter = tile_radius + tile_spacing
-        y_counter = tile_radius + tile_spacing
-        for row in game.get_board()[1:8]:
-            for tile in row[1:8]:
-                if x_counter > (7 * tile_spacing) + ((6 * 2 + 1) * tile_radius):
-                    x_counter = tile_radius + tile_spacing
+################################################################################
+# Background Computer Player ###################################################
+################################################################################
 
-                if tile == 'W':
-                    pygame.draw.circle(board, white, (x_counter, y_counter), tile_radius)
+# the running search: its thread, the event that stops it, and whether it is only
+#  pondering (thinking during the human's turn to fill the engine's table)
+search_thread = None
+search_stop = None
+search_pondering = False
+
+
+def start_search(player_name, pondering=False):
+    """
+    Starts the engine on a background thread. The engine searches a copy of the game,
+        so the game loop can keep drawing and handling input. A real search posts
+        its move back to the game loop as a COMPUTER_MOVE event.
+    """
+    global search_thread, search_stop, search_pondering
+    stop_event = threading.Event()
+    position = copy.deepcopy(game)
+    # pondering runs until it is cancelled by the human's move
+    time_ms = 3600 * 1000 if pondering else args.think_ms
+
+    def think():
+        result = engine.search(position, player_name, time_ms=time_ms, stop_event=stop_event)
+        if not pondering and not stop_event.is_set():
+            pygame.event.post(pygame.event.Event(COMPUTER_MOVE, player=player_name,
+                                                 move=result.move, stop_event=stop_event))
+
+    search_thread = threading.Thread(target=think, daemon=True)
+    search_stop = stop_event
+    search_pondering = pondering
+    search_thread.start()
+
+
+def cancel_search():
+    """Stops the background search (if any) and drops any move it already posted"""
+    global search_thread, search_stop
+    if search_thread is not None:
+        search_stop.set()
+        search_thread.join()
+        search_thread = None
+        search_stop = None
 
-                if tile == 'R':
-                    pygame.draw.circle(board, red, (x_counter, y_counter), tile_radius)
 
-                if tile == 'B':
-                    pygame.draw.circle(board, black, (x_counter, y_counter), tile_radius)
+################################################################################
+# Game Loop ####################################################################
+################################################################################
 
-                # move across the board to the right for every tile
-                #  until it reaches 660, then reset to 0
-                x_counter += 2 * tile_radius + tile_spacing
+# draw the whole window once, then only the changes
+board.fill(grey)
+show_frame()
+pygame.display.flip()
 
-            # move down the board row by row until y_counter reaches 600 then stop
-            y_counter += 2 * tile_radius + tile_spacing
+running = True
+while running:
+    # handle every event that is waiting without blocking, so the window keeps drawing
+    for event in pygame.event.get():
 
-        # display the marble selector highlight:
-        if marble_select:
-            if marble_color == black:
-                select_color = yellow
-            if marble_color == white:
-                select_color = blue
-            pygame.draw.circle(board, select_color, select_pos, tile_radius, 5)
+        # the background search finished: play its move (unless it was cancelled)
+        if event.type == COMPUTER_MOVE:
+            if event.stop_event is search_stop:
+                search_thread = None
+                search_stop = None
+                if event.move is None:
+                    # a player with no legal moves loses
+                    game.set_winner(game.get_other_player(event.player).get_name())
+                else:
+                    game.make_move(event.player, event.move[0], event.move[1])
 
         # let the user select a marble (currently allows left click, right click, scroll)
-        if event.type == MOUSEBUTTONDOWN:
+        elif event.type == MOUSEBUTTONDOWN:
             # store mouse click coordinates
-            mx, my = pygame.mouse.get_pos()
+            mx, my = event.pos
 
-            for row in range(tile_radius + tile_spacing,
-                             (8 * tile_spacing) + (7 * 2 * tile_radius),
-                             2 * tile_radius + tile_spacing):
-                for col in range(tile_radius + tile_spacing,
-                             (8 * tile_spacing) + (7 * 2 * tile_radius),
-                            2 * tile_radius + tile_spacing):
-                    x_pos = row
-                    y_pos = col
+            for row in range(7):
+                for col in range(7):
+                    x_pos, y_pos = tile_center(row, col)
 
                     mx_sq = (mx - x_pos) ** 2
                     my_sq = (my - y_pos) ** 2
+                    if math.sqrt(mx_sq + my_sq) > tile_radius:
+                        continue
 
-                    # if the user clicks on a valid marble position and there is a white marble in it
-                    if math.sqrt(mx_sq + my_sq) <= tile_radius\
-                            and board.get_at((mx, my)) == white\
-                            and game.get_current_turn() != 'Black':
-                        # update the marble index
-                        marble_index = (int((y_pos - (tile_radius + tile_spacing)) / (2 * tile_radius + tile_spacing)),
-                                        int((x_pos - (tile_radius + tile_spacing)) / (2 * tile_radius + tile_spacing)))
+                    # if the user clicks on a white marble and it is white's turn
+                    if game.get_marble((row, col)) == 'W' and game.get_current_turn() != 'Black':
+                        marble_index = (row, col)
                         marble_select = True
-                        marble_color = white
-                        select_pos = (x_pos, y_pos)
-
-
-                    # if the user clicks on a valid marble position
-                    #  and there is a black marble in it
-                    #  and it is their turn
-                    elif math.sqrt(mx_sq + my_sq) <= tile_radius\
-                            and board.get_at((mx, my)) == black\
-                            and game.get_current_turn() != 'White':
-                        # update the marble index
-                        marble_index = (int((y_pos - (tile_radius + tile_spacing)) / (2 * tile_radius + tile_spacing)),
-                                        int((x_pos - (tile_radius + tile_spacing)) / (2 * tile_radius + tile_spacing)))
+                        select_color = blue
+
+                    # if the user clicks on a black marble and it is black's turn
+                    elif game.get_marble((row, col)) == 'B' and game.get_current_turn() != 'White':
+                        marble_index = (row, col)
                         marble_select = True
-                        marble_color = black
-                        select_pos = (x_pos, y_pos)
+                        select_color = yellow
 
         # did the user hit a key?
         elif event.type == KEYDOWN:
             # if the user presses escape, stop the loop
             if event.key == K_ESCAPE:
                 running = False
+            # N starts a new game, cancelling any search
+            elif event.key == K_n:
+                cancel_search()
+                game = KubaGame(('White', 'W'), ('Black', 'B'))
+                computer_player = args.computer
+                engine.clear()
+                marble_select = False
+                marble_index = None
+                reset_drawing()
+                continue
+            # G gives up: the human (or, with two humans, the player to move) resigns
+            elif event.key == K_g and game.get_winner() is None:
+                cancel_search()
+                if computer_player is not None:
+                    game.set_winner(computer_player)
+                elif game.get_current_turn() is not None:
+                    game.set_winner(game.get_other_player(game.get_current_turn()).get_name())
+                continue
             # accept keyboard input for marble direction (arrow keys only)
             elif event.key == K_UP:
                 direction = 'F'
@@ -179,32 +351,33 @@ while running:
             elif event.key == K_RIGHT:
                 direction = 'R'
 
-            # attempt to make a move
-            if game.make_move('Black', marble_index, direction):
-                marble_select = False              # erase the selection circle
-            if game.make_move('White', marble_index, direction):
-                marble_select = False              # erase the selection circle
-
+            # attempt to make a move (the computer's marbles can't be moved by hand)
+            if marble_index is not None:
+                if computer_player != 'Black' and game.make_move('Black', marble_index, direction):
+                    marble_select = False              # erase the selection circle
+                if computer_player != 'White' and game.make_move('White', marble_index, direction):
+                    marble_select = False              # erase the selection circle
 
         elif event.type == pygame.QUIT:
             running = False
 
-        if game.get_winner() is not None:
-            marble_select = False
-            # show a giant winner's rectangle
-            pygame.draw.rect(board, white,
-                             pygame.Rect(tile_spacing * 2,
-                                         7 * tile_radius + 4 * tile_spacing,
-                                         BOARD_WIDTH - 4 * tile_spacing,
-                                         tile_spacing * 4 + tile_radius * 2))
-            win_font = pygame.font.SysFont("Comic Sans MS", int((tile_radius + tile_spacing)*2))
-
-            winner_overlay = win_font.render(str(game.get_winner()) + ' wins!!', 1, dark_green)
-            board.blit(winner_overlay, (tile_radius + tile_spacing, 6.5 * tile_radius + 5 * tile_spacing))
-
-
-            #pygame.time.wait(5000)
-            #running = False
-
-        # call to update output board
-        pygame.display.flip()
+    if game.get_winner() is not None:
+        marble_select = False
+        cancel_search()
+
+    # start the computer thinking once it is its turn; while the human is to move,
+    #  optionally ponder in the background
+    elif computer_player is not None:
+        computer_turn = game.get_current_turn() == computer_player
+        if computer_turn and (search_thread is None or search_pondering):
+            cancel_search()
+            start_search(computer_player)
+        elif not computer_turn and args.ponder and search_thread is None \
+                and game.get_current_turn() is not None:
+            start_search(game.get_current_turn(), pondering=True)
+
+    # call to update the changed parts of the output board, then wait for the next frame
+    show_frame()
+    clock.tick(FPS)
+
+cancel_search()